@@ -1,8 +1,10 @@
 #!/usr/bin/env python3
 
+from concurrent.futures import Future
 from datetime import datetime
 
 from meshbot.meshwrapper import Node, Nodelist, Message
+from meshbot.meshwrapper.transmitter import sent
 from meshbot.chatbot import Chatbot
 
 
@@ -24,9 +26,27 @@ for module in [
     exec(f"register_{module}(bot)")
 
 
-def output(response: str) -> bool:
+def output(response: str) -> Future:
     print(response)
-    return True
+    return sent(True)
+
+
+class User(Node):
+    """The node on the other side of the conversation, which is the terminal"""
+
+    __slots__ = ()
+
+    def send(self, message: str, **kwargs) -> Future:
+        return output(message)
+
+
+class Bot(Node):
+    """The node that the bot is running on"""
+
+    __slots__ = ()
+
+    def is_self(self):
+        return True
 
 
 print(bot)
@@ -35,7 +55,7 @@ print(bot)
 # Create fake domain model
 
 
-fromNode = Node()
+fromNode = User()
 fromNode.num = 1
 fromNode.id = "!00000001"
 fromNode.shortName = "USER"
@@ -43,14 +63,12 @@ fromNode.longName = "User"
 fromNode.snr = 5.0
 fromNode.rssi = -80
 fromNode.hopsAway = 0
-fromNode.send = output
 fromNode.lastHeard = datetime.timestamp(datetime.now())
 fromNode.position = [49.911, 9.210]
 
-toNode = Node()
+toNode = Bot()
 toNode.num = 2
 toNode.id = "!00000002"
-toNode.is_self = lambda: True
 toNode.shortName = "MBOT"
 toNode.longName = "Meshbot"
 toNode.snr = 6.0
@@ -71,7 +89,6 @@ while True:
         message = Message()
         message.text = input(">>> ")
         message.type = "TEXT_MESSAGE_APP"
-        message.reply = output
         message.fromNode = fromNode
         message.toNode = toNode
         message.nodelist = nodelist
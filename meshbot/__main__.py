@@ -1,23 +1,18 @@
 import sys
-import os
 import time
 import threading
 import logging
-from dotenv import dotenv_values
 
 from .meshwrapper import MeshtasticClient, Message, MeshtasticConnectionLost
+from .meshwrapper.transmitter import transmitter
 from .chatbot import Chatbot
+from .executor import Executor
+from .weather import prewarm_cache
+from .config import config
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("Meshbot")
 
-config = {
-    **dotenv_values(".env"),
-    **dotenv_values("production.env"),
-    **dotenv_values("development.env"),
-    **os.environ,
-}
-
 
 # Create a bot and register the desired modules with it
 
@@ -32,6 +27,23 @@ for module in [
     exec(f"from meshbot.{module} import register as register_{module}")
     exec(f"register_{module}(bot)")
 
+# Run the handlers on a pool of worker threads, so slow handlers don't stop us
+# from receiving packets
+
+executor = Executor(
+    bot.handle,
+    workers=int(config.get("HANDLER_WORKERS", 4)),
+    max_queued=int(config.get("HANDLER_QUEUE_SIZE", 100)),
+)
+
+
+# Don't transmit more than the duty cycle allows in our region
+
+transmitter.limit(
+    duty_cycle=float(config.get("TRANSMIT_DUTY_CYCLE", 100)) / 100,
+    burst=float(config.get("TRANSMIT_BURST", 30)),
+)
+
 
 # Define event handlers
 
@@ -43,7 +55,7 @@ def connectionHandler(meshtasticClient: MeshtasticClient):
 
 def messageHandler(message: Message):
     logger.info(message)  # So we can actually see messages coming in on the terminal
-    bot.handle(message)
+    executor.submit(message)
 
 
 # Start the connection to the Meshtastic node
@@ -75,7 +87,7 @@ else:
     raise Exception(f"Unknown transport: {config['TRANSPORT']}")
 
 
-# Output the node list every half hour
+# Output the node list and handler statistics every half hour
 
 
 class setInterval:
@@ -96,7 +108,22 @@ class setInterval:
         self.stopEvent.set()
 
 
-interval = setInterval(30 * 60, lambda: logger.info(meshtasticClient.nodelist()))
+def logStatus():
+    logger.info(meshtasticClient.nodelist())
+    logger.info(executor)
+
+
+interval = setInterval(30 * 60, logStatus)
+
+
+# Keep the weather cache warm for active nodes, if so configured
+
+prewarmInterval = float(config.get("WEATHER_PREWARM_INTERVAL", 0))
+if prewarmInterval > 0:
+    prewarm = setInterval(
+        prewarmInterval,
+        lambda: prewarm_cache(meshtasticClient.nodelist(), prewarmInterval),
+    )
 
 
 # Keep the connection open until the user presses Ctrl+C or the device
@@ -114,3 +141,5 @@ except MeshtasticConnectionLost:
 finally:
     logger.info("Done!")
     interval.cancel()
+    if prewarmInterval > 0:
+        prewarm.cancel()
@@ -1,3 +1,6 @@
+import threading
+import time
+from collections import OrderedDict
 from itertools import groupby
 from typing import Callable
 
@@ -29,11 +32,26 @@ class Chatbot:
     CATCH_ALL_TEXT = 1  # Get all text messages
     CATCH_ALL_EVENTS = 2  # Get all packets
 
-    def __init__(self):
+    def __init__(
+        self,
+        max_conversations: int = 1000,
+        conversation_timeout: float = 30 * 60,
+    ):
         self.states = ["MAIN"]
-        self.state = "MAIN"
         self.commands = []
 
+        # Each (node, channel) conversation has its own state. We only keep
+        # track of conversations that are not in the "MAIN" state, ordered from
+        # least to most recently active, and fall back to "MAIN" for the ones
+        # that have been idle for too long or don't fit anymore.
+        self.max_conversations = max_conversations
+        self.conversation_timeout = conversation_timeout
+        self._conversations = OrderedDict()  # key -> (state, last active)
+        self._lock = threading.Lock()
+
+        # (state, is private) -> _DispatchTable
+        self._tables = {}
+
     def add_state(self, *states):
         for state in states:
             self.states.append(state)
@@ -41,71 +59,113 @@ class Chatbot:
     def add_command(self, *commands):
         for command in commands:
             self.commands.append(command)
+            self._compile(command, len(self.commands) - 1)
+
+    def _compile(self, command: dict, index: int) -> None:
+        """
+        Add the command to the dispatch tables for the scopes it is valid in,
+        so handling a message doesn't have to look at every registered command
+        """
+        state = command.get("state", "MAIN")
+        scopes = [
+            is_private
+            for is_private in (True, False)
+            if command.get("private", True) == is_private
+            or command.get("channel", False) == (not is_private)
+        ]
+        for is_private in scopes:
+            table = self._tables.setdefault((state, is_private), _DispatchTable())
+            table.add(command, index)
+
+    @staticmethod
+    def conversation(message: Message) -> tuple:
+        """Returns the key of the conversation this message belongs to"""
+        node = message.fromNode.id if message.fromNode else None
+        return (node, message.channel)
+
+    def state(self, message: Message) -> str:
+        """Returns the state of the conversation this message belongs to"""
+        return self._state(Chatbot.conversation(message), touch=False)
+
+    def _state(self, key: tuple, touch: bool) -> str:
+        with self._lock:
+            if key not in self._conversations:
+                return "MAIN"
+            state, last_active = self._conversations[key]
+            now = time.monotonic()
+            if now - last_active > self.conversation_timeout:
+                del self._conversations[key]
+                return "MAIN"
+            if touch:
+                self._conversations[key] = (state, now)
+                self._conversations.move_to_end(key)
+            return state
+
+    def _set_state(self, key: tuple, state: str) -> None:
+        with self._lock:
+            if state == "MAIN":
+                self._conversations.pop(key, None)
+                return
+
+            now = time.monotonic()
+            self._conversations[key] = (state, now)
+            self._conversations.move_to_end(key)
+
+            # Forget idle conversations, and the least recently active ones if
+            # we have too many
+            while self._conversations:
+                oldest_key, (_, last_active) = next(iter(self._conversations.items()))
+                if (
+                    len(self._conversations) <= self.max_conversations
+                    and now - last_active <= self.conversation_timeout
+                ):
+                    break
+                del self._conversations[oldest_key]
 
     def handle(self, message: Message) -> None:
         is_text_message = message.type == "TEXT_MESSAGE_APP"
         is_private_message = message.private_message()
-        is_channel_message = not is_private_message
-
-        # Find commands that are valid in this state and are of the right type
-        relevant_commands = [
-            cmd
-            for cmd in self.commands
-            if cmd.get("state", "MAIN") is self.state
-            and (
-                cmd.get("private", True) == is_private_message
-                or cmd.get("channel", False) == is_channel_message
-            )
-        ]
+        conversation = Chatbot.conversation(message)
+        state = self._state(conversation, touch=is_text_message)
+
+        table = self._tables.get((state, is_private_message), None)
 
         # Bail early if we have no relevant commands at all
-        if len(relevant_commands) == 0:
+        if table is None:
             return
 
         # Messages that are not text messages can only be handled by
         # CATCH_ALL_EVENTS commands
         if not is_text_message:
-            catch_all_events = [
-                cmd
-                for cmd in relevant_commands
-                if self._matching(cmd, Chatbot.CATCH_ALL_EVENTS)
-            ]
-            for cmd in catch_all_events:
-                self._run_function(cmd["function"], message)
+            for cmd in table.catch_all_events:
+                self._run_function(cmd["function"], message, conversation)
             return
 
         # Messages that are text messages are evaluated specific first, catch
         # all later
-        specific = [
-            cmd for cmd in relevant_commands if self._matching(cmd, message.text)
-        ]
+        specific = table.matching(message.text)
         for cmd in specific:
-            self._run_function(cmd["function"], message)
+            self._run_function(cmd["function"], message, conversation)
 
         # Have we now handled this message?
         if len(specific) > 0:
             return
 
         # No specific command matched, try catch all
-        catch_all = [
-            cmd
-            for cmd in relevant_commands
-            if self._matching(cmd, Chatbot.CATCH_ALL_TEXT)
-            or self._matching(cmd, Chatbot.CATCH_ALL_EVENTS)
-        ]
-        for cmd in catch_all:
-            self._run_function(cmd["function"], message)
+        for cmd in table.catch_all_text:
+            self._run_function(cmd["function"], message, conversation)
         return
 
     def _run_function(
         self,
         function: Callable[[Message], str | None],
         message: Message,
+        conversation: tuple,
     ) -> None:
         assert function is not None, "Can't call a nonexistant function"
         new_state = function(message)
         if type(new_state) == str and new_state in self.states:
-            self.state = new_state
+            self._set_state(conversation, new_state)
 
     def __str__(self):
         description = "🤖👋 Hey there! I understand these commands:\n"
@@ -133,29 +193,6 @@ class Chatbot:
 
         return description
 
-    def _matching(self, command, input):
-        if "command" in command:
-            if type(command["command"]) == list:
-                return any(self._same(c, input) for c in command["command"])
-            return self._same(command["command"], input)
-
-        if "prefix" in command:
-            if type(command["prefix"]) == list:
-                return any(self._startsWith(c, input) for c in command["prefix"])
-            return self._startsWith(command["prefix"], input)
-
-        return False
-
-    def _same(self, command, input):
-        if type(command) == str and type(input) == str:
-            return command.upper().strip() == input.upper().strip()
-        return command is input
-
-    def _startsWith(self, prefix, input):
-        if type(prefix) == str and type(input) == str:
-            return input.upper().strip().startswith(prefix.upper().strip())
-        return False
-
     def _visible(self, command):
         return (
             (
@@ -165,3 +202,74 @@ class Chatbot:
             )
             or "prefix" in command
         ) and command.get("description", None) is not None
+
+
+class _DispatchTable:
+    """
+    The commands that are valid in one state and scope, compiled into a hash
+    map for exact commands and a trie for prefixes
+    """
+
+    def __init__(self):
+        self.exact = {}  # Normalized command -> [(index, command)]
+        self.prefixes = {}  # Trie of normalized prefixes, see add_prefix
+        self.catch_all_text = []
+        self.catch_all_events = []
+
+    def add(self, command: dict, index: int) -> None:
+        if "command" in command:
+            matchers = command["command"]
+            if type(matchers) != list:
+                matchers = [matchers]
+            for matcher in _unique(matchers):
+                if type(matcher) == str:
+                    key = matcher.upper().strip()
+                    self.exact.setdefault(key, []).append((index, command))
+
+            # Text messages fall through to both kinds of catch alls, in order
+            # of registration
+            if any(m is Chatbot.CATCH_ALL_EVENTS for m in matchers):
+                self.catch_all_events.append(command)
+            if any(
+                m is Chatbot.CATCH_ALL_TEXT or m is Chatbot.CATCH_ALL_EVENTS
+                for m in matchers
+            ):
+                self.catch_all_text.append(command)
+
+        elif "prefix" in command:
+            prefixes = command["prefix"]
+            if type(prefixes) != list:
+                prefixes = [prefixes]
+            for prefix in _unique(prefixes):
+                if type(prefix) == str:
+                    self.add_prefix(prefix.upper().strip(), index, command)
+
+    def add_prefix(self, prefix: str, index: int, command: dict) -> None:
+        # Each trie node is a dictionary of characters to child nodes, with the
+        # commands for the prefix that ends there stored under the None key
+        node = self.prefixes
+        for char in prefix:
+            node = node.setdefault(char, {})
+        node.setdefault(None, []).append((index, command))
+
+    def matching(self, text: str) -> list[dict]:
+        """Returns the commands matching this text, in order of registration"""
+        text = text.upper().strip()
+        matches = list(self.exact.get(text, []))
+
+        node = self.prefixes
+        matches += node.get(None, [])
+        for char in text:
+            node = node.get(char, None)
+            if node is None:
+                break
+            matches += node.get(None, [])
+
+        if len(matches) > 1:
+            # A command can match in multiple ways, but only runs once
+            matches = sorted(dict(matches).items(), key=lambda m: m[0])
+        return [command for _, command in matches]
+
+
+def _unique(items: list) -> list:
+    return [item for i, item in enumerate(items) if item not in items[:i]]
@@ -0,0 +1,13 @@
+import os
+
+from dotenv import dotenv_values
+
+# Settings from the .env files, overridden by those for the environment we run
+# in, and finally by environment variables. Loaded once and shared by all
+# modules.
+config = {
+    **dotenv_values(".env"),
+    **dotenv_values("production.env"),
+    **dotenv_values("development.env"),
+    **os.environ,
+}
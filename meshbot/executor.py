@@ -0,0 +1,127 @@
+import logging
+import threading
+import time
+from collections import deque
+from typing import Callable
+
+from .meshwrapper import Message
+from .chatbot import Chatbot
+
+logger = logging.getLogger("Meshbot")
+
+
+class Executor:
+    """
+    Runs message handlers on a bounded pool of worker threads, so a slow
+    handler doesn't hold up the thread that receives packets from the node.
+
+    Messages that belong to the same conversation are handled one at a time,
+    in the order they came in. When too many messages are waiting, submitting
+    a new one blocks for a while before the message gets dropped.
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[Message], None],
+        workers: int = 4,
+        max_queued: int = 100,
+        submit_timeout: float = 5,
+    ):
+        self.handler = handler
+        self.max_queued = max_queued
+        self.submit_timeout = submit_timeout
+
+        self._condition = threading.Condition()
+        self._queues = {}  # Conversation -> deque of Messages
+        self._ready = deque()  # Conversations with messages and no active worker
+        self._queued = 0
+
+        # Metrics
+        self._max_queued_seen = 0
+        self._handled = 0
+        self._dropped = 0
+        self._failed = 0
+        self._total_latency = 0
+        self._max_latency = 0
+
+        self._workers = [
+            threading.Thread(target=self._run, name=f"Meshbot worker {i}", daemon=True)
+            for i in range(workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, message: Message) -> bool:
+        """Queue a message to be handled. Returns False if it had to be dropped"""
+        conversation = Chatbot.conversation(message)
+        with self._condition:
+            if not self._condition.wait_for(
+                lambda: self._queued < self.max_queued, self.submit_timeout
+            ):
+                self._dropped += 1
+                logger.warning(f"Too many messages waiting, dropping: {message}")
+                return False
+
+            queue = self._queues.get(conversation, None)
+            if queue is None:
+                queue = self._queues[conversation] = deque()
+                self._ready.append(conversation)
+            queue.append(message)
+            self._queued += 1
+            self._max_queued_seen = max(self._max_queued_seen, self._queued)
+            self._condition.notify_all()
+        return True
+
+    def stats(self) -> dict:
+        with self._condition:
+            return {
+                "queued": self._queued,
+                "maxQueued": self._max_queued_seen,
+                "handled": self._handled,
+                "dropped": self._dropped,
+                "failed": self._failed,
+                "averageLatency": (
+                    self._total_latency / self._handled if self._handled else 0
+                ),
+                "maxLatency": self._max_latency,
+            }
+
+    def _run(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._ready)
+                # We now own this conversation until its queue is empty, which
+                # is what keeps its messages in order
+                conversation = self._ready.popleft()
+                message = self._queues[conversation][0]
+
+            start = time.monotonic()
+            try:
+                self.handler(message)
+                failed = False
+            except Exception:
+                logger.exception(f"Handler failed for message: {message}")
+                failed = True
+            latency = time.monotonic() - start
+
+            with self._condition:
+                queue = self._queues[conversation]
+                queue.popleft()
+                if queue:
+                    self._ready.append(conversation)
+                else:
+                    del self._queues[conversation]
+                self._queued -= 1
+                self._handled += 1
+                self._failed += failed
+                self._total_latency += latency
+                self._max_latency = max(self._max_latency, latency)
+                self._condition.notify_all()
+
+    def __str__(self):
+        stats = self.stats()
+        return (
+            f"Handler queue: {stats['queued']} waiting (max {stats['maxQueued']}), "
+            f"{stats['handled']} handled, {stats['failed']} failed, {stats['dropped']} dropped, "
+            f"latency {stats['averageLatency']:.2f}s average, {stats['maxLatency']:.2f}s max"
+        )
@@ -0,0 +1,59 @@
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .config import config
+
+
+class HttpClient:
+    """
+    Shared HTTP client for talking to outside APIs. Keeps connections alive in
+    a pool per host, so repeated requests don't pay for a new TCP and TLS
+    handshake each time, applies default timeouts and retries failed
+    connections with exponential backoff.
+    """
+
+    def __init__(
+        self,
+        connect_timeout: float = 5,
+        read_timeout: float = 30,
+        retries: int = 3,
+        backoff: float = 0.5,
+        pool_size: int = 10,
+    ):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+
+        # Only retry when we could not connect or the server is temporarily
+        # unavailable. A request that timed out while reading may have been
+        # processed already, and is probably slow because of the server.
+        retry = Retry(
+            total=retries,
+            read=0,
+            backoff_factor=backoff,
+            status_forcelist=[429, 502, 503, 504],
+            allowed_methods=None,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry
+        )
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def get(self, url: str, read_timeout: float = None, **kwargs):
+        return self.session.get(url, timeout=self._timeout(read_timeout), **kwargs)
+
+    def post(self, url: str, read_timeout: float = None, **kwargs):
+        return self.session.post(url, timeout=self._timeout(read_timeout), **kwargs)
+
+    def _timeout(self, read_timeout: float | None) -> tuple[float, float]:
+        return (self.connect_timeout, read_timeout or self.read_timeout)
+
+
+http = HttpClient(
+    connect_timeout=float(config.get("HTTP_CONNECT_TIMEOUT", 5)),
+    read_timeout=float(config.get("HTTP_READ_TIMEOUT", 30)),
+    retries=int(config.get("HTTP_RETRIES", 3)),
+)
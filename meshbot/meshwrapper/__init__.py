@@ -1,4 +1,4 @@
 from .client import MeshtasticClient, MeshtasticConnectionLost
 from .message import Message
 from .node import Node
-from .nodelist import Nodelist
+from .nodelist import Nodelist, NodelistView
@@ -0,0 +1,61 @@
+import math
+
+# Spreading factor, bandwidth in Hz and coding rate (the 5 in 4/5) per preset
+MODEM_PRESETS = {
+    "SHORT_TURBO": (7, 500_000, 5),
+    "SHORT_FAST": (7, 250_000, 5),
+    "SHORT_SLOW": (8, 250_000, 5),
+    "MEDIUM_FAST": (9, 250_000, 5),
+    "MEDIUM_SLOW": (10, 250_000, 5),
+    "LONG_TURBO": (11, 500_000, 8),
+    "LONG_FAST": (11, 250_000, 5),
+    "LONG_MODERATE": (11, 125_000, 8),
+    "LONG_SLOW": (12, 125_000, 8),
+    "VERY_LONG_SLOW": (12, 62_500, 8),
+}
+DEFAULT_PRESET = "LONG_FAST"
+
+# Meshtastic sends a longer preamble than the LoRa default of 8 symbols
+PREAMBLE_SYMBOLS = 16
+
+# Bytes Meshtastic adds to a text message: the packet header, and the fields
+# that wrap the text in the encrypted payload
+PACKET_OVERHEAD = 16 + 6
+
+
+def airtime(text_bytes: int, modem: tuple = MODEM_PRESETS[DEFAULT_PRESET]) -> float:
+    """
+    Returns the number of seconds it takes to transmit a text message of the
+    given size, using the formula from the Semtech SX127x datasheet.
+    """
+    spreading_factor, bandwidth, coding_rate = modem
+    payload = text_bytes + PACKET_OVERHEAD
+
+    symbol_time = 2**spreading_factor / bandwidth
+    low_data_rate = 1 if symbol_time > 0.016 else 0
+    payload_symbols = 8 + max(
+        math.ceil(
+            (8 * payload - 4 * spreading_factor + 28 + 16)
+            / (4 * (spreading_factor - 2 * low_data_rate))
+        )
+        * coding_rate,
+        0,
+    )
+    return (PREAMBLE_SYMBOLS + 4.25 + payload_symbols) * symbol_time
+
+
+def modem_settings(interface) -> tuple:
+    """
+    Returns the spreading factor, bandwidth and coding rate our node uses.
+    Falls back to the default preset if the node doesn't tell us.
+    """
+    try:
+        lora = interface.localNode.localConfig.lora
+        if not lora.use_preset and lora.spread_factor and lora.bandwidth:
+            # Custom settings, bandwidth is configured in kHz
+            return (lora.spread_factor, lora.bandwidth * 1000, lora.coding_rate or 5)
+        preset = lora.DESCRIPTOR.fields_by_name["modem_preset"].enum_type
+        name = preset.values_by_number[lora.modem_preset].name
+        return MODEM_PRESETS.get(name, MODEM_PRESETS[DEFAULT_PRESET])
+    except (AttributeError, KeyError):
+        return MODEM_PRESETS[DEFAULT_PRESET]
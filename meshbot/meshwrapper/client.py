@@ -6,9 +6,10 @@ import meshtastic
 import meshtastic.tcp_interface
 import meshtastic.serial_interface
 
-from .node import Node, Everyone
+from .node import Everyone
 from .nodelist import Nodelist
 from .message import Message
+from .transmitter import transmitter
 
 logger = logging.getLogger("Meshbot")
 
@@ -40,6 +41,7 @@ class MeshtasticClient:
         self.closing = False
         self._connectedCallback = connected
         self._messageCallback = message
+        self._nodelist = None
 
         if hostname:
             self._interface = meshtastic.tcp_interface.TCPInterface(hostname=hostname)
@@ -55,23 +57,34 @@ class MeshtasticClient:
         self._interface.close()
 
     def nodelist(self):
-        nodelist = Nodelist()
-        for node in self._interface.nodes.values():
-            nodelist.add(Node.from_packet(node, self._interface))
-        return nodelist
+        return self._get_nodelist(self._interface).view()
+
+    def _get_nodelist(self, interface) -> Nodelist:
+        # Built once, then kept up to date by the packets we receive
+        if self._nodelist is None:
+            self._nodelist = Nodelist.from_interface(interface)
+        return self._nodelist
 
     def _on_receive(self, packet, interface):
-        nodelist = self.nodelist()
-        fromNode = nodelist.get(packet["from"])
-        if "rxSnr" in packet:
-            fromNode.snr = packet["rxSnr"]
-        if "rxRssi" in packet:
-            fromNode.rssi = packet["rxRssi"]
+        nodelist = self._get_nodelist(interface)
+        fromNode = nodelist.on_packet(packet)
 
         message = Message.from_packet(packet)
-        message.nodelist = nodelist
+        message.nodelist = nodelist.view()
         message.fromNode = fromNode
         message.toNode = nodelist.get(packet["to"])
+
+        # Our own node and direct neighbours hear the same channel we do. The
+        # sender may be the Unknown sentinel, which has no hopsAway.
+        if message.type == "TELEMETRY_APP" and (
+            fromNode.is_self() or getattr(fromNode, "hopsAway", None) == 0
+        ):
+            utilization = message.telemetry.get("deviceMetrics", {}).get(
+                "channelUtilization", None
+            )
+            if utilization is not None:
+                transmitter.set_channel_utilization(utilization)
+
         if self._messageCallback:
             self._messageCallback(message)
 
@@ -1,59 +1,98 @@
+from concurrent.futures import Future
 from datetime import datetime
 from .node import Node, Everyone
+from .transmitter import sent
 
 
 class Message:
     """Class representing a message that was received over the LoRa mesh"""
 
+    # We create one of these for every packet we receive, so keep them small
+    # and only look at the parts of the packet that someone asks for
+    __slots__ = (
+        "id",
+        "channel",
+        "rxTime",
+        "type",
+        "text",
+        "fromNode",
+        "toNode",
+        "nodelist",
+        "_decoded",
+    )
+
     def __init__(self):
-        pass
+        self._decoded = {}
+        self.id = None
+        self.rxTime = 0
+        self.type = None
+        self.text = ""
+        self.channel = 0
+        self.fromNode = None
+        self.toNode = None
+        self.nodelist = None
 
     @staticmethod
     def from_packet(data):
         message = Message()
-        message.data = data
+        message._decoded = data.get("decoded", {})
 
         message.id = data.get("id")
         message.channel = int(data.get("channel", 0))
-        message.timestamp = datetime.fromtimestamp(data.get("rxTime", 0))
-        message.type = data.get("decoded", {}).get("portnum")
-        message.text = data.get("decoded", {}).get("text", "")
-
-        message.telemetry = data.get("decoded", {}).get("telemetry", {})
-        if "raw" in message.telemetry:
-            del message.telemetry["raw"]
-
-        position = data.get("decoded", {}).get("position", None)
-        message.position_request = data.get("decoded", {}).get("wantResponse", False)
-        if position and not message.position_request:
-            message.position = [
-                position.get("latitudeI", 0) / pow(10, 7),
-                position.get("longitudeI", 0) / pow(10, 7),
-                position.get("altitude", 0),
-            ]
-
-        message.neighborInfo = data.get("decoded", {}).get("neighborinfo", {})
-        if "raw" in message.neighborInfo:
-            del message.neighborInfo["raw"]
-
-        message.user = data.get("decoded", {}).get("user", {})
-        if "raw" in message.user:
-            del message.user["raw"]
-
-        message.routing = data.get("decoded", {}).get("routing", {})
-        if "raw" in message.routing:
-            del message.routing["raw"]
-
-        message.admin = data.get("decoded", {}).get("admin", {})
-        if "raw" in message.admin:
-            del message.admin["raw"]
-
+        message.rxTime = data.get("rxTime", 0)
+        message.type = message._decoded.get("portnum")
+        message.text = message._decoded.get("text", "")
         return message
 
+    @property
+    def timestamp(self) -> datetime:
+        return datetime.fromtimestamp(self.rxTime)
+
+    @property
+    def position_request(self) -> bool:
+        return self._decoded.get("wantResponse", False)
+
+    @property
+    def position(self) -> list | None:
+        position = self._decoded.get("position", None)
+        if not position or self.position_request:
+            return None
+        return [
+            position.get("latitudeI", 0) / pow(10, 7),
+            position.get("longitudeI", 0) / pow(10, 7),
+            position.get("altitude", 0),
+        ]
+
+    @property
+    def telemetry(self) -> dict:
+        return self._section("telemetry")
+
+    @property
+    def neighborInfo(self) -> dict:
+        return self._section("neighborinfo")
+
+    @property
+    def user(self) -> dict:
+        return self._section("user")
+
+    @property
+    def routing(self) -> dict:
+        return self._section("routing")
+
+    @property
+    def admin(self) -> dict:
+        return self._section("admin")
+
+    def _section(self, name: str) -> dict:
+        # Leave the packet itself alone, the Meshtastic library may still need
+        # the raw protobuf
+        section = self._decoded.get(name, {})
+        return {key: value for key, value in section.items() if key != "raw"}
+
     def private_message(self):
         return self.toNode != Everyone
 
-    def reply(self, message: str, **kwargs) -> bool:
+    def reply(self, message: str, **kwargs) -> Future:
         if self.toNode == Everyone:
             # This was a message in a channel, respond in the same channel
             return Everyone.send(message, channelIndex=self.channel, **kwargs)
@@ -61,10 +100,10 @@ class Message:
             # This was a direct message, respond to the right node
             return self.fromNode.send(message, channelIndex=self.channel, **kwargs)
         else:
-            return False
+            return sent(False)
 
     def __str__(self):
-        content = str(self.data)
+        content = str(self._decoded)
         match self.type:
             case "TELEMETRY_APP":
                 content = f"new telemetry: {self.telemetry}"
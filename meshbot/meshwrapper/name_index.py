@@ -0,0 +1,114 @@
+from collections import Counter
+
+from .node import Node
+
+# Scores for the different ways a name can match what the user typed. Names
+# that only share some trigrams with the needle score below SUBSTRING_MATCH.
+EXACT_MATCH = 1.0
+PREFIX_MATCH = 0.9
+SUBSTRING_MATCH = 0.8
+MIN_SIMILARITY = 0.3
+
+
+class NameIndex:
+    """
+    Trigram index over the short and long names of nodes, for finding nodes
+    when the user only types part of a name or makes a typo.
+
+    Every node gets a posting in the index for each trigram in its names, so a
+    search only has to look at nodes that have at least one trigram in common
+    with the needle, instead of comparing against every node we know.
+    """
+
+    def __init__(self):
+        self._postings = {}  # Trigram -> set of node numbers
+        self._grams = {}  # Node number -> trigrams it is indexed under
+        self._names = {}  # Node number -> (node, case-folded names)
+
+    def add(self, node: Node):
+        names = _names(node)
+        grams = set().union(*(_trigrams(name) for name in names))
+        old_grams = self._grams.get(node.num, set())
+        self._names[node.num] = (node, names)
+
+        # Change the sets in place, searches on other threads take a snapshot
+        for gram in old_grams - grams:
+            postings = self._postings[gram]
+            postings.discard(node.num)
+            if not postings:
+                del self._postings[gram]
+        for gram in grams - old_grams:
+            self._postings.setdefault(gram, set()).add(node.num)
+
+        self._grams[node.num] = grams
+
+    def search(self, needle: str, limit: int = 5) -> list[tuple[float, Node]]:
+        """
+        Returns up to `limit` (score, node) pairs for nodes with a name that
+        resembles the needle, best match first.
+        """
+        needle = needle.strip().casefold()
+        if not needle:
+            return []
+
+        grams = _trigrams(needle)
+        # Copying a set is a single step for the interpreter, so this is safe
+        # while the receiving thread adds nodes
+        postings = [tuple(self._postings.get(gram, ())) for gram in grams]
+        postings = [nums for nums in postings if nums]
+
+        # Trigrams that most nodes have in common barely help to pick the
+        # candidates, but are the most expensive to count, so skip them unless
+        # there is nothing else to go on
+        common = len(self._names) // 4
+        rare = [nums for nums in postings if len(nums) <= common]
+        counts = Counter()
+        for nums in rare or postings:
+            counts.update(nums)
+
+        # Only score the nodes that share the most trigrams with the needle
+        results = []
+        for num, _ in counts.most_common(limit * 4):
+            node, names = self._names[num]
+            score = max(_score(needle, grams, name) for name in names)
+            if score >= MIN_SIMILARITY:
+                results.append((score, node))
+
+        results.sort(key=lambda result: (-result[0], -(result[1].lastHeard or 0)))
+        return results[:limit]
+
+    def best(self, needle: str) -> Node | None:
+        """
+        Returns the node the user most likely means, but only if one node
+        contains the needle in its name and matches it better than any other.
+        """
+        results = self.search(needle, 2)
+        if not results or results[0][0] < SUBSTRING_MATCH:
+            return None
+        if len(results) > 1 and results[1][0] == results[0][0]:
+            return None
+        return results[0][1]
+
+
+def _names(node: Node) -> tuple[str, ...]:
+    return tuple(name.casefold() for name in (node.shortName, node.longName) if name)
+
+
+def _trigrams(text: str) -> set[str]:
+    # Pad the text so short names (like a single emoji) still have trigrams,
+    # and matching starts of words count for something
+    padded = f"  {text} "
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+def _score(needle: str, grams: set[str], name: str) -> float:
+    if name == needle:
+        return EXACT_MATCH
+    if name.startswith(needle):
+        return PREFIX_MATCH
+    if needle in name:
+        return SUBSTRING_MATCH
+    name_grams = _trigrams(name)
+    # Dice coefficient, scaled to stay below the substring matches
+    similarity = 2 * len(grams & name_grams) / (len(grams) + len(name_grams))
+    return similarity * SUBSTRING_MATCH * 0.99
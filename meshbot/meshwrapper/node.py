@@ -1,32 +1,41 @@
 import logging
-import textwrap
-import time
-from threading import Timer
+from concurrent.futures import Future
 
+from .signal_history import SignalHistory
+from .splitter import split_message
 from .time_helper import time_ago
+from .transmitter import transmitter, sent
 
 logger = logging.getLogger("Meshbot")
 
-# Message reply timeout delay before we give up
-MAX_REPLY_DELAY = 5
-
 # Maximum size of a message in UTF-8 bytes that we can send
 MAX_SIZE = 234
 
-# Size minus `len(" [i/n]")`.
-# Note: if we have to split into more than 9 messages, this does break.
-SHORT_SIZE = MAX_SIZE - 6
-
-wrapper = textwrap.TextWrapper(
-    width=SHORT_SIZE, replace_whitespace=False, break_long_words=True
-)
-
 
 class Node:
     """Class representing a Meshtastic node in the LoRa mesh"""
 
+    # We keep one of these for every node we've ever heard of, so don't give
+    # each of them a __dict__
+    __slots__ = (
+        "interface",
+        "num",
+        "id",
+        "mac",
+        "hardware",
+        "role",
+        "shortName",
+        "longName",
+        "position",
+        "lastHeard",
+        "hopsAway",
+        "snr",
+        "rssi",
+        "signal",
+    )
+
     def __init__(self):
-        self.transmission = {"sending": None, "last_result": False, "timeout": None}
+        pass
 
     @staticmethod
     def from_packet(data, interface):
@@ -36,33 +45,80 @@ class Node:
         node.num = data.get("num")
         assert node.num, "Node should at least have an ID"
 
-        node.id = data.get("user", {}).get("id", "")
-        node.mac = data.get("user", {}).get("macaddr", "")
-        node.hardware = data.get("user", {}).get("hwModel", "")
-        node.role = data.get("user", {}).get("role", None)
-        node.shortName = data.get("user", {}).get("shortName", "")
-        node.longName = data.get("user", {}).get("longName", "")
-        if not node.mac:
-            node.shortName = "UNKN"
-            node.longName = "Unknown node"
-
-        position = data.get("position", None)
-        if position and "latitude" in position and "longitude" in position:
-            node.position = [
-                position["latitude"],
-                position["longitude"],
-                position.get("altitude", 0),
-            ]
-        else:
-            node.position = None
+        node._update_user(data.get("user", {}))
+
+        node.position = None
+        node._update_position(data.get("position", None))
 
         node.lastHeard = data.get("lastHeard", 0)
         node.hopsAway = data.get("hopsAway", 0)
         node.snr = data.get("snr", None)
         node.rssi = None
+        node.signal = None
 
         return node
 
+    def update_from_packet(self, packet):
+        """Apply what a freshly received packet tells us about this node"""
+        if "rxTime" in packet:
+            self.lastHeard = packet["rxTime"]
+        if "rxSnr" in packet:
+            self.snr = packet["rxSnr"]
+        if "rxRssi" in packet:
+            self.rssi = packet["rxRssi"]
+        if "hopStart" in packet and "hopLimit" in packet:
+            self.hopsAway = packet["hopStart"] - packet["hopLimit"]
+        if "rxSnr" in packet or "rxRssi" in packet:
+            self._record_signal(packet)
+
+        decoded = packet.get("decoded", {})
+        match decoded.get("portnum"):
+            case "NODEINFO_APP":
+                self._update_user(decoded.get("user", {}))
+            case "POSITION_APP":
+                self._update_position(decoded.get("position", None))
+
+    def _record_signal(self, packet):
+        # Only allocate a history for nodes we actually receive packets from
+        if self.signal is None:
+            self.signal = SignalHistory()
+        hops = None
+        if "hopStart" in packet and "hopLimit" in packet:
+            hops = packet["hopStart"] - packet["hopLimit"]
+        self.signal.add(
+            packet.get("rxTime", self.lastHeard),
+            packet.get("rxSnr", None),
+            packet.get("rxRssi", None),
+            hops,
+        )
+
+    def _update_user(self, user):
+        self.id = user.get("id", "")
+        self.mac = user.get("macaddr", "")
+        self.hardware = user.get("hwModel", "")
+        self.role = user.get("role", None)
+        self.shortName = user.get("shortName", "")
+        self.longName = user.get("longName", "")
+        if not self.mac:
+            self.shortName = "UNKN"
+            self.longName = "Unknown node"
+
+    def _update_position(self, position):
+        if not position:
+            return
+        if "latitude" in position and "longitude" in position:
+            self.position = [
+                position["latitude"],
+                position["longitude"],
+                position.get("altitude", 0),
+            ]
+        elif "latitudeI" in position and "longitudeI" in position:
+            self.position = [
+                position["latitudeI"] / pow(10, 7),
+                position["longitudeI"] / pow(10, 7),
+                position.get("altitude", 0),
+            ]
+
     def is_self(self):
         return (
             hasattr(self, "interface")
@@ -74,76 +130,22 @@ class Node:
     def is_broadcast(self):
         return self is Everyone
 
-    def send(self, message: str, **kwargs) -> bool:
-        if self.id and self.interface:
-            messages = self.break_message(message)
-            oneliner = message.replace("\n", "\\n")
-            logger.info(
-                f"Sending to {self} in {len(messages)} {'part' if len(messages) == 1 else 'parts'}: {oneliner}"
-            )
-            for msg in messages:
-                if not self._send(msg, **kwargs):
-                    return False
-            return True
-        else:
-            return False
-
-    def _send(self, message: str, **kwargs) -> bool:
-        self.transmission["timeout"] = Timer(MAX_REPLY_DELAY, self.on_timeout)
-        self.transmission["timeout"].start()
-        self.transmission["sending"] = self.interface.sendText(
-            message,
-            destinationId=self.id,
-            wantAck=True,
-            onResponse=self.onAckNak,
-            **kwargs,
-        )
-        while self.transmission["sending"]:
-            time.sleep(0.1)
-        return self.transmission["last_result"]
-
-    # Don't change the name of this callback
-    # https://github.com/meshtastic/python/blob/c696d59b9052361856630c8eb97a061cdb51dc6b/meshtastic/mesh_interface.py#L415-L418
-    def onAckNak(self, response):
-        if (
-            self.transmission["sending"]
-            and self.transmission["sending"].id == response["decoded"]["requestId"]
-        ):
-            # Got a reply to the blocking message! Unblocking...
-            self.transmission["timeout"].cancel()
-            self.transmission["last_result"] = (
-                response["decoded"]["routing"]["errorReason"] == "NONE"
-            )
-            self.transmission["sending"] = None
-
-    def on_timeout(self):
+    def send(self, message: str, **kwargs) -> Future:
+        """
+        Queue a message for this node. Returns a Future that resolves to True
+        when all parts of the message have been acknowledged.
+        """
+        if not (self.id and self.interface):
+            return sent(False)
+        messages = self.break_message(message)
+        oneliner = message.replace("\n", "\\n")
         logger.info(
-            f"Did not get a reply from {self} within {MAX_REPLY_DELAY} seconds, moving on"
+            f"Sending to {self} in {len(messages)} {'part' if len(messages) == 1 else 'parts'}: {oneliner}"
         )
-        self.transmission["last_result"] = False
-        self.transmission["sending"] = None
+        return transmitter.send(self, messages, **kwargs)
 
     def break_message(self, message: str):
-        # Keep it as a single message if possible
-        if len(message.encode("utf-8")) <= MAX_SIZE:
-            return [message]
-
-        # Split message into multiple parts
-        words = wrapper._split_chunks(message)
-        words.reverse()  # use it as a stack
-        words = [w.encode("utf-8") for w in words]
-        lines = [b""]
-        while words:
-            word = words.pop(-1)
-            if len(word) > SHORT_SIZE:
-                assert False, "we should never be here if the wrapper does its job"
-            if len(lines[-1]) + len(word) <= SHORT_SIZE:
-                lines[-1] += word
-            else:
-                lines.append(word)
-        return [
-            f"{l.decode().rstrip()} [{i+1}/{len(lines)}]" for i, l in enumerate(lines)
-        ]
+        return split_message(message, MAX_SIZE)
 
     def __str__(self):
         if type(self) == SpecialNode:
@@ -182,13 +184,14 @@ class Node:
 
 
 class SpecialNode(Node):
+    __slots__ = ()
+
     def __init__(self, short, long, id):
         self.shortName = short
         self.longName = long
         self.id = id
         self.interface = None
         self.hardware = "UNSET"
-        self.transmission = {"sending": None, "last_result": False, "timeout": None}
 
     def is_self(self):
         return False
@@ -0,0 +1,103 @@
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from .node import Node
+
+# Windows we keep track of the active nodes for, in seconds
+WINDOWS = (5 * 60, 30 * 60, 60 * 60, 24 * 60 * 60)
+
+
+class ActiveWindow:
+    """
+    The nodes we heard from within the last `seconds`, ordered by when we last
+    heard them, with a histogram of their hop counts.
+    """
+
+    def __init__(self, seconds: int):
+        self.seconds = seconds
+        self.nodes = OrderedDict()  # Node number -> (last heard, hops away)
+        self.hops = Counter()
+
+    def heard(self, node: Node):
+        last_heard = node.lastHeard
+        if node.num in self.nodes:
+            heard_before, hops = self.nodes[node.num]
+            self.hops[hops] -= 1
+            if last_heard <= heard_before:
+                # Not a newer packet, so the node keeps its place
+                self.nodes[node.num] = (heard_before, node.hopsAway)
+                self.hops[node.hopsAway] += 1
+                return
+            del self.nodes[node.num]
+        # Packets mostly come in the order they were heard, but if this one
+        # wasn't the latest, move the nodes heard after it back behind it
+        later = []
+        for num in reversed(self.nodes):
+            if self.nodes[num][0] <= last_heard:
+                break
+            later.append(num)
+        self.nodes[node.num] = (last_heard, node.hopsAway)
+        self.hops[node.hopsAway] += 1
+        for num in reversed(later):
+            self.nodes.move_to_end(num)
+
+    def expire(self, now: float):
+        # The least recently heard nodes are at the front, so we can stop at
+        # the first one that is still recent enough
+        cutoff = now - self.seconds
+        while self.nodes:
+            num = next(iter(self.nodes))
+            if self.nodes[num][0] >= cutoff:
+                break
+            self.hops[self.nodes.pop(num)[1]] -= 1
+
+
+class NodeStats:
+    """
+    Aggregates for the nodelist summary, kept up to date as packets come in so
+    the summary doesn't have to look at every node. Our own node is not
+    counted.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hops = Counter()  # Hops away -> number of nodes
+        self._hops_away = {}  # Node number -> hops away
+        self.windows = {seconds: ActiveWindow(seconds) for seconds in WINDOWS}
+
+    def update(self, node: Node):
+        with self._lock:
+            self._update(node)
+
+    def _update(self, node: Node):
+        if node.num in self._hops_away:
+            self.hops[self._hops_away[node.num]] -= 1
+        self._hops_away[node.num] = node.hopsAway
+        self.hops[node.hopsAway] += 1
+
+        if node.lastHeard and node.lastHeard >= time.time() - max(WINDOWS):
+            for window in self.windows.values():
+                window.heard(node)
+
+    def total(self) -> dict:
+        """Returns the number of nodes per hop count"""
+        with self._lock:
+            return dict(self.hops)
+
+    def active(self, seconds: int) -> tuple[int, dict]:
+        """
+        Returns the number of nodes we heard from in the last `seconds`, and
+        how many of those there are per hop count
+        """
+        with self._lock:
+            window = self.windows[seconds]
+            window.expire(time.time())
+            return len(window.nodes), dict(window.hops)
+
+    @staticmethod
+    def from_nodes(nodes: list[Node]) -> "NodeStats":
+        stats = NodeStats()
+        for node in sorted(nodes, key=lambda node: node.lastHeard or 0):
+            stats._update(node)
+        return stats
@@ -1,8 +1,9 @@
 import re
-from datetime import datetime
+from types import MappingProxyType
 
+from .name_index import NameIndex
 from .node import Node, Everyone, Unknown
-
+from .node_stats import NodeStats
 
 fullHexId = re.compile("![0-9a-fA-F]{8}")
 shortHexId = re.compile("[0-9a-fA-F]{8}")
@@ -13,12 +14,80 @@ class Nodelist:
 
     def __init__(self):
         self.nodes = {}
+        self.interface = None
+
+        # Indexes for finding nodes by what users type, kept up to date when
+        # nodes are added or change their names. Names map to lists of nodes,
+        # because names don't have to be unique.
+        self._by_short_name = {}
+        self._by_long_name = {}
+        self._by_id = {}
+        self._index_keys = {}  # num -> keys this node is indexed under
+        self._name_index = NameIndex()
+        self._self = None
+        self._stats = NodeStats()
+        # Read-only copy of the nodes for views, made again after nodes were
+        # added or replaced
+        self._version = 0
+        self._snapshot = (-1, None)
+
+    @staticmethod
+    def from_interface(interface):
+        nodelist = Nodelist()
+        nodelist.interface = interface
+        for info in (interface.nodes or {}).values():
+            node = Node.from_packet(info, interface)
+            nodelist.nodes[node.num] = node
+            nodelist._index(node)
+        # Build the statistics in one go, because the active windows expect
+        # nodes in the order we heard them
+        nodelist._stats = NodeStats.from_nodes(
+            [node for node in nodelist.nodes.values() if node is not nodelist._self]
+        )
+        return nodelist
 
     def add(self, node: Node):
+        # Handlers on other threads only iterate over snapshots of the nodes,
+        # so we can grow the dictionary in place
         self.nodes[node.num] = node
+        self._version += 1
+        self._index(node)
+        if node is not self._self:
+            self._stats.update(node)
 
     def update(self, node: Node):
         self.nodes[node.num] = node
+        self._version += 1
+        self._index(node)
+        if node is not self._self:
+            self._stats.update(node)
+
+    def _index(self, node: Node):
+        keys = (
+            node.shortName.casefold(),
+            node.longName.casefold(),
+            (node.id or "").casefold(),
+        )
+        old_keys = self._index_keys.get(node.num, None)
+        if old_keys == keys and self._by_id.get(keys[2], None) is node:
+            return
+
+        if old_keys:
+            old_node = self._by_id.get(old_keys[2], None)
+            _remove(self._by_short_name, old_keys[0], node.num)
+            _remove(self._by_long_name, old_keys[1], node.num)
+            if old_node is not None and old_node.num == node.num:
+                del self._by_id[old_keys[2]]
+
+        self._name_index.add(node)
+        _append(self._by_short_name, keys[0], node)
+        _append(self._by_long_name, keys[1], node)
+        if keys[2]:
+            self._by_id[keys[2]] = node
+        self._index_keys[node.num] = keys
+
+        if node.is_self():
+            self._self = node
 
     def get(self, num) -> Node | None:
         """Returns Node object"""
@@ -28,6 +97,41 @@ class Nodelist:
             return self.nodes[num]
         return Unknown
 
+    def on_packet(self, packet) -> Node:
+        """
+        Update the list with what we learn from a received packet. Only touches
+        the sending node, so the cost does not depend on the size of the list.
+        Returns the sending Node object.
+        """
+        num = packet.get("from")
+        if num not in self.nodes:
+            known = getattr(self.interface, "nodesByNum", None) or {}
+            if num not in known:
+                return self.get(num)
+            self.add(Node.from_packet(known[num], self.interface))
+
+        node = self.nodes[num]
+        node.update_from_packet(packet)
+        if packet.get("decoded", {}).get("portnum") == "NODEINFO_APP":
+            self._index(node)
+        if node is not self._self:
+            self._stats.update(node)
+        return node
+
+    def view(self):
+        """Returns a cheap read-only view on this list"""
+        return NodelistView(self)
+
+    def _snapshot_nodes(self) -> MappingProxyType:
+        # Read the version before copying, so a node added while we copy
+        # makes the next call copy again instead of keeping a stale snapshot
+        version, snapshot = self._snapshot
+        if version != self._version:
+            version = self._version
+            snapshot = MappingProxyType(self.nodes.copy())
+            self._snapshot = (version, snapshot)
+        return snapshot
+
     def find(self, needle: str) -> Node | None:
         """Figure out which node the user intends. Returns Node object or None"""
         id = self.find_id(needle)
@@ -47,66 +151,120 @@ class Nodelist:
             # needle is a HEX notation node number, but we're missing the exclamation mark
             return f"!{needle}"
 
-        elif len(needle) <= 4 and needle.upper() in [
-            node.shortName.upper() for node in self.nodes.values()
-        ]:
-            # needle is a known short name
-            return next(
-                node.id
-                for node in self.nodes.values()
-                if node.shortName.upper() == needle.upper()
-            )
-
-        elif needle.isnumeric() and int(needle) > 0:
+        candidates = self.candidates(needle)
+        if len(candidates) == 1:
+            # needle is a known, unique short or long name
+            return candidates[0].id
+
+        elif not candidates and needle.isdecimal() and int(needle) > 0:
             # needle is a decimal number
-            return "!" + hex(needle)[2:]
+            return f"!{int(needle):08x}"
+
+        elif not candidates:
+            # needle may be part of a name, or a name with a typo in it
+            node = self._name_index.best(needle)
+            if node:
+                return node.id
 
         return None
 
+    def search(self, needle: str, limit: int = 5) -> list[Node]:
+        """Returns the nodes with names resembling the needle, best match first"""
+        return [node for _, node in self._name_index.search(needle, limit)]
+
+    def candidates(self, needle: str) -> list[Node]:
+        """
+        Returns the nodes that match the given id, short name or long name. If
+        this returns more than one node, `find` and `find_id` refuse to guess.
+        """
+        needle = needle.strip().casefold()
+        if needle in self._by_id:
+            return [self._by_id[needle]]
+        if f"!{needle}" in self._by_id:
+            return [self._by_id[f"!{needle}"]]
+        if len(needle) <= 4 and needle in self._by_short_name:
+            return self._by_short_name[needle]
+        return self._by_long_name.get(needle, [])
+
     def get_self(self) -> Node | None:
-        return next((n for n in self.nodes.values() if n.is_self()), None)
+        if self._self is None:
+            self._self = next((n for n in self._snapshot() if n.is_self()), None)
+        return self._self
+
+    def _snapshot(self) -> list[Node]:
+        # Copying the values is a single step for the interpreter, so this is
+        # safe while the receiving thread adds nodes
+        return list(self.nodes.values())
 
     def __str__(self):
         output = "Node list\n"
         output += "---------\n"
-        nodes = sorted(self.nodes.values(), key=lambda n: n.hopsAway)
+        nodes = sorted(self._snapshot(), key=lambda n: n.hopsAway)
         for node in nodes:
             output += f"{node.to_verbose_string()}\n"
         return output
 
     def to_succinct_string(self):
         """Used when sending the node list in Meshtastic messages"""
-        return "\n".join(node.to_succinct_string() for node in self.nodes.values())
+        return "\n".join(node.to_succinct_string() for node in self._snapshot())
 
     def summary(self):
-        now = datetime.now()
-        seen_in_the_last_half_hour = [
-            node
-            for node in self.nodes.values()
-            if not node.is_self()
-            and node.lastHeard
-            and (now - datetime.fromtimestamp(node.lastHeard)).total_seconds() < 1800
-        ]
-
-        hop_counts = {}
-        for node in self.nodes.values():
-            if not node.is_self():
-                hop_counts[node.hopsAway] = hop_counts.get(node.hopsAway, 0) + 1
-
-        recent_hop_counts = {}
-        for node in seen_in_the_last_half_hour:
-            recent_hop_counts[node.hopsAway] = (
-                recent_hop_counts.get(node.hopsAway, 0) + 1
-            )
+        recent, recent_hop_counts = self._stats.active(30 * 60)
+        hop_counts = self._stats.total()
+        last_5_minutes, _ = self._stats.active(5 * 60)
+        last_hour, _ = self._stats.active(60 * 60)
+        last_day, _ = self._stats.active(24 * 60 * 60)
 
         optional_part = (
             f" Of which {recent_hop_counts.get(0, 0)} directly connected and {recent_hop_counts.get(1, 0)} one hop away."
-            if len(seen_in_the_last_half_hour) > 0
+            if recent > 0
+            else ""
+        )
+        windows_part = (
+            f"\n\nActive nodes: {last_5_minutes} in the past 5 minutes, {last_hour} in the past hour and {last_day} in the past 24 hours."
+            if last_day > 0
             else ""
         )
         totals_part = (
             f"\n\nIn total I've seen {len(self.nodes)} nodes. {hop_counts.get(0, 0)} of those were directly connected and {hop_counts.get(1, 0)} were one hop away."
-            if len(self.nodes) != len(seen_in_the_last_half_hour)
+            if len(self.nodes) != recent
             else ""
         )
-        return f"I've seen {len(seen_in_the_last_half_hour)} nodes in the past 30 minutes.{optional_part}{totals_part}"
+        return f"I've seen {recent} nodes in the past 30 minutes.{optional_part}{windows_part}{totals_part}"
+
+
+def _append(index: dict, key: str, node: Node):
+    # Replace lists instead of changing them, for the benefit of readers on
+    # other threads
+    index[key] = [n for n in index.get(key, []) if n.num != node.num] + [node]
+
+
+def _remove(index: dict, key: str, num: int):
+    nodes = [n for n in index.get(key, []) if n.num != num]
+    if nodes:
+        index[key] = nodes
+    else:
+        index.pop(key, None)
+
+
+class NodelistView:
+    """Read-only view on a Nodelist, as handed to message handlers"""
+
+    _mutators = ("add", "update", "on_packet", "_index")
+
+    def __init__(self, nodelist: Nodelist):
+        self._nodelist = nodelist
+
+    @property
+    def nodes(self):
+        # A snapshot, so handlers can iterate over it while the receiving
+        # thread adds nodes. It is only copied again after nodes were added.
+        return self._nodelist._snapshot_nodes()
+
+    def __getattr__(self, name):
+        if name in NodelistView._mutators:
+            raise AttributeError(f"Can't {name} nodes through a read-only view")
+        return getattr(self._nodelist, name)
+
+    def __str__(self):
+        return str(self._nodelist)
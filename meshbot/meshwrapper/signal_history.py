@@ -0,0 +1,94 @@
+import math
+from array import array
+
+# Number of samples we keep per node
+HISTORY_SIZE = 32
+
+FIELDS = ("snr", "rssi", "hops")
+
+
+class SignalHistory:
+    """
+    Ring buffer of the most recent signal readings for a node. Backed by fixed
+    size arrays, so a node takes the same kilobyte or so no matter how long
+    we've been listening to it. Missing readings are stored as NaN.
+    """
+
+    __slots__ = ("size", "_time", "_snr", "_rssi", "_hops", "_next", "_count")
+
+    def __init__(self, size: int = HISTORY_SIZE):
+        self.size = size
+        self._time = array("d", [0.0] * size)
+        self._snr = array("f", [math.nan] * size)
+        self._rssi = array("f", [math.nan] * size)
+        self._hops = array("f", [math.nan] * size)
+        self._next = 0
+        self._count = 0
+
+    def add(self, time: float, snr=None, rssi=None, hops=None):
+        i = self._next
+        self._time[i] = time or 0
+        self._snr[i] = math.nan if snr is None else snr
+        self._rssi[i] = math.nan if rssi is None else rssi
+        self._hops[i] = math.nan if hops is None else hops
+        self._next = (i + 1) % self.size
+        self._count = min(self._count + 1, self.size)
+
+    def values(self, field: str, since: float = 0) -> list[float]:
+        """Returns the readings for `snr`, `rssi` or `hops`, oldest first"""
+        assert field in FIELDS, f"Unknown signal field {field}"
+        column = getattr(self, f"_{field}")
+        start = (self._next - self._count) % self.size
+        values = []
+        for j in range(self._count):
+            i = (start + j) % self.size
+            if self._time[i] >= since and not math.isnan(column[i]):
+                values.append(column[i])
+        return values
+
+    def percentile(self, field: str, percentile: float, since: float = 0):
+        """Returns the given percentile (0 to 100) of a field, or None"""
+        return _percentile(sorted(self.values(field, since)), percentile)
+
+    def stats(self, field: str, since: float = 0) -> dict | None:
+        """Returns count, min, avg, max and median of a field, or None"""
+        values = sorted(self.values(field, since))
+        if not values:
+            return None
+        return {
+            "count": len(values),
+            "min": values[0],
+            "avg": sum(values) / len(values),
+            "max": values[-1],
+            "median": _percentile(values, 50),
+        }
+
+    def describe(self) -> str:
+        """Returns a human readable summary of the SNR and RSSI readings"""
+        parts = []
+        for field, label in (("snr", "SNR"), ("rssi", "RSSI")):
+            stats = self.stats(field)
+            if stats:
+                parts.append(
+                    f"{label} between {_number(stats['min'])} and {_number(stats['max'])} "
+                    f"(average {_number(stats['avg'])}, median {_number(stats['median'])})"
+                )
+        if not parts:
+            return ""
+        packets = "packet" if self._count == 1 else f"{self._count} packets"
+        return f"Over the last {packets}: {', '.join(parts)}."
+
+    def __len__(self):
+        return self._count
+
+
+def _percentile(values: list[float], percentile: float):
+    # Nearest rank, which always returns one of the actual readings
+    if not values:
+        return None
+    rank = math.ceil(percentile / 100 * len(values))
+    return values[max(0, min(len(values), rank) - 1)]
+
+
+def _number(value: float) -> str:
+    return f"{round(value, 1):g}"
@@ -0,0 +1,128 @@
+import unicodedata
+
+ZERO_WIDTH_JOINER = 0x200D
+
+
+def split_message(message: str, size: int) -> list[str]:
+    """
+    Split a message into parts of at most `size` UTF-8 bytes, numbering the
+    parts like "[1/3]" when there is more than one. Prefers to split at the end
+    of a line, then between words, and never splits a character or an emoji
+    sequence in two.
+    """
+    encoded = message.encode("utf-8")
+    if len(encoded) <= size:
+        return [message]
+
+    # We need to know how many parts there will be to know how much room the
+    # numbering takes, so start by guessing it fits in a single digit
+    total = 2
+    while True:
+        parts = _split(encoded, size - len(f" [{total}/{total}]"))
+        if len(str(len(parts))) <= len(str(total)):
+            break
+        total = len(parts)
+
+    if not parts:
+        # Nothing but whitespace, which still makes a message, like it does
+        # when it's short enough to send as is
+        return [""]
+    return [
+        f"{part.decode('utf-8')} [{i + 1}/{len(parts)}]" for i, part in enumerate(parts)
+    ]
+
+
+def _split(encoded: bytes, budget: int) -> list[bytes]:
+    # Leave room for at least the longest UTF-8 character
+    assert budget >= 4, "No room left for the message itself"
+    parts = []
+    start = _skip_whitespace(encoded, 0)
+    while start < len(encoded):
+        cut = start + budget
+        if cut >= len(encoded):
+            parts.append(encoded[start:].rstrip())
+            break
+
+        # Prefer the end of a line, if that doesn't waste too much room
+        newline = encoded.rfind(b"\n", start, cut + 1)
+        space = max(
+            newline,
+            encoded.rfind(b" ", start, cut + 1),
+            encoded.rfind(b"\t", start, cut + 1),
+        )
+        if newline > start + budget // 2:
+            end = newline
+        elif space > start:
+            end = space
+        else:
+            end = _grapheme_boundary(encoded, start, cut)
+
+        part = encoded[start:end].rstrip()
+        if part:
+            parts.append(part)
+        start = _skip_whitespace(encoded, end)
+    return parts
+
+
+def _skip_whitespace(encoded: bytes, index: int) -> int:
+    while index < len(encoded) and encoded[index] in b" \t\r\n":
+        index += 1
+    return index
+
+
+def _grapheme_boundary(encoded: bytes, start: int, cut: int) -> int:
+    """
+    Move `cut` back to the nearest place where we can split without breaking
+    up a character or a sequence of characters that is displayed as one, like
+    an emoji with a skin tone or a flag.
+    """
+    boundary = cut = _codepoint_start(encoded, start, cut)
+    while boundary > start and _joined(encoded, start, boundary):
+        boundary = _codepoint_start(encoded, start, boundary - 1)
+    # A single grapheme that doesn't fit at all still has to be split somewhere
+    return boundary if boundary > start else cut
+
+
+def _codepoint_start(encoded: bytes, start: int, index: int) -> int:
+    # UTF-8 continuation bytes look like 0b10xxxxxx
+    while index > start and encoded[index] & 0xC0 == 0x80:
+        index -= 1
+    return index
+
+
+def _codepoint_at(encoded: bytes, index: int) -> int:
+    return ord(encoded[index : index + 4].decode("utf-8", errors="ignore")[0])
+
+
+def _joined(encoded: bytes, start: int, index: int) -> bool:
+    """Is the codepoint starting at `index` part of the same grapheme as the one before it?"""
+    after = _codepoint_at(encoded, index)
+    before = _codepoint_at(encoded, _codepoint_start(encoded, start, index - 1))
+    if before == ZERO_WIDTH_JOINER or _extends(after):
+        return True
+    if _regional_indicator(before) and _regional_indicator(after):
+        # Flags are pairs of regional indicators, so count how many come
+        # before this one to see if it's the second half of a pair
+        count = 0
+        position = index
+        while position > start:
+            position = _codepoint_start(encoded, start, position - 1)
+            if not _regional_indicator(_codepoint_at(encoded, position)):
+                break
+            count += 1
+        return count % 2 == 1
+    return False
+
+
+def _extends(codepoint: int) -> bool:
+    return (
+        codepoint == ZERO_WIDTH_JOINER
+        or 0xFE00 <= codepoint <= 0xFE0F  # Variation selectors
+        or 0x1F3FB <= codepoint <= 0x1F3FF  # Skin tones
+        or 0xE0020 <= codepoint <= 0xE007F  # Tags, used in some flags
+        or unicodedata.category(chr(codepoint)) in ("Mn", "Me", "Mc")
+    )
+
+
+def _regional_indicator(codepoint: int) -> bool:
+    return 0x1F1E6 <= codepoint <= 0x1F1FF
@@ -0,0 +1,408 @@
+import heapq
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+from .airtime import airtime, modem_settings
+
+logger = logging.getLogger("Meshbot")
+
+# How long to wait for an ACK from a direct neighbour before we know how fast
+# it usually replies. Nodes further away start with a multiple of this.
+MAX_REPLY_DELAY = 5
+
+# Number of times we send a part again when it isn't acknowledged in time
+RETRIES = 2
+
+# Destination of messages to everyone on the channel
+BROADCAST = 0xFFFFFFFF
+
+# Priorities for transmissions. Replies to someone who is waiting for them go
+# before bulk traffic, like delivering stored messages.
+INTERACTIVE = 0
+BULK = 1
+
+# Share of the air-time that bulk traffic leaves for interactive replies
+INTERACTIVE_RESERVE = 0.5
+
+
+class Transmission:
+    """A message on its way to a node, possibly in multiple parts"""
+
+    def __init__(self, node, parts: list[str], priority: int, kwargs: dict):
+        self.node = node
+        self.parts = deque(parts)
+        self.priority = priority
+        self.kwargs = kwargs
+        self.future = Future()
+        self.part = None  # The part we're currently trying to deliver
+        self.attempts = 0
+        self.packets = []  # Ids of the packets we've sent with this part
+
+
+class RoundTripTime:
+    """
+    Smoothed round trip time to a node and how much it varies, used to decide
+    how long to wait for an ACK, like TCP does it (RFC 6298)
+    """
+
+    ALPHA = 1 / 8
+    BETA = 1 / 4
+
+    def __init__(self):
+        self.smoothed = None
+        self.variation = None
+
+    def sample(self, rtt: float):
+        if self.smoothed is None:
+            self.smoothed = rtt
+            self.variation = rtt / 2
+        else:
+            self.variation += self.BETA * (abs(self.smoothed - rtt) - self.variation)
+            self.smoothed += self.ALPHA * (rtt - self.smoothed)
+
+    def timeout(self) -> float | None:
+        if self.smoothed is None:
+            return None
+        return self.smoothed + 4 * self.variation
+
+
+class TokenBucket:
+    """
+    Air-time budget: fills up with `rate` seconds of air-time per second, up
+    to `capacity` seconds. Transmitting takes air-time out of the bucket.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self._updated = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self._updated) * self.rate
+        )
+        self._updated = now
+
+    def time_until(self, tokens: float) -> float:
+        """Seconds until the bucket holds `tokens`, which can't be over capacity"""
+        self.refill()
+        missing = min(tokens, self.capacity) - self.tokens
+        return max(0, missing / self.rate) if self.rate > 0 else float("inf")
+
+    def take(self, tokens: float):
+        # May go below zero for a packet that is bigger than the whole bucket
+        self.refill()
+        self.tokens -= tokens
+
+
+class Transmitter:
+    """
+    Sends messages from a dedicated worker thread, so the thread that asks for
+    a message to be sent never has to wait for the mesh.
+
+    Each destination gets its own queue and has at most one packet in flight,
+    which keeps the parts of a message in order without slow nodes holding up
+    the others. Interactive replies go ahead of bulk messages in the queue,
+    between the parts of a bulk message if need be. Packets are matched to
+    their ACK or NAK by packet id, and all ACK timeouts are tracked by the
+    same worker instead of a timer per packet. How long we wait for an ACK
+    depends on the round trip times we've seen for the destination, and parts
+    that time out are sent again a few times, each time waiting twice as long.
+    An ACK for any of the copies of a part counts, as the first may just be
+    late.
+
+    All destinations share one air-time budget, which refills according to the
+    duty cycle we may use and how busy the channel is. Interactive replies go
+    first, and bulk traffic leaves part of the budget for them.
+    """
+
+    def __init__(
+        self,
+        timeout: float = MAX_REPLY_DELAY,
+        retries: int = RETRIES,
+        duty_cycle: float = 1.0,
+        burst: float = 30,
+    ):
+        self.timeout = timeout
+        self.retries = retries
+        self._round_trips = {}  # Destination id -> RoundTripTime
+        self.duty_cycle = duty_cycle
+        self.channel_utilization = 0  # Percentage, as reported in telemetry
+        self._bucket = TokenBucket(duty_cycle, burst)
+        self._condition = threading.Condition()
+        self._queues = {}  # Destination id -> deque of Transmissions
+        # Destinations that can send their next part, by priority
+        self._ready = {INTERACTIVE: deque(), BULK: deque()}
+        self._in_flight = {}  # Packet id -> (Transmission, time sent)
+        self._timeouts = []  # Heap of (deadline, packet id)
+        self._worker = None
+
+    def send(
+        self, node, parts: list[str], priority: int = INTERACTIVE, **kwargs
+    ) -> Future:
+        """
+        Queue the parts of a message for the given node. Returns a Future that
+        resolves to True once all parts have been acknowledged, or False as soon
+        as one of them fails.
+        """
+        if not parts:
+            return sent(True)
+        transmission = Transmission(node, parts, priority, kwargs)
+        with self._condition:
+            queue = self._queues.setdefault(node.id, deque())
+            # Go ahead of lower priority messages for the same node, unless
+            # one of their parts is already underway
+            position = len(queue)
+            while (
+                position > 0
+                and queue[position - 1].priority > priority
+                and queue[position - 1].part is None
+            ):
+                position -= 1
+            queue.insert(position, transmission)
+            if position == 0:
+                if len(queue) > 1:
+                    self._ready[queue[1].priority].remove(node.id)
+                self._ready[priority].append(node.id)
+            if self._worker is None:
+                self._worker = threading.Thread(
+                    target=self._run, name="Meshbot transmitter", daemon=True
+                )
+                self._worker.start()
+            self._condition.notify()
+        return transmission.future
+
+    def timeout_for(self, node) -> float:
+        """
+        How long to wait for an ACK from this node: based on the round trip
+        times we've seen, or on how many hops away it is if we haven't seen any
+        """
+        round_trip = self._round_trips.get(node.id, None)
+        timeout = round_trip.timeout() if round_trip else None
+        if timeout is None:
+            timeout = self.timeout * (1 + (getattr(node, "hopsAway", 0) or 0))
+        return min(max(timeout, self.timeout / 5), self.timeout * 12)
+
+    def queued(self) -> int:
+        """Returns the number of messages that have not been fully sent yet"""
+        with self._condition:
+            return sum(len(queue) for queue in self._queues.values())
+
+    def limit(self, duty_cycle: float, burst: float):
+        """
+        Only transmit for `duty_cycle` (0 to 1) of the time, allowing bursts
+        of up to `burst` seconds of air-time
+        """
+        with self._condition:
+            self.duty_cycle = duty_cycle
+            self._bucket.refill()
+            self._bucket.capacity = burst
+            self._bucket.tokens = min(self._bucket.tokens, burst)
+            self._update_rate()
+            self._condition.notify()
+
+    def set_channel_utilization(self, percentage: float):
+        """
+        Tell the transmitter how busy the channel is. The busier it gets, the
+        less of our duty cycle we use, but never less than a tenth of it.
+        """
+        with self._condition:
+            self.channel_utilization = percentage
+            self._update_rate()
+            self._condition.notify()
+
+    def _update_rate(self):
+        self._bucket.refill()
+        free = max(0.1, 1 - self.channel_utilization / 100)
+        self._bucket.rate = self.duty_cycle * free
+
+    # Don't change the name of this callback
+    # https://github.com/meshtastic/python/blob/c696d59b9052361856630c8eb97a061cdb51dc6b/meshtastic/mesh_interface.py#L415-L418
+    def onAckNak(self, response):
+        with self._condition:
+            packet_id = response["decoded"]["requestId"]
+            in_flight = self._in_flight.get(packet_id, None)
+            if not in_flight:
+                return
+            transmission, sent_at = in_flight
+            success = response["decoded"]["routing"]["errorReason"] == "NONE"
+
+            # A NAK only counts for the copy we're still waiting for
+            if not success and (
+                packet_id != transmission.packets[-1] or self._retrying(transmission)
+            ):
+                del self._in_flight[packet_id]
+                return
+
+            # Only measure packets we sent once, as we can't tell which copy
+            # of a retransmitted packet an ACK is for
+            if success and transmission.attempts == 1:
+                self._round_trips.setdefault(
+                    transmission.node.id, RoundTripTime()
+                ).sample(time.monotonic() - sent_at)
+
+            self._settle(transmission)
+            self._advance(transmission, success)
+            self._condition.notify()
+
+    def _run(self):
+        with self._condition:
+            while True:
+                # If the worker dies, nothing gets sent anymore and nobody
+                # hears about it, so keep going whatever happens
+                try:
+                    self._expire_timeouts()
+                    wait = self._transmit_ready()
+                    timeout = self._time_to_next_timeout()
+                    if wait is not None and (timeout is None or wait < timeout):
+                        timeout = wait
+                except Exception:
+                    logger.exception("Transmitter failed")
+                    timeout = self.timeout
+                self._condition.wait(timeout)
+
+    def _transmit_ready(self) -> float | None:
+        """
+        Send as many ready parts as the air-time budget allows. Returns how
+        long to wait for the budget to allow the next one, if any are left.
+        """
+        while True:
+            priority = INTERACTIVE if self._ready[INTERACTIVE] else BULK
+            ready = self._ready[priority]
+            if not ready:
+                return None
+
+            transmission = self._queues[ready[0]][0]
+            try:
+                cost = self._airtime(transmission)
+                if priority == BULK:
+                    cost += INTERACTIVE_RESERVE * self._bucket.capacity
+                wait = self._bucket.time_until(cost)
+                if wait > 0:
+                    return wait
+                self._transmit(ready.popleft())
+            except Exception:
+                logger.exception(f"Could not send to {transmission.node}")
+                self._settle(transmission)
+                self._advance(transmission, False)
+
+    def _airtime(self, transmission: Transmission) -> float:
+        part = (
+            transmission.part
+            if transmission.part is not None
+            else transmission.parts[0]
+        )
+        return airtime(
+            len(part.encode("utf-8")), modem_settings(transmission.node.interface)
+        )
+
+    def _transmit(self, destination):
+        transmission = self._queues[destination][0]
+        self._bucket.take(self._airtime(transmission))
+        if transmission.part is None:
+            transmission.part = transmission.parts.popleft()
+            transmission.attempts = 0
+        transmission.attempts += 1
+        try:
+            packet = transmission.node.interface.sendText(
+                transmission.part,
+                destinationId=destination,
+                wantAck=True,
+                onResponse=self.onAckNak,
+                **transmission.kwargs,
+            )
+        except Exception as e:
+            logger.error(f"Could not send to {transmission.node}: {e}")
+            self._settle(transmission)
+            self._advance(transmission, False)
+            return
+
+        # Back off exponentially when we have to try again
+        timeout = self.timeout_for(transmission.node) * 2 ** (transmission.attempts - 1)
+        now = time.monotonic()
+        self._in_flight[packet.id] = (transmission, now)
+        transmission.packets.append(packet.id)
+        heapq.heappush(self._timeouts, (now + timeout, packet.id))
+
+    def _retrying(self, transmission: Transmission) -> bool:
+        # The part is underway, so its destination is only ready when the
+        # part timed out and waits to be sent again
+        return transmission.node.id in self._ready[transmission.priority]
+
+    def _settle(self, transmission: Transmission):
+        """Stop trying to deliver the current part, and forget all its copies"""
+        for packet_id in transmission.packets:
+            self._in_flight.pop(packet_id, None)
+        transmission.packets = []
+        transmission.part = None
+        if self._retrying(transmission):
+            self._ready[transmission.priority].remove(transmission.node.id)
+
+    def _advance(self, transmission: Transmission, success: bool):
+        destination = transmission.node.id
+        queue = self._queues[destination]
+        if success and transmission.parts:
+            # Let higher priority messages that were queued while this part
+            # was underway go before the rest of this one
+            position = 1
+            while (
+                position < len(queue)
+                and queue[position].priority < transmission.priority
+            ):
+                position += 1
+            if position > 1:
+                queue.popleft()
+                queue.insert(position - 1, transmission)
+            self._ready[queue[0].priority].append(destination)
+            return
+
+        queue.popleft()
+        if queue:
+            self._ready[queue[0].priority].append(destination)
+        else:
+            del self._queues[destination]
+        transmission.future.set_result(success)
+
+    def _expire_timeouts(self):
+        now = time.monotonic()
+        while self._timeouts and self._timeouts[0][0] <= now:
+            _, packet_id = heapq.heappop(self._timeouts)
+            in_flight = self._in_flight.get(packet_id, None)
+            if not in_flight:
+                continue
+            transmission, sent_at = in_flight
+            # A broadcast that is sent again gets a new packet id, so everyone
+            # who did get it would see it twice
+            retries = 0 if transmission.node.id == BROADCAST else self.retries
+            # Keep listening for an ACK for this copy while we try again
+            if transmission.attempts <= retries:
+                logger.info(
+                    f"Did not get a reply from {transmission.node} within {now - sent_at:.1f} seconds, trying again"
+                )
+                self._ready[transmission.priority].append(transmission.node.id)
+            else:
+                logger.info(
+                    f"Did not get a reply from {transmission.node} within {now - sent_at:.1f} seconds, moving on"
+                )
+                self._settle(transmission)
+                self._advance(transmission, False)
+
+    def _time_to_next_timeout(self) -> float | None:
+        if not self._timeouts:
+            return None
+        return max(0, self._timeouts[0][0] - time.monotonic())
+
+
+def sent(result: bool) -> Future:
+    """Returns an already resolved Future, for when there is nothing to send"""
+    future = Future()
+    future.set_result(result)
+    return future
+
+
+transmitter = Transmitter()
@@ -1,11 +1,22 @@
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime
 
 from .meshwrapper import Message, Node
+from .meshwrapper.node import MAX_SIZE
 from .meshwrapper.time_helper import time_ago
+from .meshwrapper.transmitter import BULK, INTERACTIVE
 from .chatbot import Chatbot
+from .message_storage import MessageStorage, MemoryStorage, SqliteStorage
+from .config import config
 
 
 def register(bot: Chatbot):
+    global storage
+    if config.get("MESSAGE_STORE"):
+        storage = SqliteStorage(config["MESSAGE_STORE"])
+
     bot.add_command(
         {
             "command": "INBOX",
@@ -45,12 +56,36 @@ def register(bot: Chatbot):
     )
 
 
-messageStore = {}
+# Where the messages are kept. In memory by default, or in an SQLite database
+# when MESSAGE_STORE is configured.
+storage: MessageStorage = MemoryStorage()
+
+# Don't notify the same node about its new messages more often than this, in
+# seconds. Nodes that broadcast telemetry every minute would get spammed
+# otherwise.
+NOTIFY_COOLDOWN = 10 * 60
+
+# Recipient -> when we last notified them about new messages
+lastNotified = {}
+
+# Send as many short messages together in a single packet as will fit. Off by
+# default, as it changes what recipients get.
+BATCH_DELIVERY = config.get("MESSAGE_BATCHING") == "True"
+
+# Deliveries are resolved on the transmitter thread. Marking messages as read
+# and sending the next batch happens on a thread of our own, so a slow disk
+# never holds up the radio.
+deliveries = ThreadPoolExecutor(max_workers=1, thread_name_prefix="Meshbot mailbox")
+
+# Ids of the messages that are on their way, so asking for them again before
+# they arrive doesn't send them twice
+sending = set()
+sendingLock = threading.Lock()
 
 
 def send_inbox(message: Message):
     _store_welcome_message(message.fromNode)
-    stats = _user_stats(message.fromNode)
+    stats = storage.stats(message.fromNode.id)
 
     if stats["totalMessages"] == 0:
         message.fromNode.send("🤖📭 You have no messages in your inbox")
@@ -64,7 +99,7 @@ def send_inbox(message: Message):
 
 def send_new_messages(message: Message):
     _store_welcome_message(message.fromNode)
-    stats = _user_stats(message.fromNode)
+    stats = storage.stats(message.fromNode.id)
 
     if stats["numUnread"] == 0:
         old_messages = (
@@ -73,15 +108,20 @@ def send_new_messages(message: Message):
         message.fromNode.send(f"🤖📭 You have no new messages.{old_messages}")
         return
 
+    messages = _claim(message.fromNode, read=False)
+    if not messages:
+        message.fromNode.send("🤖📬 Your new messages are already on their way.")
+        return
+
     message.fromNode.send(
-        f"🤖📬 You have {stats['numUnread']} new {_pluralize('message', stats['numUnread'])}. Sending {_pluralize('it', stats['numUnread'])} now..."
+        f"🤖📬 You have {len(messages)} new {_pluralize('message', len(messages))}. Sending {_pluralize('it', len(messages))} now..."
     )
-    _send_messages(message.fromNode, read=False)
+    _send_messages(message.fromNode, messages, priority=INTERACTIVE)
 
 
 def send_old_messages(message: Message):
     _store_welcome_message(message.fromNode)
-    stats = _user_stats(message.fromNode)
+    stats = storage.stats(message.fromNode.id)
 
     if stats["numRead"] == 0:
         new_messages = (
@@ -90,19 +130,22 @@ def send_old_messages(message: Message):
         message.fromNode.send(f"🤖📭 You have no old messages.{new_messages}")
         return
 
+    messages = _claim(message.fromNode, read=True)
+    if not messages:
+        message.fromNode.send("🤖📬 Your old messages are already on their way.")
+        return
+
     message.fromNode.send(
-        f"🤖📬 You have {stats['numRead']} old {_pluralize('message', stats['numRead'])}. Sending {_pluralize('it', stats['numRead'])} now..."
+        f"🤖📬 You have {len(messages)} old {_pluralize('message', len(messages))}. Sending {_pluralize('it', len(messages))} now..."
     )
-    _send_messages(message.fromNode, read=True)
+    _send_messages(message.fromNode, messages, priority=INTERACTIVE)
 
 
 def clear_old_messages(message: Message):
     _store_welcome_message(message.fromNode)
-    stats = _user_stats(message.fromNode)
+    stats = storage.stats(message.fromNode.id)
 
-    messageStore[message.fromNode.id] = [
-        msg for msg in messageStore[message.fromNode.id] if not msg["read"]
-    ]
+    storage.clear_read(message.fromNode.id)
     message.fromNode.send(
         f"🤖🗑️ I removed {stats['numRead']} old {_pluralize('message', stats['numRead'])}. You have {stats['numUnread']} new {_pluralize('message', stats['numUnread'])} left in your inbox."
     )
@@ -125,23 +168,23 @@ def store_message(message: Message):
     # Figure out who the recipient is
     id = parts[1]
     recipientId = message.nodelist.find_id(id)
+    if not recipientId and len(message.nodelist.candidates(id)) > 1:
+        message.fromNode.send(
+            f"🤖🧨 I know more than one node called {id}. The message was not stored.\n\nPlease use the node ID of the recipient instead (example: !8e92a31f)."
+        )
+        return
     if not recipientId:
         message.fromNode.send(
             "🤖🧨 I don't know who that is. The message was not stored.\n\nI need the short name of a node I have seen before (example: TDRP), or the node ID of the recipient (example: !8e92a31f)."
+            + "".join(
+                f"\n\nDid you mean {node.to_succinct_string()}?"
+                for node in message.nodelist.search(id, 1)
+            )
         )
         return
 
     # Store the message
-    if recipientId not in messageStore:
-        messageStore[recipientId] = []
-    messageStore[recipientId].append(
-        {
-            "sender": message.fromNode.to_succinct_string(),
-            "contents": msg,
-            "read": False,
-            "timestamp": datetime.now(),
-        }
-    )
+    storage.add(recipientId, message.fromNode.to_succinct_string(), msg, datetime.now())
     message.fromNode.send(f"🤖📨 Saved this message for node `{id}`:\n\n{msg}")
 
 
@@ -150,6 +193,11 @@ def notify_user(message: Message):
     Check to see if one of our recipients came in range, and has new messages.
     """
 
+    # This runs for every packet we receive, so bail as quickly as possible for
+    # the vast majority of nodes that have no new messages.
+    if not storage.has_unread(message.fromNode.id):
+        return
+
     # If they are messaging us first, they will probably quickly find out that
     # they have messages, and it just breaks the flow. So only check for all
     # other message types.
@@ -161,56 +209,113 @@ def notify_user(message: Message):
     if message.type == "ROUTING_APP":
         return
 
-    # Do we have a message box?
-    if message.fromNode.id not in messageStore:
+    # Have we recently told them about their messages?
+    now = time.monotonic()
+    if now - lastNotified.get(message.fromNode.id, -NOTIFY_COOLDOWN) < NOTIFY_COOLDOWN:
         return
 
-    # Do we have new messages?
-    stats = _user_stats(message.fromNode)
-    if stats["numUnread"] == 0:
+    # Do we have new messages that are not on their way yet?
+    messages = _claim(message.fromNode, read=False)
+    if not messages:
         return
+    lastNotified[message.fromNode.id] = now
 
-    # Send this user their new messages
+    # Send this user their new messages. They didn't ask for them, so don't
+    # let this get in the way of replies to people who did.
     message.fromNode.send(
-        f"🤖📬 I have {stats['numUnread']} new {_pluralize('message', stats['numUnread'])} for you! Sending {_pluralize('it', stats['numUnread'])} now..."
+        f"🤖📬 I have {len(messages)} new {_pluralize('message', len(messages))} for you! Sending {_pluralize('it', len(messages))} now...",
+        priority=BULK,
     )
-    _send_messages(message.fromNode, read=False)
+    _send_messages(message.fromNode, messages, priority=BULK)
 
 
 def _store_welcome_message(node: Node):
     """
     Give the current user an inbox and a welcome message if they are new
     """
-    if node.id not in messageStore:
-        messageStore[node.id] = [
-            {
-                "sender": "🤖 Meshbot",
-                "contents": f"Welcome to this Meshtastic answering machine, {node.longName}! You can leave messages for other users, and they can leave messages for you! Hope you like it 😄",
-                "read": False,
-                "timestamp": datetime.now(),
-            },
+    storage.add_if_new(
+        node.id,
+        "🤖 Meshbot",
+        f"Welcome to this Meshtastic answering machine, {node.longName}! You can leave messages for other users, and they can leave messages for you! Hope you like it 😄",
+        datetime.now(),
+    )
+
+
+def _claim(node: Node, read: bool) -> list[dict]:
+    """
+    Get the messages for this node that are not on their way yet, and mark
+    them as being on their way
+    """
+    with sendingLock:
+        messages = [
+            msg
+            for msg in storage.messages(node.id, read=read)
+            if msg["id"] not in sending
         ]
+        sending.update(msg["id"] for msg in messages)
+    return messages
+
 
+def _release(messages: list[dict]):
+    with sendingLock:
+        sending.difference_update(msg["id"] for msg in messages)
 
-def _send_messages(node: Node, read: bool = False):
-    for msg in messageStore.get(node.id, []):
-        if msg["read"] != read:
-            continue
-        if node.send(
-            f"🤖✉️ From {msg['sender']}, {time_ago(msg['timestamp'])} ago:\n\n{msg['contents']}"
-        ):
-            msg["read"] = True
-
-
-def _user_stats(node: Node) -> dict:
-    messages = messageStore.get(node.id, [])
-    numUnread = sum(1 for msg in messages if not msg["read"])
-    totalMessages = len(messages)
-    return {
-        "totalMessages": totalMessages,
-        "numUnread": numUnread,
-        "numRead": totalMessages - numUnread,
-    }
+
+def _send_messages(node: Node, messages: list[dict], priority: int):
+    """Send messages claimed with `_claim`"""
+    if BATCH_DELIVERY:
+        batches = _batch(messages)
+    else:
+        batches = [[msg] for msg in messages]
+    _send_batches(node, batches, priority)
+
+
+def _batch(messages: list[dict]) -> list[list[dict]]:
+    """
+    Group messages so each group fits in a single packet. Messages that are
+    too long for that get a group to themselves, and are sent in parts.
+    """
+    batches = []
+    for msg in messages:
+        if batches and len(_format(batches[-1] + [msg]).encode("utf-8")) <= MAX_SIZE:
+            batches[-1].append(msg)
+        else:
+            batches.append([msg])
+    return batches
+
+
+def _format(messages: list[dict]) -> str:
+    if len(messages) == 1:
+        msg = messages[0]
+        return f"🤖✉️ From {msg['sender']}, {time_ago(msg['timestamp'])} ago:\n\n{msg['contents']}"
+    return "🤖✉️ " + "\n\n".join(
+        f"From {msg['sender']}, {time_ago(msg['timestamp'])} ago:\n{msg['contents']}"
+        for msg in messages
+    )
+
+
+def _send_batches(node: Node, batches: list[list[dict]], priority: int):
+    # Send one batch at a time, so we can stop at the first one that doesn't
+    # arrive. What we didn't deliver stays unread, and gets sent next time.
+    if not batches:
+        return
+    node.send(_format(batches[0]), priority=priority).add_done_callback(
+        lambda delivery: deliveries.submit(
+            _delivered, node, batches, priority, delivery
+        )
+    )
+
+
+def _delivered(node: Node, batches: list[list[dict]], priority: int, delivery: Future):
+    if not delivery.result():
+        # Leave the rest for next time
+        for batch in batches:
+            _release(batch)
+        return
+    for msg in batches[0]:
+        storage.mark_read(node.id, msg["id"])
+    _release(batches[0])
+    _send_batches(node, batches[1:], priority)
 
 
 def _pluralize(word: str, count: int) -> str:
@@ -0,0 +1,328 @@
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from datetime import datetime
+
+
+class MessageStorage(ABC):
+    """
+    Interface for the places where the message box can keep its messages.
+
+    Messages are dictionaries with an `id`, `sender`, `contents`, `read` flag
+    and a `timestamp`. Storage implementations keep the number of read and
+    unread messages per recipient up to date when writing, so asking for the
+    stats of an inbox doesn't have to look at the messages themselves.
+    """
+
+    @abstractmethod
+    def has_inbox(self, recipient: str) -> bool: ...
+
+    @abstractmethod
+    def recipients(self) -> list[str]: ...
+
+    @abstractmethod
+    def add(
+        self, recipient: str, sender: str, contents: str, timestamp: datetime
+    ) -> int:
+        """Store a new unread message. Returns the id of the message"""
+
+    @abstractmethod
+    def add_if_new(
+        self, recipient: str, sender: str, contents: str, timestamp: datetime
+    ) -> int | None:
+        """
+        Store a new unread message, but only if the recipient doesn't have an
+        inbox yet. Checking and adding happen at once, so only one of several
+        threads gets to add it. Returns the id of the message, or None.
+        """
+
+    @abstractmethod
+    def messages(self, recipient: str, read: bool | None = None) -> list[dict]:
+        """Returns the messages for the recipient, optionally filtered on read"""
+
+    @abstractmethod
+    def mark_read(self, recipient: str, id: int) -> None: ...
+
+    @abstractmethod
+    def clear_read(self, recipient: str) -> int:
+        """Remove the read messages of a recipient. Returns how many there were"""
+
+    @abstractmethod
+    def stats(self, recipient: str) -> dict: ...
+
+    @abstractmethod
+    def has_unread(self, recipient: str) -> bool:
+        """
+        Cheap check that runs for every packet we receive, so implementations
+        should keep a set of recipients with unread messages in memory
+        """
+
+
+def _stats(numUnread: int, numRead: int) -> dict:
+    return {
+        "totalMessages": numUnread + numRead,
+        "numUnread": numUnread,
+        "numRead": numRead,
+    }
+
+
+class MemoryStorage(MessageStorage):
+    """
+    Keeps messages in memory, so they are gone when the bot restarts. Can be
+    filled with a dictionary in the old `messageStore` format, of recipients to
+    lists of messages.
+    """
+
+    def __init__(self, messages: dict = None):
+        self._lock = threading.Lock()
+        self._inboxes = {}  # Recipient -> {id: message}
+        self._counts = {}  # Recipient -> [numUnread, numRead]
+        self._unread = set()  # Recipients with unread messages
+        self._next_id = 1
+        for recipient, inbox in (messages or {}).items():
+            self._inboxes.setdefault(recipient, {})
+            self._counts.setdefault(recipient, [0, 0])
+            for message in inbox:
+                self._insert(recipient, message)
+
+    def has_inbox(self, recipient: str) -> bool:
+        return recipient in self._inboxes
+
+    def recipients(self) -> list[str]:
+        return list(self._inboxes.keys())
+
+    def add(self, recipient, sender, contents, timestamp) -> int:
+        with self._lock:
+            return self._insert(
+                recipient,
+                {
+                    "sender": sender,
+                    "contents": contents,
+                    "read": False,
+                    "timestamp": timestamp,
+                },
+            )
+
+    def add_if_new(self, recipient, sender, contents, timestamp) -> int | None:
+        with self._lock:
+            if recipient in self._inboxes:
+                return None
+            return self._insert(
+                recipient,
+                {
+                    "sender": sender,
+                    "contents": contents,
+                    "read": False,
+                    "timestamp": timestamp,
+                },
+            )
+
+    def _insert(self, recipient: str, message: dict) -> int:
+        id = self._next_id
+        self._next_id += 1
+        self._inboxes.setdefault(recipient, {})[id] = {**message, "id": id}
+        counts = self._counts.setdefault(recipient, [0, 0])
+        counts[1 if message["read"] else 0] += 1
+        if not message["read"]:
+            self._unread.add(recipient)
+        return id
+
+    def messages(self, recipient, read=None) -> list[dict]:
+        with self._lock:
+            return [
+                dict(message)
+                for message in self._inboxes.get(recipient, {}).values()
+                if read is None or message["read"] == read
+            ]
+
+    def mark_read(self, recipient, id) -> None:
+        with self._lock:
+            message = self._inboxes.get(recipient, {}).get(id, None)
+            if message and not message["read"]:
+                message["read"] = True
+                self._counts[recipient][0] -= 1
+                self._counts[recipient][1] += 1
+                if self._counts[recipient][0] == 0:
+                    self._unread.discard(recipient)
+
+    def clear_read(self, recipient) -> int:
+        with self._lock:
+            inbox = self._inboxes.get(recipient, {})
+            for id in [id for id, message in inbox.items() if message["read"]]:
+                del inbox[id]
+            counts = self._counts.get(recipient, [0, 0])
+            removed, counts[1] = counts[1], 0
+            return removed
+
+    def stats(self, recipient) -> dict:
+        return _stats(*self._counts.get(recipient, [0, 0]))
+
+    def has_unread(self, recipient) -> bool:
+        return recipient in self._unread
+
+
+class SqliteStorage(MessageStorage):
+    """Keeps messages in an SQLite database, so they survive restarts"""
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        with self._db:
+            self._db.executescript("""
+                CREATE TABLE IF NOT EXISTS messages (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    recipient TEXT NOT NULL,
+                    sender TEXT NOT NULL,
+                    contents TEXT NOT NULL,
+                    read INTEGER NOT NULL DEFAULT 0,
+                    timestamp REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS messages_by_recipient
+                    ON messages (recipient, read, id);
+                CREATE TABLE IF NOT EXISTS inboxes (
+                    recipient TEXT PRIMARY KEY,
+                    num_unread INTEGER NOT NULL DEFAULT 0,
+                    num_read INTEGER NOT NULL DEFAULT 0
+                );
+                """)
+        self._unread = set(  # Recipients with unread messages
+            row[0]
+            for row in self._db.execute(
+                "SELECT recipient FROM inboxes WHERE num_unread > 0"
+            )
+        )
+
+    def has_inbox(self, recipient: str) -> bool:
+        with self._lock:
+            return (
+                self._db.execute(
+                    "SELECT 1 FROM inboxes WHERE recipient = ?", (recipient,)
+                ).fetchone()
+                is not None
+            )
+
+    def recipients(self) -> list[str]:
+        with self._lock:
+            return [row[0] for row in self._db.execute("SELECT recipient FROM inboxes")]
+
+    def create_inbox(self, recipient: str) -> None:
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR IGNORE INTO inboxes (recipient) VALUES (?)", (recipient,)
+            )
+
+    def add(self, recipient, sender, contents, timestamp, read=False) -> int:
+        with self._lock, self._db:
+            id = self._db.execute(
+                "INSERT INTO messages (recipient, sender, contents, read, timestamp) VALUES (?, ?, ?, ?, ?)",
+                (recipient, sender, contents, int(read), timestamp.timestamp()),
+            ).lastrowid
+            self._db.execute(
+                """
+                INSERT INTO inboxes (recipient, num_unread, num_read) VALUES (?, ?, ?)
+                ON CONFLICT (recipient) DO UPDATE SET
+                    num_unread = num_unread + excluded.num_unread,
+                    num_read = num_read + excluded.num_read
+                """,
+                (recipient, int(not read), int(read)),
+            )
+            if not read:
+                self._unread.add(recipient)
+            return id
+
+    def add_if_new(self, recipient, sender, contents, timestamp) -> int | None:
+        with self._lock, self._db:
+            created = self._db.execute(
+                "INSERT OR IGNORE INTO inboxes (recipient, num_unread) VALUES (?, 1)",
+                (recipient,),
+            ).rowcount
+            if not created:
+                return None
+            id = self._db.execute(
+                "INSERT INTO messages (recipient, sender, contents, timestamp) VALUES (?, ?, ?, ?)",
+                (recipient, sender, contents, timestamp.timestamp()),
+            ).lastrowid
+            self._unread.add(recipient)
+            return id
+
+    def messages(self, recipient, read=None) -> list[dict]:
+        with self._lock:
+            if read is None:
+                rows = self._db.execute(
+                    "SELECT id, sender, contents, read, timestamp FROM messages WHERE recipient = ? ORDER BY id",
+                    (recipient,),
+                )
+            else:
+                rows = self._db.execute(
+                    "SELECT id, sender, contents, read, timestamp FROM messages WHERE recipient = ? AND read = ? ORDER BY id",
+                    (recipient, int(read)),
+                )
+            return [
+                {
+                    "id": id,
+                    "sender": sender,
+                    "contents": contents,
+                    "read": bool(read),
+                    "timestamp": datetime.fromtimestamp(timestamp),
+                }
+                for id, sender, contents, read, timestamp in rows
+            ]
+
+    def mark_read(self, recipient, id) -> None:
+        with self._lock, self._db:
+            changed = self._db.execute(
+                "UPDATE messages SET read = 1 WHERE id = ? AND recipient = ? AND read = 0",
+                (id, recipient),
+            ).rowcount
+            if changed:
+                self._db.execute(
+                    "UPDATE inboxes SET num_unread = num_unread - 1, num_read = num_read + 1 WHERE recipient = ?",
+                    (recipient,),
+                )
+                (unread,) = self._db.execute(
+                    "SELECT num_unread FROM inboxes WHERE recipient = ?",
+                    (recipient,),
+                ).fetchone()
+                if unread == 0:
+                    self._unread.discard(recipient)
+
+    def clear_read(self, recipient) -> int:
+        with self._lock, self._db:
+            removed = self._db.execute(
+                "DELETE FROM messages WHERE recipient = ? AND read = 1", (recipient,)
+            ).rowcount
+            self._db.execute(
+                "UPDATE inboxes SET num_read = 0 WHERE recipient = ?", (recipient,)
+            )
+            return removed
+
+    def stats(self, recipient) -> dict:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT num_unread, num_read FROM inboxes WHERE recipient = ?",
+                (recipient,),
+            ).fetchone()
+        return _stats(*(row or (0, 0)))
+
+    def has_unread(self, recipient) -> bool:
+        return recipient in self._unread
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def migrate(source: MessageStorage, target: SqliteStorage) -> None:
+    """Copy all messages from one storage to an SQLite storage"""
+    for recipient in source.recipients():
+        target.create_inbox(recipient)
+        for message in source.messages(recipient):
+            target.add(
+                recipient,
+                message["sender"],
+                message["contents"],
+                message["timestamp"],
+                read=message["read"],
+            )
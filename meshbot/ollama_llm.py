@@ -1,17 +1,18 @@
 import requests
-import os
-from dotenv import dotenv_values
+import concurrent.futures
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable
 
 from .meshwrapper import Message, Nodelist, Node
+from .meshwrapper.node import MAX_SIZE
 from .chatbot import Chatbot
 from .open_meteo import fetch_weather, fetch_forecast
-
-config = {
-    **dotenv_values(".env"),
-    **dotenv_values("production.env"),
-    **dotenv_values("development.env"),
-    **os.environ,
-}
+from .http_client import http
+from .config import config
 
 
 def register(bot: Chatbot):
@@ -46,56 +47,274 @@ def register(bot: Chatbot):
     )
 
 
-conversations = {}
+# The conversations we remember, from least to most recently used. When there
+# are more than OLLAMA_MAX_CONVERSATIONS, the least recently used ones are
+# forgotten.
+conversations = OrderedDict()
+conversations_lock = threading.Lock()
+
+# Approximate number of tokens that we allow a conversation to use, before we
+# start forgetting the oldest turns
+CONTEXT_TOKENS = int(config.get("OLLAMA_CONTEXT_TOKENS", 2048))
+MAX_CONVERSATIONS = int(config.get("OLLAMA_MAX_CONVERSATIONS", 100))
+
+# Tool calls run in parallel, each for at most TOOL_TIMEOUT seconds. The model
+# gets MAX_TOOL_ROUNDS chances to call tools before it has to answer.
+TOOL_TIMEOUT = float(config.get("OLLAMA_TOOL_TIMEOUT", 20))
+MAX_TOOL_ROUNDS = int(config.get("OLLAMA_MAX_TOOL_ROUNDS", 5))
 
 
 def start_conversation(message: Message) -> str:
-    message.reply("🤖⏳ Spinning up the LLM, just a moment...")
-    conversations[identifier(message)] = [
-        {
-            "role": "system",
-            "content": system_prompt + str(_gather_relevant_stats(message)),
-        }
-    ]
-    reply = _reply_from_ollama(conversations[identifier(message)], message.nodelist)
-    message.reply("🤖🧠 Started LLM conversation")
-    reply_if_not_empty(message, reply)
+    if not _streaming():
+        message.reply("🤖⏳ Spinning up the LLM, just a moment...")
+    conversation = _new_conversation(message)
+    if _streaming():
+        message.reply("🤖🧠 Started LLM conversation")
+        _answer(message)
+    else:
+        reply = _reply_from_ollama(conversation, message.nodelist)
+        message.reply("🤖🧠 Started LLM conversation")
+        reply_if_not_empty(message, reply)
     return "LLM"
 
 
 def converse(message: Message):
-    assert identifier(message) in conversations, "Conversation should have been started"
-    conversations[identifier(message)].append(
+    conversation = _recall(identifier(message)) or _new_conversation(message)
+    conversation.append(
         {
             "role": "user",
             "content": f"Node {message.fromNode.id}: {message.text}",
         }
     )
-    reply_if_not_empty(
-        message,
-        _reply_from_ollama(conversations[identifier(message)], message.nodelist),
-    )
+    _answer(message)
 
 
 def stop_conversation(message: Message) -> str:
-    del conversations[identifier(message)]
+    with conversations_lock:
+        conversations.pop(identifier(message), None)
     message.reply("🤖🧠 Ended LLM conversation")
     return "MAIN"
 
 
-def identifier(message: Message) -> str:
-    if message.private_message():
-        return message.fromNode.id
-    else:
-        return f"Channel {message.channel}"
+def identifier(message: Message) -> tuple:
+    # Conversations follow the chatbot's conversation state, so each node gets
+    # its own conversation, both in private and in channels
+    return Chatbot.conversation(message)
 
 
-def reply_if_not_empty(message: Message, reply: str):
+def _new_conversation(message: Message) -> list:
+    conversation = [
+        {
+            "role": "system",
+            "content": system_prompt + str(_gather_relevant_stats(message)),
+        }
+    ]
+    with conversations_lock:
+        conversations[identifier(message)] = conversation
+        conversations.move_to_end(identifier(message))
+        while len(conversations) > MAX_CONVERSATIONS:
+            conversations.popitem(last=False)
+    return conversation
+
+
+def _recall(key: tuple) -> list | None:
+    with conversations_lock:
+        if key not in conversations:
+            return None
+        conversations.move_to_end(key)
+        return conversations[key]
+
+
+def reply_if_not_empty(message: Message, reply: str, sent: bool = False):
     if reply != "":
-        conversations[identifier(message)].append(
-            {"role": "assistant", "content": reply}
+        conversation = _recall(identifier(message))
+        if conversation is not None:
+            conversation.append({"role": "assistant", "content": reply})
+        if not sent:
+            message.reply("🤖 " + reply)
+
+
+def _answer(message: Message):
+    """Ask the LLM to reply to the conversation, and send the reply"""
+    streamed = []
+
+    def send_part(part: str):
+        streamed.append(part)
+        message.reply("🤖 " + part)
+
+    conversation = _recall(identifier(message))
+    _trim(conversation)
+    reply = _reply_from_ollama(
+        conversation,
+        message.nodelist,
+        on_part=send_part if _streaming() else None,
+    )
+    reply_if_not_empty(message, reply, sent=len(streamed) > 0)
+
+
+def _streaming() -> bool:
+    return config.get("OLLAMA_STREAM") == "True"
+
+
+def _tokens(conversation: list) -> int:
+    # Rule of thumb: a token is about four characters, plus a bit of overhead
+    # for every message
+    return sum(len(msg.get("content") or "") // 4 + 4 for msg in conversation)
+
+
+def _trim(conversation: list) -> None:
+    """
+    Forget the oldest turns of the conversation until it fits in the token
+    budget again. The system prompt and the latest turn are always kept. If
+    OLLAMA_SUMMARIZE is enabled, the forgotten turns are summarized into a
+    second system message.
+    """
+    has_summary = len(conversation) > 1 and conversation[1]["role"] == "system"
+    first = 2 if has_summary else 1
+    forgotten = []
+    while _tokens(conversation) > CONTEXT_TOKENS:
+        # A turn runs from one user message up to the next
+        end = next(
+            (
+                i
+                for i in range(first + 1, len(conversation))
+                if conversation[i]["role"] == "user"
+            ),
+            None,
+        )
+        if end is None:
+            break
+        forgotten += conversation[first:end]
+        del conversation[first:end]
+
+    if not forgotten or config.get("OLLAMA_SUMMARIZE") != "True":
+        return
+
+    summary = _summarize(conversation[1]["content"] if has_summary else "", forgotten)
+    if summary:
+        summary = {
+            "role": "system",
+            "content": f"Summary of the earlier conversation: {summary}",
+        }
+        if has_summary:
+            conversation[1] = summary
+        else:
+            conversation.insert(1, summary)
+
+
+def _summarize(previous_summary: str, messages: list) -> str | None:
+    transcript = "\n".join(
+        f"{msg['role']}: {msg.get('content', '')}"
+        for msg in messages
+        if msg["role"] in ("user", "assistant")
+    )
+    try:
+        result = http.post(
+            config["OLLAMA_API"] + "/chat",
+            json={
+                "model": config["OLLAMA_MODEL"],
+                "stream": False,
+                "messages": [
+                    {
+                        "role": "user",
+                        "content": f"Summarize this conversation in a few short sentences, keeping any facts that may be needed later.\n\n{previous_summary}\n{transcript}",
+                    }
+                ],
+            },
+            read_timeout=float(config.get("OLLAMA_TIMEOUT", 120)),
         )
-        message.reply("🤖 " + reply)
+        if not result.ok:
+            return None
+        return result.json().get("message", {}).get("content", None)
+    except requests.exceptions.RequestException:
+        return None
+
+
+# Streamed replies are sent in parts that fit in a single packet, including the
+# robot prefix
+PART_SIZE = MAX_SIZE - len("🤖 ".encode("utf-8"))
+
+sentence_end = re.compile(r"[.!?…](?=\s)|\n")
+word_end = re.compile(r"\s")
+
+
+class MessageChunker:
+    """
+    Collects streamed text and cuts it into parts of at most `size` UTF-8
+    bytes, preferably at the end of a sentence, otherwise between words.
+    """
+
+    def __init__(self, size: int = PART_SIZE):
+        self.size = size
+        self.buffer = ""
+
+    def feed(self, text: str) -> list[str]:
+        """Add text, and return the parts that are complete"""
+        self.buffer += text
+        parts = []
+        while len(self.buffer.encode("utf-8")) > self.size:
+            cut = self._cut()
+            parts.append(self.buffer[:cut].strip())
+            self.buffer = self.buffer[cut:].lstrip()
+        return [part for part in parts if part]
+
+    def flush(self) -> list[str]:
+        """Return whatever is left"""
+        part, self.buffer = self.buffer.strip(), ""
+        return [part] if part else []
+
+    def _cut(self) -> int:
+        # Find the longest prefix that fits, and the best place to cut it
+        fits = 0
+        size = 0
+        for char in self.buffer:
+            size += len(char.encode("utf-8"))
+            if size > self.size:
+                break
+            fits += 1
+        prefix = self.buffer[:fits]
+        for boundary in (sentence_end, word_end):
+            ends = [match.end() for match in boundary.finditer(prefix)]
+            if ends and ends[-1] > 0:
+                return ends[-1]
+        return max(fits, 1)
+
+
+def _consume_stream(response, on_part: Callable[[str], None]) -> dict:
+    """
+    Read Ollama's stream of JSON lines, handing out parts of the reply as soon
+    as they fill a packet. Returns the whole message, like a non-streamed
+    response would.
+    """
+    chunker = MessageChunker()
+    content = ""
+    tool_calls = []
+    # Close the response when we're done, or its connection is never handed
+    # back to the session
+    with response:
+        for line in response.iter_lines():
+            if not line:
+                continue
+            try:
+                chunk = json.loads(line)
+            except ValueError as err:
+                raise requests.exceptions.RequestException(
+                    f"Invalid JSON in stream: {err}"
+                ) from err
+            if "error" in chunk:
+                raise requests.exceptions.RequestException(chunk["error"])
+            message = chunk.get("message", {})
+            tool_calls += message.get("tool_calls", [])
+            content += message.get("content", "")
+            for part in chunker.feed(message.get("content", "")):
+                on_part(part)
+            if chunk.get("done", False):
+                break
+
+    # Also send what the model said before calling tools
+    for part in chunker.flush():
+        on_part(part)
+    return {"message": {"content": content, "tool_calls": tool_calls}}
 
 
 system_prompt = f"""
@@ -149,7 +368,7 @@ tools = [
                 "properties": {
                     "node": {
                         "type": "string",
-                        "description": "The ID or short name of the node for which to get the signal strength, e.g. !9a34ed2b or R3NL",
+                        "description": "The ID, short name or long name of the node for which to get the signal strength, e.g. !9a34ed2b or R3NL",
                     },
                 },
                 "required": ["node"],
@@ -166,7 +385,7 @@ tools = [
                 "properties": {
                     "node": {
                         "type": "string",
-                        "description": "The ID or short name of the node for which to get the number of hops, e.g. !9a34ed2b or R3NL",
+                        "description": "The ID, short name or long name of the node for which to get the number of hops, e.g. !9a34ed2b or R3NL",
                     },
                 },
                 "required": ["node"],
@@ -183,7 +402,7 @@ tools = [
                 "properties": {
                     "node": {
                         "type": "string",
-                        "description": "The ID or short name of the node for which to get the current weather, e.g. !9a34ed2b or R3NL",
+                        "description": "The ID, short name or long name of the node for which to get the current weather, e.g. !9a34ed2b or R3NL",
                     },
                 },
                 "required": ["node"],
@@ -200,7 +419,7 @@ tools = [
                 "properties": {
                     "node": {
                         "type": "string",
-                        "description": "The ID or short name of the node for which to get the weather forecast, e.g. !9a34ed2b or R3NL",
+                        "description": "The ID, short name or long name of the node for which to get the weather forecast, e.g. !9a34ed2b or R3NL",
                     },
                 },
                 "required": ["node"],
@@ -210,70 +429,141 @@ tools = [
 ]
 
 
-def _reply_from_ollama(conversation: list, nodelist: Nodelist):
+def _reply_from_ollama(
+    conversation: list,
+    nodelist: Nodelist,
+    on_part: Callable[[str], None] = None,
+):
+    """
+    Get the LLM's reply to the conversation. If `on_part` is given, the reply
+    is streamed and handed to `on_part` in parts that fit in a single packet as
+    soon as they are complete. The whole reply is returned either way.
+    """
     request = {
         "model": config["OLLAMA_MODEL"],
         "messages": conversation,
-        "stream": False,
+        "stream": on_part is not None,
     }
 
     if config.get("OLLAMA_USE_TOOLS") == "True":
         request["tools"] = tools
 
-    working = True
-    while working:
+    def error(text: str) -> str:
+        # Parts of the reply may have been sent already, and then the caller
+        # doesn't send the returned reply, so send the error right away
+        if on_part is not None:
+            on_part(text)
+        return text
+
+    for tool_round in range(MAX_TOOL_ROUNDS + 1):
+        if tool_round == MAX_TOOL_ROUNDS:
+            # The model keeps calling tools. Make it answer with what it has.
+            request.pop("tools", None)
+
         try:
-            result = requests.post(config["OLLAMA_API"] + "/chat", json=request)
-        except requests.exceptions.ConnectionError as err:
-            return f"Could not reach the Ollama server at this time: {err}"
-        if not result.ok:
-            return f"Did not get a valid result from Ollama. Status: {result.status_code} - {result.text}"
+            result = http.post(
+                config["OLLAMA_API"] + "/chat",
+                json=request,
+                stream=request["stream"],
+                read_timeout=float(config.get("OLLAMA_TIMEOUT", 120)),
+            )
+            if not result.ok:
+                return error(
+                    f"Did not get a valid result from Ollama. Status: {result.status_code} - {result.text}"
+                )
+            if request["stream"]:
+                result = _consume_stream(result, on_part)
+            else:
+                result = result.json()
+        except requests.exceptions.RequestException as err:
+            return error(f"Could not reach the Ollama server at this time: {err}")
 
-        result = result.json()
         tool_calls = result.get("message", {}).get("tool_calls", False)
-
-        if tool_calls:
-            # print("Tool call! " + str(tool_calls))
-            for call in tool_calls:
-                function = call.get("function", {})
-                arguments = function.get("arguments", {})
-                node = nodelist.find(arguments.get("node", ""))
-                assert node, "The tool should have been called with a node parameter"
-                match function.get("name", None):
-                    case "get_signal_strength":
-                        return_value = _get_signal_strength(node)
-                    case "get_hops":
-                        return_value = f"Node {node.to_succinct_string()} is {node.hopsAway} hops away"
-                    case "get_current_weather":
-                        return_value = fetch_weather(node.position)
-                    case "get_weather_forecast":
-                        return_value = fetch_forecast(node.position)
-                    case _:
-                        assert False, "Invalid function name in function call from LLM"
-                # print("Return value: " + return_value)
-                conversation.append({"role": "tool", "content": return_value})
-        else:
-            working = False
+        if not tool_calls:
+            break
+
+        # Run the tools in parallel, but add the results in the order of the
+        # calls. Every call gets a thread of its own, so they all start right
+        # away and the timeout counts from when they start. A tool that hangs
+        # only ties up its own thread, and not those of other requests.
+        pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=len(tool_calls), thread_name_prefix="Meshbot tool"
+        )
+        try:
+            futures = [pool.submit(_call_tool, call, nodelist) for call in tool_calls]
+            concurrent.futures.wait(futures, timeout=TOOL_TIMEOUT)
+        finally:
+            pool.shutdown(wait=False)
+        for future in futures:
+            if future.done():
+                return_value = future.result()
+            else:
+                return_value = "This function took too long, try again later"
+            conversation.append({"role": "tool", "content": return_value})
 
     return result.get("message", {}).get(
         "content", "Did not get a valid result from Ollama :/"
     )
 
 
+def _call_tool(call: dict, nodelist: Nodelist) -> str:
+    function = call.get("function", {})
+    try:
+        arguments = function.get("arguments", {})
+        if isinstance(arguments, str):
+            # Some models send the arguments as a JSON string
+            arguments = json.loads(arguments)
+        node = nodelist.find(arguments.get("node", ""))
+        if not node:
+            suggestions = nodelist.search(arguments.get("node", ""), 3)
+            if suggestions:
+                return f"There is no known node {arguments.get('node', '')}. Similar nodes: {', '.join(n.to_succinct_string() for n in suggestions)}"
+            return f"There is no known node {arguments.get('node', '')}"
+
+        match function.get("name", None):
+            case "get_signal_strength":
+                return _get_signal_strength(node)
+            case "get_hops":
+                return f"Node {node.to_succinct_string()} is {node.hopsAway} hops away"
+            case "get_current_weather":
+                return (
+                    fetch_weather(node.position)
+                    or "The current weather is not available right now"
+                )
+            case "get_weather_forecast":
+                return (
+                    fetch_forecast(node.position)
+                    or "The weather forecast is not available right now"
+                )
+            case _:
+                return f"There is no function named {function.get('name', None)}"
+    except Exception as e:
+        return f"This function failed: {e}"
+
+
 def _get_signal_strength(node: Node) -> str:
+    history = getattr(node, "signal", None)
+    if node.snr is None:
+        return f"There are no signal readings for node {node.to_succinct_string()}"
+
+    # Judge the signal by the median of recent readings, which is less noisy
+    # than the last reading by itself
+    median = history.percentile("snr", 50) if history else None
+    snr = node.snr if median is None else median
     rssi = f" and an RSSI of {node.rssi}" if node.rssi else ""
     qualification = "That's a very good signal! Connection should be strong."
-    if node.snr < 0:
+    if snr < 0:
         qualification = "That's a pretty good signal. Connection should be strong."
-    if node.snr < -10:
+    if snr < -10:
         qualification = "That's not a very good signal, but it will work."
-    if node.snr < -15:
+    if snr < -15:
         qualification = (
             "That's a pretty bad signal. The connection may not be very reliable."
         )
-    if node.snr < -20:
+    if snr < -20:
         qualification = "That's a very bad signal. Don't expect to connect reliably."
-    return f"Node {node.to_succinct_string()} is being received with an SNR of {node.snr}{rssi}. {qualification}"
+    trend = f" {history.describe()}" if history and len(history) > 1 else ""
+    return f"Node {node.to_succinct_string()} is being received with an SNR of {node.snr}{rssi}.{trend} {qualification}"
 
 
 def _gather_relevant_stats(message: Message) -> dict:
@@ -299,6 +589,29 @@ def _gather_relevant_stats(message: Message) -> dict:
                 "longName": node.longName,
                 "id": node.id,
             }
-            for node in message.nodelist.nodes.values()
+            for node in _relevant_nodes(message)
         ]
     return stats
+
+
+def _relevant_nodes(message: Message) -> list[Node]:
+    """
+    Select the nodes that are most likely to take part in a channel
+    conversation: the sender, then recently heard direct neighbours, then other
+    recently heard nodes. The result is sorted by id, so the system prompt comes
+    out byte for byte the same for the same nodes, and Ollama can reuse its
+    prompt cache.
+    """
+    limit = int(config.get("OLLAMA_CONTEXT_NODES", 20))
+    recent = time.time() - float(config.get("OLLAMA_CONTEXT_RECENT", 2 * 60 * 60))
+    candidates = [
+        node
+        for node in message.nodelist.nodes.values()
+        if node is not message.fromNode
+        and not node.is_self()
+        and (node.lastHeard or 0) >= recent
+    ]
+    candidates.sort(key=lambda node: (node.hopsAway != 0, -(node.lastHeard or 0)))
+    selected = [message.fromNode] + candidates[: limit - 1]
+    # The sentinels for unknown nodes and everyone have numbers for ids
+    return sorted(selected, key=lambda node: str(node.id))
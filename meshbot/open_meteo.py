@@ -1,36 +1,262 @@
-import requests
 import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
 from datetime import datetime
 
 from .meshwrapper.time_helper import friendly_date
+from .http_client import http
+from .config import config
 
+logger = logging.getLogger("Meshbot")
 
 wmo_codes = json.loads(open("./meshbot/wmo_codes.json").read())
 
 
+class WeatherCache:
+    """
+    Size bounded LRU cache of Open-Meteo responses with a time to live. Nearby
+    positions share an entry, by rounding them to a grid of `resolution`
+    degrees.
+    """
+
+    def __init__(self, resolution: float, ttl: float, max_size: int):
+        self.resolution = resolution
+        self.ttl = ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # Grid cell -> (expires, response)
+        self._lock = threading.Lock()
+
+    def cell(self, position) -> tuple[float, float]:
+        """Returns the center of the grid cell that the position falls in"""
+        return (
+            round(round(position[0] / self.resolution) * self.resolution, 6),
+            round(round(position[1] / self.resolution) * self.resolution, 6),
+        )
+
+    def get(self, cell: tuple[float, float], count: bool = True) -> dict | None:
+        with self._lock:
+            entry = self._entries.get(cell, None)
+            if entry is None or entry[0] < time.monotonic():
+                self.misses += count
+                return None
+            self._entries.move_to_end(cell)
+            self.hits += count
+            return entry[1]
+
+    def put(self, cell: tuple[float, float], response: dict) -> None:
+        with self._lock:
+            self._entries[cell] = (time.monotonic() + self.ttl, response)
+            self._entries.move_to_end(cell)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def expires_within(self, cell: tuple[float, float], seconds: float) -> bool:
+        with self._lock:
+            entry = self._entries.get(cell, None)
+            return entry is None or entry[0] < time.monotonic() + seconds
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+_resolution = float(config.get("WEATHER_CACHE_RESOLUTION", 0.05))
+_cache_size = int(config.get("WEATHER_CACHE_SIZE", 256))
+
+current_cache = WeatherCache(
+    _resolution, float(config.get("WEATHER_CACHE_TTL", 10 * 60)), _cache_size
+)
+forecast_cache = WeatherCache(
+    _resolution, float(config.get("FORECAST_CACHE_TTL", 60 * 60)), _cache_size
+)
+
+# Maximum number of locations to ask Open-Meteo about in one request
+BATCH_SIZE = 50
+
+current_params = {
+    "current": [
+        "temperature_2m",
+        "is_day",
+        "precipitation",
+        "weather_code",
+        "wind_speed_10m",
+        "wind_direction_10m",
+    ],
+}
+
+forecast_params = {
+    "daily": [
+        "weather_code",
+        "temperature_2m_max",
+        "temperature_2m_min",
+        "precipitation_sum",
+        "precipitation_probability_max",
+        "wind_speed_10m_max",
+        "wind_direction_10m_dominant",
+    ],
+    "timezone": "auto",
+}
+
+
+# Requests to Open-Meteo that are underway, by (cache, grid cell)
+in_flight = {}
+in_flight_lock = threading.Lock()
+
+
+def _fetch(cache: WeatherCache, params: dict, position) -> dict | None:
+    """Get the Open-Meteo response for this position, from cache if we can"""
+    cell = cache.cell(position)
+    response = cache.get(cell)
+    if response is not None:
+        return response
+
+    # If someone is already asking Open-Meteo about this grid cell, wait for
+    # their answer instead of asking again
+    with in_flight_lock:
+        request = in_flight.get((cache, cell), None)
+        waiting = request is not None
+        if not waiting:
+            # The previous request may have finished since we checked the cache
+            response = cache.get(cell, count=False)
+            if response is not None:
+                return response
+            request = in_flight[(cache, cell)] = Future()
+    if waiting:
+        return request.result()
+
+    try:
+        response = _request(params, cell)
+        if response is not None:
+            cache.put(cell, response)
+        request.set_result(response)
+        return response
+    except Exception as e:
+        request.set_exception(e)
+        raise
+    finally:
+        with in_flight_lock:
+            del in_flight[(cache, cell)]
+
+
+def _request(params: dict, cell: tuple[float, float]) -> dict | None:
+    responses = _request_batch(params, [cell])
+    return responses[0] if responses else None
+
+
+def _request_batch(params: dict, cells: list[tuple[float, float]]) -> list | None:
+    """Ask Open-Meteo about multiple locations in a single request"""
+    result = http.get(
+        "https://api.open-meteo.com/v1/forecast",
+        params={
+            "latitude": ",".join(str(cell[0]) for cell in cells),
+            "longitude": ",".join(str(cell[1]) for cell in cells),
+            **params,
+        },
+    )
+    if not result.ok:
+        logger.warning(
+            f"Could not reach the Open-Meteo server at this time: {result.status_code} - {result.text}"
+        )
+        return None
+
+    # We get a list of responses for multiple locations, or a single response
+    # for a single location
+    responses = result.json()
+    return responses if type(responses) == list else [responses]
+
+
+def _fetch_batch(
+    cache: WeatherCache,
+    params: dict,
+    positions: list,
+    refresh_within: float = 0,
+    count: bool = True,
+) -> list[dict | None]:
+    """
+    Get the Open-Meteo responses for many positions, asking Open-Meteo about
+    all the grid cells that are not cached (or expire within `refresh_within`
+    seconds) in as few requests as possible. Only counts towards the cache
+    statistics if `count` is set.
+    """
+    cells = [cache.cell(position) for position in positions]
+    responses = {}
+    missing = []
+    for cell in dict.fromkeys(cells):
+        response = cache.get(cell, count=count)
+        if response is None or cache.expires_within(cell, refresh_within):
+            missing.append(cell)
+        if response is not None:
+            responses[cell] = response
+
+    # Like _fetch, wait for the cells that someone else is already asking
+    # Open-Meteo about, and let others wait for the cells we ask about
+    waiting = {}
+    requests = {}
+    with in_flight_lock:
+        for cell in missing:
+            request = in_flight.get((cache, cell), None)
+            if request is not None:
+                waiting[cell] = request
+            else:
+                requests[cell] = in_flight[(cache, cell)] = Future()
+
+    try:
+        cells_to_request = list(requests)
+        for i in range(0, len(cells_to_request), BATCH_SIZE):
+            batch = cells_to_request[i : i + BATCH_SIZE]
+            batch_responses = _request_batch(params, batch)
+            if batch_responses is None or len(batch_responses) != len(batch):
+                continue
+            for cell, response in zip(batch, batch_responses):
+                cache.put(cell, response)
+                responses[cell] = response
+    finally:
+        for cell, request in requests.items():
+            request.set_result(responses.get(cell, None))
+        with in_flight_lock:
+            for cell in requests:
+                del in_flight[(cache, cell)]
+
+    for cell, request in waiting.items():
+        try:
+            responses[cell] = request.result()
+        except Exception as e:
+            logger.warning(f"Could not get the weather from Open-Meteo: {e}")
+
+    return [responses.get(cell, None) for cell in cells]
+
+
 def fetch_weather(position) -> str | None:
     try:
-        params = {
-            "latitude": position[0],
-            "longitude": position[1],
-            "current": [
-                "temperature_2m",
-                "is_day",
-                "precipitation",
-                "weather_code",
-                "wind_speed_10m",
-                "wind_direction_10m",
-            ],
-        }
-        result = requests.get("https://api.open-meteo.com/v1/forecast", params=params)
-
-        if not result.ok:
-            print(
-                f"Could not reach the Open-Meteo server at this time: {result.status_code} - {result.text}"
-            )
-            return None
+        return _format_weather(_fetch(current_cache, current_params, position))
+    except Exception as e:
+        logger.warning(f"Could not get the weather from Open-Meteo: {e}")
+        return None
+
+
+def fetch_weather_batch(positions: list) -> list[str | None]:
+    """Like fetch_weather, for many positions with as few requests as possible"""
+    try:
+        responses = _fetch_batch(current_cache, current_params, positions)
+    except Exception as e:
+        logger.warning(f"Could not get the weather from Open-Meteo: {e}")
+        return [None] * len(positions)
+    return [_format_weather(response) for response in responses]
+
 
-        weather = result.json()
+def _format_weather(weather: dict | None) -> str | None:
+    if weather is None:
+        return None
+    try:
         weather_code = wmo_codes.get(
             str(weather.get("current", {}).get("weather_code", None)), {}
         ).get(
@@ -55,35 +281,35 @@ def fetch_weather(position) -> str | None:
 🌬️  {wind_speed}{wind_speed_unit} {wind_dir}
 """
     except Exception as e:
-        print(e)
+        logger.exception("Could not format the weather")
         return None
 
 
-def fetch_forecast(position) -> str | None:
+def fetch_forecast(position, compact: bool = False) -> str | None:
     try:
-        params = {
-            "latitude": position[0],
-            "longitude": position[1],
-            "daily": [
-                "weather_code",
-                "temperature_2m_max",
-                "temperature_2m_min",
-                "precipitation_sum",
-                "precipitation_probability_max",
-                "wind_speed_10m_max",
-                "wind_direction_10m_dominant",
-            ],
-            "timezone": "auto",
-        }
-        result = requests.get("https://api.open-meteo.com/v1/forecast", params=params)
-
-        if not result.ok:
-            print(
-                f"Could not reach the Open-Meteo server at this time: {result.status_code} - {result.text}"
-            )
-            return None
+        forecast = _fetch(forecast_cache, forecast_params, position)
+        if compact:
+            return _format_compact_forecast(forecast)
+        return _format_forecast(forecast)
+    except Exception as e:
+        logger.warning(f"Could not get the weather forecast from Open-Meteo: {e}")
+        return None
 
-        forecast = result.json()
+
+def fetch_forecast_batch(positions: list) -> list[str | None]:
+    """Like fetch_forecast, for many positions with as few requests as possible"""
+    try:
+        responses = _fetch_batch(forecast_cache, forecast_params, positions)
+    except Exception as e:
+        logger.warning(f"Could not get the weather from Open-Meteo: {e}")
+        return [None] * len(positions)
+    return [_format_forecast(response) for response in responses]
+
+
+def _format_forecast(forecast: dict | None) -> str | None:
+    if forecast is None:
+        return None
+    try:
         daily = forecast.get("daily", None)
         units = forecast.get("daily_units", None)
 
@@ -125,10 +351,77 @@ def fetch_forecast(position) -> str | None:
 
         return forecast_string
     except Exception as e:
-        print(e)
+        logger.exception("Could not format the weather forecast")
+        return None
+
+
+def _format_compact_forecast(forecast: dict | None) -> str | None:
+    """A forecast in as few bytes as possible, one line per day"""
+    if forecast is None:
+        return None
+    try:
+        daily = forecast.get("daily", None)
+        units = forecast.get("daily_units", None)
+        lines = []
+        for i, date in enumerate(daily["time"][:6]):
+            day = friendly_date(datetime.strptime(date, "%Y-%m-%d"))
+            icon = (
+                wmo_codes.get(str(daily["weather_code"][i]), {})
+                .get("day", {})
+                .get("icon", "")
+            )
+            lines.append(
+                f"{day.replace('Tomorrow', 'Tmrw')} {icon} "
+                f"{daily['temperature_2m_max'][i]}/{daily['temperature_2m_min'][i]}{units['temperature_2m_max']} "
+                f"{daily['precipitation_sum'][i]}{units['precipitation_sum']} "
+                f"{daily['precipitation_probability_max'][i]}{units['precipitation_probability_max']} "
+                f"{daily['wind_speed_10m_max'][i]}{units['wind_speed_10m_max']}"
+                f"{wind_direction(daily['wind_direction_10m_dominant'][i])}"
+            )
+        return "\n".join(lines)
+    except Exception as e:
+        logger.exception("Could not format the weather forecast")
         return None
 
 
+def prewarm(positions: list, refresh_within: float = 0) -> None:
+    """
+    Make sure the current weather and forecast for these positions are cached,
+    and won't expire within `refresh_within` seconds. Positions are taken in
+    order until the cache is full, so put the most important ones first.
+    Doesn't count towards the cache statistics.
+    """
+    try:
+        for cache, params in (
+            (current_cache, current_params),
+            (forecast_cache, forecast_params),
+        ):
+            _fetch_batch(
+                cache,
+                params,
+                _within_capacity(cache, positions),
+                refresh_within,
+                count=False,
+            )
+    except Exception as e:
+        logger.warning(f"Could not pre-warm the weather cache: {e}")
+
+
+def _within_capacity(cache: WeatherCache, positions: list) -> list:
+    # Filling the cache with more cells than it holds would only evict the
+    # ones we just fetched
+    cells = set()
+    selected = []
+    for position in positions:
+        cell = cache.cell(position)
+        if cell not in cells:
+            if len(cells) == cache.max_size:
+                continue
+            cells.add(cell)
+        selected.append(position)
+    return selected
+
+
 def wind_direction(direction) -> str:
     match direction:
         case dir if 0 <= dir < 22.5:
@@ -1,5 +1,6 @@
 from .meshwrapper import Message
 from .chatbot import Chatbot
+from . import reply_budget
 
 
 def register(bot: Chatbot):
@@ -12,9 +13,9 @@ def register(bot: Chatbot):
             "function": nodes_info,
         },
         {
-            "command": "/NODELIST",
+            "prefix": "/NODELIST",
             "module": "📡 Radio commands",
-            "description": "Get a list of the nodes I see",
+            "description": "/NODELIST [<page>] [COMPACT]: Get a list of the nodes I see",
             "channel": True,
             "function": node_list,
         },
@@ -31,34 +32,35 @@ def register(bot: Chatbot):
 def signal_report(message: Message):
     # Figure out who we're requesting a signal report about
     parts = message.text.split(" ")
+    needle = " ".join(parts[1:])
     if len(parts) == 1:
         # Send a signal report on the sender
         subject = message.fromNode
     else:
         # Send a signal report on the specified node
-        subject = message.nodelist.find(" ".join(parts[1:]))
+        subject = message.nodelist.find(needle)
+        if not subject and len(message.nodelist.candidates(needle)) > 1:
+            message.reply(
+                f"🤖🧨 I know more than one node called {needle}. Please use the node ID (example: !8e92a31f) instead."
+            )
+            return
 
     if not subject:
         message.reply(
             "🤖🧨 I don't know who that is. Sorry!\n\nI need the short name (example: TDRP), or node ID (example: !8e92a31f) of a node that I know."
+            + _did_you_mean(message, needle)
         )
         return
 
     if subject.hopsAway == 0:
         if subject.snr and subject.rssi:
-            message.reply(
-                f"🤖📶 I'm reading {subject.to_succinct_string()} with an SNR of {subject.snr} and an RSSI of {subject.rssi}."
-            )
+            report = f"🤖📶 I'm reading {subject.to_succinct_string()} with an SNR of {subject.snr} and an RSSI of {subject.rssi}."
         elif subject.snr:
-            message.reply(
-                f"🤖📶 I'm reading {subject.to_succinct_string()} with an SNR of {subject.snr}."
-            )
+            report = f"🤖📶 I'm reading {subject.to_succinct_string()} with an SNR of {subject.snr}."
         elif subject.rssi:
-            message.reply(
-                f"🤖📶 I'm reading {subject.to_succinct_string()} with an RSSI of {subject.rssi}."
-            )
+            report = f"🤖📶 I'm reading {subject.to_succinct_string()} with an RSSI of {subject.rssi}."
         else:
-            message.reply(
+            report = (
                 f"🤖📶 I don't have any readings for {subject.to_succinct_string()}."
             )
     else:
@@ -68,9 +70,13 @@ def signal_report(message: Message):
             if subject.snr
             else ""
         )
-        message.reply(
-            f"🤖📶 {subject.to_succinct_string()} is {subject.hopsAway} {'hop' if subject.hopsAway == 1 else 'hops'} away{snr}."
-        )
+        report = f"🤖📶 {subject.to_succinct_string()} is {subject.hopsAway} {'hop' if subject.hopsAway == 1 else 'hops'} away{snr}."
+
+    # A single reading is already in the report, but more are worth a summary
+    history = getattr(subject, "signal", None)
+    if history and len(history) > 1:
+        report += f"\n\n{history.describe()}"
+    message.reply(report)
 
 
 def nodes_info(message: Message):
@@ -78,6 +84,46 @@ def nodes_info(message: Message):
 
 
 def node_list(message: Message):
-    message.reply(
-        f"🤖👀 I've seen these nodes:\n\n{message.nodelist.to_succinct_string()}"
+    arguments = message.text.upper().split()[1:]
+    compact = "COMPACT" in arguments
+    page = next((int(arg) for arg in arguments if arg.isdecimal()), 1)
+
+    if compact:
+        lines = [
+            f"{node.shortName} {node.id}" for node in message.nodelist.nodes.values()
+        ]
+    else:
+        lines = [node.to_succinct_string() for node in message.nodelist.nodes.values()]
+
+    def render(lines: list[str], page: int, pages: int) -> str:
+        if pages == 1:
+            return f"🤖👀 I've seen these nodes:\n\n" + "\n".join(lines)
+        more = (
+            f", send /NODELIST {page + 1}{' COMPACT' if compact else ''} for more"
+            if page < pages
+            else ""
+        )
+        return (
+            f"🤖👀 I've seen these nodes (page {page} of {pages}{more}):\n\n"
+            + "\n".join(lines)
+        )
+
+    # Long lists would keep the channel busy for ages, so send them in pages
+    pages = reply_budget.paginate(
+        lines, render, reply_budget.max_parts(message.nodelist.interface)
+    )
+    if not 1 <= page <= len(pages):
+        message.reply(f"🤖🧨 There is no page {page}, I only have {len(pages)}.")
+        return
+    message.reply(pages[page - 1])
+
+
+def _did_you_mean(message: Message, needle: str) -> str:
+    suggestions = message.nodelist.search(needle, 3) if needle else []
+    if not suggestions:
+        return ""
+    return (
+        "\n\nDid you mean "
+        + " or ".join(node.to_succinct_string() for node in suggestions)
+        + "?"
     )
@@ -0,0 +1,66 @@
+from typing import Callable
+
+from .meshwrapper.airtime import airtime, modem_settings
+from .meshwrapper.node import MAX_SIZE
+from .meshwrapper.splitter import split_message
+from .config import config
+
+# How long a single reply may keep the channel busy, in seconds of air-time,
+# and how many packets it may take no matter how fast the modem preset is
+MAX_AIRTIME = float(config.get("REPLY_MAX_AIRTIME", 10))
+MAX_PARTS = int(config.get("REPLY_MAX_PARTS", 5))
+
+
+def max_parts(interface) -> int:
+    """Returns the number of full packets a reply may take on our modem preset"""
+    per_part = airtime(MAX_SIZE, modem_settings(interface))
+    return max(1, min(MAX_PARTS, int(MAX_AIRTIME // per_part)))
+
+
+def parts(text: str) -> int:
+    """Returns the number of packets it takes to send this text"""
+    return len(split_message(text, MAX_SIZE))
+
+
+def fits(text: str, interface) -> bool:
+    return parts(text) <= max_parts(interface)
+
+
+def paginate(
+    lines: list[str],
+    render: Callable[[list[str], int, int], str],
+    max_parts: int,
+) -> list[str]:
+    """
+    Divide the lines over pages, so that each page takes at most `max_parts`
+    packets to send. The `render` function turns the lines of a page, its page
+    number and the number of pages into the text to send.
+    """
+
+    def fits(count: int) -> bool:
+        # We don't know the number of pages yet, so leave room for a lot
+        return parts(render(lines[start : start + count], 999, 999)) <= max_parts
+
+    pages = []
+    start = 0
+    while start < len(lines):
+        # Find the most lines that fit on this page by doubling the number of
+        # lines until they don't fit, and then bisecting. A page always gets
+        # at least one line, even if that's too long by itself.
+        fitting, too_many = 1, 2
+        while start + fitting < len(lines) and fits(too_many):
+            fitting, too_many = too_many, too_many * 2
+        too_many = min(too_many, len(lines) - start + 1)
+        while too_many - fitting > 1:
+            middle = (fitting + too_many) // 2
+            if fits(middle):
+                fitting = middle
+            else:
+                too_many = middle
+        pages.append(lines[start : start + fitting])
+        start += fitting
+
+    pages = pages or [[]]
+    return [
+        render(page_lines, page, len(pages)) for page, page_lines in enumerate(pages, 1)
+    ]
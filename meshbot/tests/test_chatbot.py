@@ -1,5 +1,8 @@
+import time
+
 from meshbot.chatbot import Chatbot
 from meshbot.meshwrapper import Node, Message
+from meshbot.meshwrapper.node import Everyone
 
 
 def test_registration():
@@ -333,3 +336,133 @@ def test_multiple_catch_all_handlers_message_handling():
     bot.handle(message)
 
     assert called == 2, "Test message should have been handled by both commands"
+
+
+def _text_message(text, node_id, channel=0):
+    message = Message()
+    message.text = text
+    message.type = "TEXT_MESSAGE_APP"
+    message.channel = channel
+    message.fromNode = Node()
+    message.fromNode.id = node_id
+    message.toNode = Node()
+    return message
+
+
+def _conversation_bot(**kwargs):
+    bot = Chatbot(**kwargs)
+    handled = []
+    bot.add_state("TALK")
+    bot.add_command(
+        {
+            "command": "/TALK",
+            "function": lambda m: "TALK",
+        },
+        {
+            "state": "TALK",
+            "command": Chatbot.CATCH_ALL_TEXT,
+            "function": lambda m: handled.append(m.fromNode.id),
+        },
+        {
+            "state": "TALK",
+            "command": "/STOP",
+            "function": lambda m: "MAIN",
+        },
+    )
+    return bot, handled
+
+
+def test_state_per_conversation():
+    bot, handled = _conversation_bot()
+
+    bot.handle(_text_message("/TALK", "!00000001"))
+    bot.handle(_text_message("hello", "!00000001"))
+    bot.handle(_text_message("hello", "!00000002"))
+    bot.handle(_text_message("hello", "!00000001", channel=1))
+
+    assert handled == ["!00000001"]
+    assert bot.state(_text_message("", "!00000001")) == "TALK"
+    assert bot.state(_text_message("", "!00000002")) == "MAIN"
+
+    bot.handle(_text_message("/STOP", "!00000001"))
+    assert bot.state(_text_message("", "!00000001")) == "MAIN"
+
+
+def test_idle_conversations_expire():
+    bot, handled = _conversation_bot(conversation_timeout=0)
+
+    bot.handle(_text_message("/TALK", "!00000001"))
+    time.sleep(0.01)
+    bot.handle(_text_message("hello", "!00000001"))
+
+    assert handled == []
+    assert bot.state(_text_message("", "!00000001")) == "MAIN"
+
+
+def test_conversations_are_bounded():
+    bot, _ = _conversation_bot(max_conversations=10)
+
+    for i in range(100):
+        bot.handle(_text_message("/TALK", f"!{i:08x}"))
+
+    assert len(bot._conversations) == 10
+    assert bot.state(_text_message("", f"!{0:08x}")) == "MAIN"
+    assert bot.state(_text_message("", f"!{99:08x}")) == "TALK"
+
+
+def test_prefix_message_handling():
+    bot = Chatbot()
+    called = []
+
+    bot.add_command(
+        {
+            "prefix": ["/SIG", "/SIGNAL"],
+            "function": lambda m: called.append("signal"),
+        },
+        {
+            "prefix": "SEND",
+            "function": lambda m: called.append("send"),
+        },
+        {
+            "command": Chatbot.CATCH_ALL_TEXT,
+            "function": lambda m: called.append("catch all"),
+        },
+    )
+
+    bot.handle(_text_message(" /signal TDRP", "!00000001"))
+    bot.handle(_text_message("send TDRP hello", "!00000001"))
+    bot.handle(_text_message("/SI", "!00000001"))
+
+    assert called == ["signal", "send", "catch all"]
+
+
+def test_channel_and_private_scopes():
+    bot = Chatbot()
+    called = []
+
+    bot.add_command(
+        {
+            "command": "PRIVATE",
+            "function": lambda m: called.append("private"),
+        },
+        {
+            "command": "BOTH",
+            "channel": True,
+            "function": lambda m: called.append("both"),
+        },
+        {
+            "command": "CHANNEL",
+            "private": False,
+            "channel": True,
+            "function": lambda m: called.append("channel"),
+        },
+    )
+
+    for text in ["PRIVATE", "BOTH", "CHANNEL"]:
+        private = _text_message(text, "!00000001")
+        bot.handle(private)
+        in_channel = _text_message(text, "!00000001")
+        in_channel.toNode = Everyone
+        bot.handle(in_channel)
+
+    assert called == ["private", "both", "both", "channel"]
@@ -0,0 +1,65 @@
+from meshbot.chatbot import Chatbot
+from meshbot.meshwrapper import Node, Message
+
+
+class CountingDict(dict):
+    """Dictionary that counts the lookups done through `get`"""
+
+    lookups = 0
+
+    def get(self, *args):
+        CountingDict.lookups += 1
+        return super().get(*args)
+
+
+def _counting(trie: dict) -> CountingDict:
+    return CountingDict(
+        (key, value if key is None else _counting(value)) for key, value in trie.items()
+    )
+
+
+def _bot(num_commands, handled):
+    bot = Chatbot()
+    for i in range(num_commands):
+        if i % 2:
+            bot.add_command({"command": f"/CMD{i}", "function": handled.append})
+        else:
+            bot.add_command({"prefix": f"/PRE{i}", "function": handled.append})
+    bot.add_command({"command": Chatbot.CATCH_ALL_TEXT, "function": handled.append})
+    for table in bot._tables.values():
+        table.exact = CountingDict(table.exact)
+        table.prefixes = _counting(table.prefixes)
+    # Dispatching should never have to look at all the commands
+    bot.commands = None
+    return bot
+
+
+def _messages(count):
+    messages = []
+    for i in range(count):
+        message = Message()
+        message.type = "TEXT_MESSAGE_APP"
+        message.text = [f"/cmd{i % 200}", f"/pre{i % 200} argument", "hello"][i % 3]
+        message.fromNode = Node()
+        message.fromNode.id = f"!{i % 50:08x}"
+        message.toNode = Node()
+        messages.append(message)
+    return messages
+
+
+def _lookups(bot, messages):
+    CountingDict.lookups = 0
+    for message in messages:
+        bot.handle(message)
+    return CountingDict.lookups
+
+
+def test_dispatch_cost_does_not_depend_on_command_count():
+    messages = _messages(600)
+
+    # An exact lookup, and at most one step down the trie per character
+    most = sum(len(message.text) + 2 for message in messages)
+    for num_commands in (2, 2000):
+        handled = []
+        assert _lookups(_bot(num_commands, handled), messages) <= most
+        assert {id(m) for m in handled} == {id(m) for m in messages}
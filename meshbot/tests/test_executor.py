@@ -0,0 +1,90 @@
+import threading
+import time
+
+from meshbot.executor import Executor
+from meshbot.meshwrapper import Node, Message
+
+
+def _message(node_id, text):
+    message = Message()
+    message.type = "TEXT_MESSAGE_APP"
+    message.text = text
+    message.fromNode = Node()
+    message.fromNode.id = node_id
+    message.fromNode.shortName = "TEST"
+    message.fromNode.longName = "Test node"
+    message.fromNode.hopsAway = 0
+    message.toNode = message.fromNode
+    return message
+
+
+def _wait_until_handled(executor, count, timeout=2):
+    deadline = time.monotonic() + timeout
+    while executor.stats()["handled"] < count:
+        assert time.monotonic() < deadline, "Timed out waiting for handlers"
+        time.sleep(0.001)
+
+
+def test_conversations_keep_their_order():
+    handled = []
+
+    def handler(message):
+        time.sleep(0.001)
+        handled.append((message.fromNode.id, message.text))
+
+    executor = Executor(handler, workers=4)
+    for i in range(20):
+        for node in ["!00000001", "!00000002", "!00000003"]:
+            executor.submit(_message(node, i))
+    _wait_until_handled(executor, 60)
+
+    for node in ["!00000001", "!00000002", "!00000003"]:
+        assert [text for id, text in handled if id == node] == list(range(20))
+
+
+def test_slow_handler_does_not_block_others():
+    release = threading.Event()
+    handled = []
+
+    def handler(message):
+        if message.text == "slow":
+            release.wait()
+        handled.append(message.text)
+
+    executor = Executor(handler, workers=2)
+    executor.submit(_message("!00000001", "slow"))
+    executor.submit(_message("!00000002", "fast"))
+    _wait_until_handled(executor, 1)
+    assert handled == ["fast"]
+
+    release.set()
+    _wait_until_handled(executor, 2)
+
+
+def test_backpressure_and_metrics():
+    release = threading.Event()
+    executor = Executor(
+        lambda message: release.wait(), workers=1, max_queued=2, submit_timeout=0.01
+    )
+
+    assert executor.submit(_message("!00000001", "one"))
+    assert executor.submit(_message("!00000001", "two"))
+    assert not executor.submit(_message("!00000001", "three"))
+
+    release.set()
+    _wait_until_handled(executor, 2)
+    stats = executor.stats()
+    assert stats["dropped"] == 1
+    assert stats["maxQueued"] == 2
+    assert stats["queued"] == 0
+    assert stats["maxLatency"] >= stats["averageLatency"] > 0
+
+
+def test_failing_handler_is_counted():
+    def handler(message):
+        raise Exception("Oops")
+
+    executor = Executor(handler, workers=1)
+    executor.submit(_message("!00000001", "one"))
+    _wait_until_handled(executor, 1)
+    assert executor.stats()["failed"] == 1
@@ -0,0 +1,52 @@
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+from meshbot.http_client import HttpClient
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    requests_seen = 0
+    connections = set()
+
+    def do_GET(self):
+        Handler.requests_seen += 1
+        Handler.connections.add(self.client_address)
+        status = 503 if Handler.requests_seen == 1 else 200
+        self.send_response(status)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"ok")
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    Handler.requests_seen = 0
+    Handler.connections = set()
+    server = HTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+
+
+def test_retries_and_keeps_connections_alive(server):
+    client = HttpClient(backoff=0)
+
+    assert client.get(server + "/one").status_code == 200
+    assert client.get(server + "/two").status_code == 200
+    assert client.get(server + "/three").status_code == 200
+
+    assert Handler.requests_seen == 4, "The first request should have been retried"
+    assert len(Handler.connections) == 1, "All requests should share a connection"
+
+
+def test_timeouts():
+    client = HttpClient(connect_timeout=2, read_timeout=10)
+    assert client._timeout(None) == (2, 10)
+    assert client._timeout(60) == (2, 60)
@@ -0,0 +1,188 @@
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+
+import pytest
+
+from meshbot import message_box
+from meshbot.message_storage import MemoryStorage
+from meshbot.meshwrapper import Node, Message
+from meshbot.meshwrapper.node import MAX_SIZE
+from meshbot.meshwrapper.transmitter import BULK, INTERACTIVE, sent
+
+
+class Inline:
+    """Runs deliveries right away, so the tests don't have to wait for them"""
+
+    def submit(self, function, *args):
+        function(*args)
+
+
+@pytest.fixture(autouse=True)
+def storage(monkeypatch):
+    storage = MemoryStorage()
+    monkeypatch.setattr(message_box, "storage", storage)
+    monkeypatch.setattr(message_box, "lastNotified", {})
+    monkeypatch.setattr(message_box, "deliveries", Inline())
+    monkeypatch.setattr(message_box, "sending", set())
+    return storage
+
+
+class FakeNode(Node):
+    __slots__ = ("outbox", "delivers", "priorities")
+
+    def send(self, text, priority=INTERACTIVE, **kwargs):
+        self.outbox.append(text)
+        self.priorities.append(priority)
+        if isinstance(self.delivers, Future):
+            return self.delivers
+        if callable(self.delivers):
+            return sent(self.delivers(text))
+        return sent(self.delivers)
+
+
+def _telemetry_from(node_id, outbox):
+    node = FakeNode()
+    node.id = node_id
+    node.longName = "Test node"
+    node.outbox = outbox
+    node.delivers = True
+    node.priorities = []
+
+    message = Message()
+    message.type = "TELEMETRY_APP"
+    message.fromNode = node
+    message.toNode = Node()
+    return message
+
+
+def test_notify_user_skips_nodes_without_mail():
+    outbox = []
+    message = _telemetry_from("!00000001", outbox)
+    message.toNode = None  # Would blow up if we got past the fast path
+
+    message_box.notify_user(message)
+
+    assert outbox == []
+
+
+def test_notify_user_delivers_and_marks_read(storage):
+    outbox = []
+    storage.add("!00000001", "Sender", "Hello", datetime.now())
+
+    message_box.notify_user(_telemetry_from("!00000001", outbox))
+
+    assert len(outbox) == 2
+    assert "Hello" in outbox[1]
+    assert not storage.has_unread("!00000001")
+
+
+def test_notify_user_cooldown(storage, monkeypatch):
+    outbox = []
+    storage.add("!00000001", "Sender", "Hello", datetime.now())
+
+    # Deliveries fail, so the message stays unread
+    message = _telemetry_from("!00000001", outbox)
+    message.fromNode.delivers = False
+
+    message_box.notify_user(message)
+    message_box.notify_user(message)
+    assert len(outbox) == 2
+
+    monkeypatch.setattr(message_box, "NOTIFY_COOLDOWN", 0)
+    message_box.notify_user(message)
+    assert len(outbox) == 4
+
+
+def test_short_messages_are_delivered_together(storage, monkeypatch):
+    monkeypatch.setattr(message_box, "BATCH_DELIVERY", True)
+    outbox = []
+    for i in range(8):
+        storage.add("!00000001", f"Sender {i}", f"Message {i}", datetime.now())
+
+    message_box.notify_user(_telemetry_from("!00000001", outbox))
+
+    # The notification, and the eight messages packed into two packets
+    assert len(outbox) == 3
+    assert all(f"Message {i}" in "".join(outbox[1:]) for i in range(8))
+    assert all(len(text.encode("utf-8")) <= MAX_SIZE for text in outbox[1:])
+    assert not storage.has_unread("!00000001")
+
+
+def test_failed_delivery_resumes_where_it_left_off(storage):
+    outbox = []
+    for i in range(8):
+        storage.add("!00000001", "Sender", f"Message {i}: " + "x" * 80, datetime.now())
+
+    # The second packet with messages doesn't arrive
+    message = _telemetry_from("!00000001", outbox)
+    message.fromNode.delivers = lambda text: "Message 2" not in text
+    message_box.notify_user(message)
+
+    assert [
+        msg["contents"][:9] for msg in storage.messages("!00000001", read=False)
+    ] == [f"Message {i}" for i in range(2, 8)]
+
+    message.fromNode.delivers = True
+    outbox.clear()
+    messages = message_box._claim(message.fromNode, read=False)
+    message_box._send_messages(message.fromNode, messages, priority=BULK)
+
+    assert "Message 2" in outbox[0]
+    assert not storage.has_unread("!00000001")
+
+
+def test_only_unsolicited_deliveries_are_bulk(storage):
+    storage.add("!00000001", "Sender", "Hello", datetime.now())
+    message = _telemetry_from("!00000001", [])
+    message_box.notify_user(message)
+    assert message.fromNode.priorities == [BULK, BULK]
+
+    storage.add("!00000001", "Sender", "Hello again", datetime.now())
+    message = _telemetry_from("!00000001", [])
+    message_box.send_new_messages(message)
+    assert message.fromNode.priorities == [INTERACTIVE, INTERACTIVE]
+
+
+def test_deliveries_continue_on_the_mailbox_thread(storage, monkeypatch):
+    pool = ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr(message_box, "deliveries", pool)
+    threads = []
+    monkeypatch.setattr(
+        storage,
+        "mark_read",
+        lambda *args: threads.append(threading.current_thread()),
+    )
+    storage.add("!00000001", "Sender", "Hello", datetime.now())
+
+    message = _telemetry_from("!00000001", [])
+    message.fromNode.delivers = Future()
+    messages = message_box._claim(message.fromNode, read=False)
+    message_box._send_messages(message.fromNode, messages, priority=BULK)
+
+    # Like the transmitter thread resolving the delivery
+    message.fromNode.delivers.set_result(True)
+    pool.shutdown(wait=True)
+    assert threads and threading.current_thread() not in threads
+
+
+def test_messages_on_their_way_are_not_sent_again(storage, monkeypatch):
+    outbox = []
+    storage.add("!00000001", "Sender", "Hello", datetime.now())
+    message = _telemetry_from("!00000001", outbox)
+    message.fromNode.delivers = Future()
+
+    message_box.notify_user(message)
+    monkeypatch.setattr(message_box, "NOTIFY_COOLDOWN", 0)
+    message_box.notify_user(message)
+    message_box.send_new_messages(message)
+
+    assert sum("Hello" in text for text in outbox) == 1
+    assert sum("Sending it now" in text for text in outbox) == 1
+
+    # Once it failed to arrive, it may be sent again
+    message.fromNode.delivers.set_result(False)
+    message.fromNode.delivers = True
+    message_box.send_new_messages(message)
+    assert sum("Hello" in text for text in outbox) == 2
+    assert not storage.has_unread("!00000001")
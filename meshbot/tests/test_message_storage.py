@@ -0,0 +1,132 @@
+import threading
+from datetime import datetime
+
+import pytest
+
+from meshbot.message_storage import MemoryStorage, SqliteStorage, migrate
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def storage(request, tmp_path):
+    if request.param == "memory":
+        yield MemoryStorage()
+    else:
+        storage = SqliteStorage(str(tmp_path / "messages.sqlite"))
+        yield storage
+        storage.close()
+
+
+def test_counts_are_maintained(storage):
+    assert not storage.has_inbox("!00000001")
+    assert storage.stats("!00000001")["totalMessages"] == 0
+
+    first = storage.add("!00000001", "Sender", "Hello", datetime.now())
+    storage.add("!00000001", "Sender", "Hello again", datetime.now())
+    storage.add("!00000002", "Sender", "Someone else", datetime.now())
+
+    assert storage.has_inbox("!00000001")
+    assert storage.stats("!00000001") == {
+        "totalMessages": 2,
+        "numUnread": 2,
+        "numRead": 0,
+    }
+
+    assert storage.has_unread("!00000001")
+    storage.mark_read("!00000001", first)
+    storage.mark_read("!00000001", first)
+    assert storage.stats("!00000001") == {
+        "totalMessages": 2,
+        "numUnread": 1,
+        "numRead": 1,
+    }
+    assert [m["contents"] for m in storage.messages("!00000001", read=True)] == [
+        "Hello"
+    ]
+    assert [m["contents"] for m in storage.messages("!00000001", read=False)] == [
+        "Hello again"
+    ]
+
+    assert storage.clear_read("!00000001") == 1
+    assert storage.stats("!00000001") == {
+        "totalMessages": 1,
+        "numUnread": 1,
+        "numRead": 0,
+    }
+    assert len(storage.messages("!00000001")) == 1
+
+    storage.mark_read("!00000001", storage.messages("!00000001")[0]["id"])
+    assert not storage.has_unread("!00000001")
+    assert storage.stats("!00000002")["numUnread"] == 1
+
+
+def test_add_if_new_only_adds_once(storage):
+    added = []
+    threads = [
+        threading.Thread(
+            target=lambda: added.append(
+                storage.add_if_new("!00000001", "Meshbot", "Welcome", datetime.now())
+            )
+        )
+        for _ in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len([id for id in added if id is not None]) == 1
+    assert storage.stats("!00000001")["numUnread"] == 1
+    assert storage.has_unread("!00000001")
+    assert storage.add_if_new("!00000001", "Meshbot", "Again", datetime.now()) is None
+
+
+def test_sqlite_survives_restart(tmp_path):
+    path = str(tmp_path / "messages.sqlite")
+    storage = SqliteStorage(path)
+    id = storage.add("!00000001", "Sender", "Hello", datetime.now())
+    storage.mark_read("!00000001", id)
+    storage.add("!00000001", "Sender", "Unread", datetime.now())
+    storage.close()
+
+    storage = SqliteStorage(path)
+    assert storage.stats("!00000001") == {
+        "totalMessages": 2,
+        "numUnread": 1,
+        "numRead": 1,
+    }
+    assert storage.messages("!00000001", read=False)[0]["contents"] == "Unread"
+    assert storage.has_unread("!00000001")
+    storage.close()
+
+
+def test_migrate_from_memory(tmp_path):
+    timestamp = datetime(2024, 1, 1, 12, 0)
+    source = MemoryStorage(
+        {
+            "!00000001": [
+                {
+                    "sender": "A",
+                    "contents": "Read",
+                    "read": True,
+                    "timestamp": timestamp,
+                },
+                {
+                    "sender": "B",
+                    "contents": "Unread",
+                    "read": False,
+                    "timestamp": timestamp,
+                },
+            ],
+            "!00000002": [],
+        }
+    )
+    target = SqliteStorage(str(tmp_path / "messages.sqlite"))
+    migrate(source, target)
+
+    assert target.stats("!00000001") == source.stats("!00000001")
+    assert target.has_inbox("!00000002")
+    assert [m["timestamp"] for m in target.messages("!00000001")] == [
+        timestamp,
+        timestamp,
+    ]
+    target.close()
@@ -0,0 +1,88 @@
+import tracemalloc
+
+from meshbot.meshwrapper import Node, Message
+
+
+def _node_data(num):
+    return {
+        "num": num,
+        "user": {
+            "id": f"!{num:08x}",
+            "macaddr": "AAAAAAAA",
+            "hwModel": "HELTEC_V3",
+            "shortName": f"N{num}"[:4],
+            "longName": f"Node {num}",
+        },
+        "position": {"latitudeI": 499110000, "longitudeI": 92100000},
+        "lastHeard": 1700000000,
+        "hopsAway": 1,
+        "snr": 5.5,
+    }
+
+
+def _packets(count):
+    templates = [
+        {"portnum": "TEXT_MESSAGE_APP", "text": "Hello mesh"},
+        {
+            "portnum": "TELEMETRY_APP",
+            "telemetry": {
+                "deviceMetrics": {"batteryLevel": 90, "voltage": 4.1},
+                "raw": "...",
+            },
+        },
+        {
+            "portnum": "POSITION_APP",
+            "position": {"latitudeI": 499110000, "longitudeI": 92100000},
+        },
+        {"portnum": "NODEINFO_APP", "user": {"id": "!00000001", "raw": "..."}},
+    ]
+    return [
+        {
+            "id": i,
+            "from": i % 500 + 1,
+            "to": 0xFFFFFFFF,
+            "channel": 0,
+            "rxTime": 1700000000 + i,
+            "rxSnr": 5.5,
+            "rxRssi": -90,
+            "decoded": dict(templates[i % len(templates)]),
+        }
+        for i in range(count)
+    ]
+
+
+def _allocated(build):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    objects = build()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return objects, (after - before) / len(objects)
+
+
+class RecordingDict(dict):
+    """Decoded packet that remembers which sections were looked at"""
+
+    def get(self, key, default=None):
+        self.read.add(key)
+        return super().get(key, default)
+
+
+def test_packets_are_decoded_lazily():
+    decoded = RecordingDict(_packets(2)[1]["decoded"])
+    decoded.read = set()
+    message = Message.from_packet({"from": 1, "to": 2, "decoded": decoded})
+
+    assert decoded.read == {"portnum", "text"}
+    assert message.telemetry["deviceMetrics"]["batteryLevel"] == 90
+    assert "telemetry" in decoded.read
+
+
+def test_model_memory():
+    packets = _packets(50_000)
+    _, message_size = _allocated(lambda: [Message.from_packet(p) for p in packets])
+    data = [_node_data(num) for num in range(1, 5001)]
+    _, node_size = _allocated(lambda: [Node.from_packet(d, None) for d in data])
+
+    assert message_size < 400
+    assert node_size < 600
@@ -0,0 +1,313 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from meshbot.meshwrapper import Nodelist, name_index
+from meshbot.meshwrapper.node import Unknown
+from meshbot.meshwrapper.node_stats import ActiveWindow
+
+
+def fake_interface(num_nodes):
+    nodes = {
+        f"!{num:08x}": {
+            "num": num,
+            "user": {
+                "id": f"!{num:08x}",
+                "macaddr": "AAAAAAAA",
+                "hwModel": "HELTEC_V3",
+                "shortName": f"N{num}"[:4],
+                "longName": f"Node {num}",
+            },
+            "lastHeard": 0,
+            "hopsAway": 1,
+        }
+        for num in range(1, num_nodes + 1)
+    }
+    return SimpleNamespace(
+        nodes=nodes,
+        nodesByNum={node["num"]: node for node in nodes.values()},
+    )
+
+
+def test_packet_updates_sending_node():
+    nodelist = Nodelist.from_interface(fake_interface(3))
+
+    node = nodelist.on_packet(
+        {
+            "from": 2,
+            "to": 0xFFFFFFFF,
+            "rxTime": 1234,
+            "rxSnr": 5.5,
+            "rxRssi": -90,
+            "hopStart": 3,
+            "hopLimit": 3,
+            "decoded": {"portnum": "TELEMETRY_APP"},
+        }
+    )
+
+    assert node is nodelist.get(2)
+    assert node.lastHeard == 1234
+    assert node.snr == 5.5
+    assert node.rssi == -90
+    assert node.hopsAway == 0
+    assert nodelist.get(1).snr is None
+
+
+def test_nodeinfo_and_position_packets():
+    nodelist = Nodelist.from_interface(fake_interface(1))
+
+    nodelist.on_packet(
+        {
+            "from": 1,
+            "decoded": {
+                "portnum": "NODEINFO_APP",
+                "user": {
+                    "id": "!00000001",
+                    "macaddr": "AAAAAAAA",
+                    "shortName": "NEW",
+                    "longName": "New name",
+                },
+            },
+        }
+    )
+    nodelist.on_packet(
+        {
+            "from": 1,
+            "decoded": {
+                "portnum": "POSITION_APP",
+                "position": {"latitudeI": 499110000, "longitudeI": 92100000},
+            },
+        }
+    )
+
+    node = nodelist.get(1)
+    assert node.shortName == "NEW"
+    assert node.longName == "New name"
+    assert node.position == [49.911, 9.21, 0]
+
+
+def test_new_and_unknown_nodes():
+    interface = fake_interface(1)
+    nodelist = Nodelist.from_interface(interface)
+
+    interface.nodesByNum[5] = {"num": 5, "user": {"macaddr": "AA", "id": "!00000005"}}
+    assert nodelist.on_packet({"from": 5}).id == "!00000005"
+    assert 5 in nodelist.nodes
+    assert nodelist.on_packet({"from": 6}) is Unknown
+
+
+def test_view_is_read_only():
+    nodelist = Nodelist.from_interface(fake_interface(2))
+    view = nodelist.view()
+
+    assert view.get(1) is nodelist.get(1)
+    assert view.find("!00000002") is nodelist.get(2)
+    with pytest.raises(TypeError):
+        view.nodes[3] = None
+    with pytest.raises(AttributeError):
+        view.add(nodelist.get(1))
+
+
+def test_view_nodes_is_a_snapshot():
+    interface = fake_interface(2)
+    nodelist = Nodelist.from_interface(interface)
+    nodes = nodelist.view().nodes
+
+    interface.nodesByNum[5] = {"num": 5, "user": {"macaddr": "AA", "id": "!00000005"}}
+    for node in nodes.values():
+        # Would fail with "dictionary changed size during iteration"
+        nodelist.on_packet({"from": 5})
+
+    assert 5 not in nodes
+    assert 5 in nodelist.view().nodes
+
+
+def test_view_nodes_is_only_copied_when_nodes_are_added():
+    interface = fake_interface(2)
+    nodelist = Nodelist.from_interface(interface)
+    nodes = nodelist.view().nodes
+
+    nodelist.on_packet({"from": 1, "rxSnr": 1.0, "rxRssi": -80, "rxTime": 1})
+    assert nodelist.view().nodes is nodes
+
+    interface.nodesByNum[5] = {"num": 5, "user": {"macaddr": "AA", "id": "!00000005"}}
+    nodelist.on_packet({"from": 5})
+    assert nodelist.view().nodes is not nodes
+
+
+class NoIteration(dict):
+    """Node dictionary that fails the test when something loops over it"""
+
+    def __iter__(self):
+        raise AssertionError("Looked at every node")
+
+    keys = values = items = __iter__
+
+
+def test_packet_cost_does_not_depend_on_node_count():
+    nodelist = Nodelist.from_interface(fake_interface(2000))
+    nodelist.nodes = NoIteration(nodelist.nodes)
+
+    for num in (1, 1000, 2000):
+        nodelist.on_packet({"from": num, "rxSnr": 1.0, "rxRssi": -80, "rxTime": 1})
+        nodelist.on_packet(
+            {
+                "from": num,
+                "decoded": {
+                    "portnum": "NODEINFO_APP",
+                    "user": {
+                        "id": f"!{num:08x}",
+                        "macaddr": "AAAAAAAA",
+                        "shortName": "NEW",
+                        "longName": f"Renamed {num}",
+                    },
+                },
+            }
+        )
+        nodelist.view()
+
+    assert nodelist.find("Renamed 1000") is nodelist.nodes[1000]
+
+
+def test_find_by_name_and_id():
+    nodelist = Nodelist.from_interface(fake_interface(3))
+
+    assert nodelist.find_id("n2") == "!00000002"
+    assert nodelist.find_id("node 3") == "!00000003"
+    assert nodelist.find_id("00000001") == "!00000001"
+    assert nodelist.find_id("17") == "!00000011"
+    assert nodelist.find_id("²") is None
+    assert nodelist.find("!00000002") is nodelist.get(2)
+    assert nodelist.find("nobody") is None
+
+
+def test_renamed_node_is_reindexed():
+    nodelist = Nodelist.from_interface(fake_interface(1))
+    nodelist.on_packet(
+        {
+            "from": 1,
+            "decoded": {
+                "portnum": "NODEINFO_APP",
+                "user": {
+                    "id": "!00000001",
+                    "macaddr": "AAAAAAAA",
+                    "shortName": "NEW",
+                    "longName": "New",
+                },
+            },
+        }
+    )
+
+    assert nodelist.find("new") is nodelist.get(1)
+    assert nodelist.find("N1") is None
+
+
+def test_duplicate_short_names_are_ambiguous():
+    interface = fake_interface(2)
+    interface.nodes["!00000002"]["user"]["shortName"] = "N1"
+    nodelist = Nodelist.from_interface(interface)
+
+    assert nodelist.find_id("N1") is None
+    assert len(nodelist.candidates("n1")) == 2
+    assert nodelist.find_id("Node 2") == "!00000002"
+
+
+def test_self_node_is_cached():
+    interface = fake_interface(2)
+    interface.myInfo = SimpleNamespace(my_node_num=2)
+    interface.localNode = SimpleNamespace(nodeNum=2)
+    nodelist = Nodelist.from_interface(interface)
+
+    assert nodelist.get_self() is nodelist.get(2)
+
+
+def test_fuzzy_find():
+    interface = fake_interface(3)
+    interface.nodes["!00000002"]["user"]["longName"] = "Tim's Rooftop 🐢"
+    interface.nodes["!00000003"]["user"]["shortName"] = "🐢"
+    nodelist = Nodelist.from_interface(interface)
+
+    assert nodelist.find("tim's") is nodelist.get(2)
+    assert nodelist.find("rooftop") is nodelist.get(2)
+    assert nodelist.find("Tims Roftop") is None
+    assert nodelist.search("Tims Roftop")[0] is nodelist.get(2)
+    assert nodelist.find("🐢") is nodelist.get(3)
+
+
+def test_fuzzy_find_does_not_guess_between_equal_matches():
+    nodelist = Nodelist.from_interface(fake_interface(20))
+
+    # "Node 1" is an exact match, but "Node 1" is also a prefix of "Node 1x"
+    assert nodelist.find("node 1") is nodelist.get(1)
+    assert nodelist.find("node") is None
+    assert len(nodelist.search("node")) == 5
+
+
+def test_fuzzy_search_only_scores_a_few_nodes(monkeypatch):
+    nodelist = Nodelist.from_interface(fake_interface(5000))
+    scored = []
+    score = name_index._score
+    monkeypatch.setattr(
+        name_index, "_score", lambda *args: scored.append(args) or score(*args)
+    )
+
+    for needle in ("node 4242", "nod 123", "4999", "nobody"):
+        scored.clear()
+        nodelist.search(needle, limit=5)
+        # Both names of at most four times as many nodes as we asked for
+        assert len(scored) <= 2 * 5 * 4
+    assert nodelist.search("node 4242")[0] is nodelist.get(4242)
+
+
+def test_summary_windows():
+    interface = fake_interface(4)
+    now = time.time()
+    for num, ago, hops in ((1, 60, 0), (2, 20 * 60, 1), (3, 2 * 3600, 1), (4, 0, 2)):
+        interface.nodesByNum[num]["lastHeard"] = now - ago
+        interface.nodesByNum[num]["hopsAway"] = hops
+    interface.nodesByNum[4]["lastHeard"] = 0
+    nodelist = Nodelist.from_interface(interface)
+
+    assert nodelist.summary() == (
+        "I've seen 2 nodes in the past 30 minutes. Of which 1 directly connected and 1 one hop away."
+        "\n\nActive nodes: 1 in the past 5 minutes, 2 in the past hour and 3 in the past 24 hours."
+        "\n\nIn total I've seen 4 nodes. 1 of those were directly connected and 2 were one hop away."
+    )
+
+    # A direct packet moves node 3 into the 5 minute window
+    nodelist.on_packet({"from": 3, "rxTime": now, "hopStart": 3, "hopLimit": 3})
+    assert nodelist.summary().startswith(
+        "I've seen 3 nodes in the past 30 minutes. Of which 2 directly connected and 1 one hop away."
+        "\n\nActive nodes: 2 in the past 5 minutes"
+    )
+
+
+def test_active_window_stays_ordered_by_last_heard():
+    def node(num, heard):
+        return SimpleNamespace(num=num, lastHeard=heard, hopsAway=0)
+
+    window = ActiveWindow(60)
+    window.heard(node(1, 100))
+    window.heard(node(2, 150))
+
+    # A packet without a newer time doesn't make node 1 look recent, and a
+    # late report for node 3 goes in front of node 2
+    window.heard(node(1, 100))
+    window.heard(node(3, 120))
+    assert list(window.nodes) == [1, 3, 2]
+
+    window.expire(190)
+    assert list(window.nodes) == [2]
+    assert +window.hops == {0: 1}
+
+
+def test_packets_are_recorded_in_signal_history():
+    nodelist = Nodelist.from_interface(fake_interface(2))
+    for snr in (1.0, -3.0, 5.0):
+        nodelist.on_packet({"from": 1, "rxTime": 1, "rxSnr": snr, "rxRssi": -90})
+    nodelist.on_packet({"from": 1, "decoded": {"portnum": "TELEMETRY_APP"}})
+
+    assert nodelist.get(1).signal.values("snr") == [1.0, -3.0, 5.0]
+    assert nodelist.get(1).signal.percentile("snr", 50) == 1.0
+    assert nodelist.get(2).signal is None
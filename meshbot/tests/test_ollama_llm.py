@@ -0,0 +1,354 @@
+import json
+import time
+from collections import OrderedDict
+from types import SimpleNamespace
+
+import requests
+
+from meshbot import ollama_llm
+from meshbot.meshwrapper import Node, Nodelist, Message
+from meshbot.meshwrapper.node import Everyone, Unknown
+from meshbot.ollama_llm import MessageChunker, _consume_stream
+
+
+class FakeStream:
+    def __init__(self, chunks):
+        self.lines = [json.dumps(chunk).encode() for chunk in chunks]
+        self.closed = False
+
+    def iter_lines(self):
+        return iter(self.lines)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.closed = True
+
+
+def test_chunker_keeps_short_replies_together():
+    chunker = MessageChunker(size=50)
+    assert chunker.feed("Hello there! ") == []
+    assert chunker.feed("How are you?") == []
+    assert chunker.flush() == ["Hello there! How are you?"]
+    assert chunker.flush() == []
+
+
+def test_chunker_cuts_at_sentence_end():
+    chunker = MessageChunker(size=30)
+    parts = chunker.feed("This is sentence one. This is sentence two. ")
+    assert parts == ["This is sentence one."]
+    assert chunker.flush() == ["This is sentence two."]
+
+
+def test_chunker_respects_byte_budget():
+    chunker = MessageChunker(size=10)
+    parts = chunker.feed("📡📡📡📡📡📡📡📡") + chunker.flush()
+    assert all(len(part.encode("utf-8")) <= 10 for part in parts)
+    assert "".join(parts) == "📡📡📡📡📡📡📡📡"
+
+
+def test_consume_stream():
+    words = ["Signal ", "is ", "good. ", "Weather ", "is ", "fine", "."]
+    chunks = [{"message": {"content": word}, "done": False} for word in words]
+    chunks.append({"message": {"content": ""}, "done": True})
+
+    parts = []
+    stream = FakeStream(chunks)
+    result = _consume_stream(stream, parts.append)
+
+    assert "".join(words) == result["message"]["content"]
+    assert " ".join(parts) == "Signal is good. Weather is fine."
+    assert stream.closed
+
+
+def test_consume_stream_sends_text_before_tool_calls():
+    call = {"function": {"name": "get_current_weather", "arguments": {}}}
+    chunks = [
+        {"message": {"content": "Let me check."}, "done": False},
+        {"message": {"content": "", "tool_calls": [call]}, "done": True},
+    ]
+
+    parts = []
+    result = _consume_stream(FakeStream(chunks), parts.append)
+
+    assert result["message"]["tool_calls"] == [call]
+    assert parts == ["Let me check."]
+
+
+class BrokenStream(FakeStream):
+    """Breaks off after the given chunks"""
+
+    ok = True
+
+    def iter_lines(self):
+        yield from self.lines
+        raise requests.exceptions.ConnectionError("Connection reset")
+
+    def post(self, url, json, **kwargs):
+        return self
+
+
+def test_errors_are_sent_after_streamed_parts(monkeypatch):
+    chunks = [{"message": {"content": "Signal is good. "}, "done": False}] * 20
+    monkeypatch.setattr(ollama_llm, "http", BrokenStream(chunks))
+    monkeypatch.setitem(ollama_llm.config, "OLLAMA_MODEL", "test")
+    monkeypatch.setitem(ollama_llm.config, "OLLAMA_API", "http://ollama")
+    monkeypatch.setitem(ollama_llm.config, "OLLAMA_USE_TOOLS", "False")
+
+    parts = []
+    reply = ollama_llm._reply_from_ollama([], Nodelist(), on_part=parts.append)
+
+    assert parts[0].startswith("Signal is good.")
+    assert parts[-1] == reply
+    assert reply.startswith("Could not reach the Ollama server")
+
+
+def test_invalid_json_in_the_stream_is_reported(monkeypatch):
+    stream = FakeStream([{"message": {"content": "Signal is good. "}}] * 20)
+    stream.lines.append(b'{"message": {"cont')
+    stream.ok = True
+    monkeypatch.setattr(
+        ollama_llm, "http", SimpleNamespace(post=lambda *a, **k: stream)
+    )
+    monkeypatch.setitem(ollama_llm.config, "OLLAMA_MODEL", "test")
+    monkeypatch.setitem(ollama_llm.config, "OLLAMA_API", "http://ollama")
+    monkeypatch.setitem(ollama_llm.config, "OLLAMA_USE_TOOLS", "False")
+
+    parts = []
+    reply = ollama_llm._reply_from_ollama([], Nodelist(), on_part=parts.append)
+
+    assert parts[-1] == reply
+    assert reply.startswith("Could not reach the Ollama server")
+    assert stream.closed
+
+
+def _turns(count, size=100):
+    conversation = [{"role": "system", "content": "You are Meshbot"}]
+    for i in range(count):
+        conversation.append({"role": "user", "content": f"Question {i} " + "x" * size})
+        conversation.append({"role": "tool", "content": "y" * size})
+        conversation.append({"role": "assistant", "content": f"Answer {i}"})
+    return conversation
+
+
+def test_trim_keeps_system_prompt_and_latest_turns(monkeypatch):
+    monkeypatch.setattr(ollama_llm, "CONTEXT_TOKENS", 200)
+    conversation = _turns(20)
+
+    ollama_llm._trim(conversation)
+
+    assert ollama_llm._tokens(conversation) <= 200
+    assert conversation[0]["content"] == "You are Meshbot"
+    assert conversation[1]["role"] == "user", "Should never start with a half turn"
+    assert conversation[-1]["content"] == "Answer 19"
+
+
+def test_trim_summarizes_forgotten_turns(monkeypatch):
+    monkeypatch.setattr(ollama_llm, "CONTEXT_TOKENS", 200)
+    monkeypatch.setitem(ollama_llm.config, "OLLAMA_SUMMARIZE", "True")
+    summarized = []
+
+    def summarize(previous, messages):
+        summarized.append((previous, messages))
+        return f"Summary {len(summarized)}"
+
+    monkeypatch.setattr(ollama_llm, "_summarize", summarize)
+    conversation = _turns(20)
+
+    ollama_llm._trim(conversation)
+    assert conversation[1]["role"] == "system"
+    assert conversation[1]["content"].endswith("Summary 1")
+
+    conversation += _turns(5)[1:]
+    ollama_llm._trim(conversation)
+    assert summarized[1][0].endswith("Summary 1")
+    assert conversation[1]["content"].endswith("Summary 2")
+    assert conversation[2]["role"] == "user"
+
+
+def test_least_recently_used_conversations_are_forgotten(monkeypatch):
+    monkeypatch.setattr(ollama_llm, "MAX_CONVERSATIONS", 3)
+    monkeypatch.setattr(ollama_llm, "conversations", OrderedDict())
+    monkeypatch.setattr(ollama_llm, "_gather_relevant_stats", lambda message: {})
+
+    messages = []
+    for i in range(4):
+        message = Message()
+        message.fromNode = Node()
+        message.fromNode.id = f"!{i:08x}"
+        messages.append(message)
+
+    for message in messages[:3]:
+        ollama_llm._new_conversation(message)
+    assert ollama_llm._recall(ollama_llm.identifier(messages[0]))
+    ollama_llm._new_conversation(messages[3])
+
+    assert ollama_llm._recall(ollama_llm.identifier(messages[0]))
+    assert ollama_llm._recall(ollama_llm.identifier(messages[1])) is None
+    assert len(ollama_llm.conversations) == 3
+
+
+class FakeNode(Node):
+    __slots__ = ("myself",)
+
+    def is_self(self):
+        return self.myself
+
+
+def _node(num, hops, last_heard):
+    node = FakeNode()
+    node.num = num
+    node.id = f"!{num:08x}"
+    node.shortName = f"N{num}"
+    node.longName = f"Node {num}"
+    node.hopsAway = hops
+    node.lastHeard = last_heard
+    node.myself = num == 1
+    return node
+
+
+def test_channel_context_only_has_relevant_nodes(monkeypatch):
+    monkeypatch.setitem(ollama_llm.config, "OLLAMA_CONTEXT_NODES", "4")
+    now = time.time()
+    nodelist = Nodelist()
+    nodelist.add(_node(1, 0, now))  # Meshbot itself
+    nodelist.add(_node(2, 3, now - 3 * 24 * 60 * 60))  # The sender, long ago
+    nodelist.add(_node(3, 2, now - 60))
+    nodelist.add(_node(4, 0, now - 600))
+    nodelist.add(_node(5, 1, now - 30))
+    nodelist.add(_node(6, 0, now - 3 * 24 * 60 * 60))  # Not heard recently
+    for num in range(7, 500):
+        nodelist.add(_node(num, 4, now - 3600 - num))
+
+    message = Message()
+    message.fromNode = nodelist.get(2)
+    message.toNode = Everyone
+    message.nodelist = nodelist
+
+    stats = ollama_llm._gather_relevant_stats(message)
+    assert [user["id"] for user in stats["users"]] == [
+        "!00000002",
+        "!00000003",
+        "!00000004",
+        "!00000005",
+    ]
+    assert str(stats) == str(ollama_llm._gather_relevant_stats(message))
+
+
+class FakeOllama:
+    """Keeps calling tools for as long as it is allowed to"""
+
+    ok = True
+
+    def __init__(self, calls_per_round):
+        self.calls_per_round = calls_per_round
+        self.requests = []
+
+    def post(self, url, json, **kwargs):
+        self.requests.append(json)
+        self.last = json
+        return self
+
+    def json(self):
+        if "tools" not in self.last:
+            return {"message": {"content": "Done"}}
+        calls = [
+            {"function": {"name": "get_current_weather", "arguments": {"node": node}}}
+            for node in self.calls_per_round
+        ]
+        return {"message": {"content": "", "tool_calls": calls}}
+
+
+def test_tool_calls_run_in_parallel_with_timeout(monkeypatch):
+    nodelist = Nodelist()
+    for num in range(1, 5):
+        node = _node(num, 0, time.time())
+        node.position = [num, num]
+        nodelist.add(node)
+
+    def fetch_weather(position):
+        if position[0] == 4:
+            time.sleep(1)
+        time.sleep(0.2)
+        return f"Weather at {position[0]}"
+
+    ollama = FakeOllama(["!00000001", "!00000002", "!00000003", "!00000004", "NOPE"])
+    monkeypatch.setattr(ollama_llm, "http", ollama)
+    monkeypatch.setattr(ollama_llm, "fetch_weather", fetch_weather)
+    monkeypatch.setattr(ollama_llm, "TOOL_TIMEOUT", 0.5)
+    monkeypatch.setattr(ollama_llm, "MAX_TOOL_ROUNDS", 1)
+    monkeypatch.setitem(ollama_llm.config, "OLLAMA_MODEL", "test")
+    monkeypatch.setitem(ollama_llm.config, "OLLAMA_API", "http://ollama")
+    monkeypatch.setitem(ollama_llm.config, "OLLAMA_USE_TOOLS", "True")
+
+    conversation = []
+    start = time.monotonic()
+    reply = ollama_llm._reply_from_ollama(conversation, nodelist)
+
+    assert time.monotonic() - start < 0.9, "Tools should run in parallel"
+    assert reply == "Done"
+    assert len(ollama.requests) == 2, "Should stop calling tools after one round"
+    assert [msg["content"] for msg in conversation] == [
+        "Weather at 1",
+        "Weather at 2",
+        "Weather at 3",
+        "This function took too long, try again later",
+        "There is no known node NOPE",
+    ]
+
+
+def test_tool_calls_are_timed_from_when_they_start(monkeypatch):
+    nodelist = Nodelist()
+    for num in range(1, 9):
+        node = _node(num, 0, time.time())
+        node.position = [num, num]
+        nodelist.add(node)
+
+    def fetch_weather(position):
+        time.sleep(0.3)
+        return f"Weather at {position[0]}"
+
+    # More calls than there are CPUs or executor workers, none of which is
+    # slow by itself
+    ollama = FakeOllama([f"!{num:08x}" for num in range(1, 9)])
+    monkeypatch.setattr(ollama_llm, "http", ollama)
+    monkeypatch.setattr(ollama_llm, "fetch_weather", fetch_weather)
+    monkeypatch.setattr(ollama_llm, "TOOL_TIMEOUT", 0.5)
+    monkeypatch.setattr(ollama_llm, "MAX_TOOL_ROUNDS", 1)
+    monkeypatch.setitem(ollama_llm.config, "OLLAMA_MODEL", "test")
+    monkeypatch.setitem(ollama_llm.config, "OLLAMA_API", "http://ollama")
+    monkeypatch.setitem(ollama_llm.config, "OLLAMA_USE_TOOLS", "True")
+
+    conversation = []
+    ollama_llm._reply_from_ollama(conversation, nodelist)
+
+    assert [msg["content"] for msg in conversation] == [
+        f"Weather at {num}" for num in range(1, 9)
+    ]
+
+
+def test_channel_context_for_an_unknown_sender():
+    nodelist = Nodelist()
+    nodelist.add(_node(2, 0, time.time()))
+
+    message = Message()
+    message.fromNode = Unknown
+    message.toNode = Everyone
+    message.nodelist = nodelist
+
+    assert ollama_llm._relevant_nodes(message) == [nodelist.get(2), Unknown]
+
+
+def test_tool_calls_with_odd_arguments_do_not_raise():
+    nodelist = Nodelist()
+    nodelist.add(_node(2, 3, time.time()))
+
+    def call(arguments):
+        return {"function": {"name": "get_hops", "arguments": arguments}}
+
+    assert "3 hops away" in ollama_llm._call_tool(
+        call('{"node": "!00000002"}'), nodelist
+    )
+    assert "failed" in ollama_llm._call_tool(call('{"node": '), nodelist)
+    assert ollama_llm._call_tool(call({"node": "!12345678xyz"}), nodelist)
@@ -0,0 +1,227 @@
+import threading
+import time
+
+import pytest
+
+from meshbot import open_meteo
+from meshbot.open_meteo import WeatherCache
+
+
+class FakeResponse:
+    ok = True
+    status_code = 200
+    text = ""
+
+    def __init__(self, data):
+        self.data = data
+
+    def json(self):
+        return self.data
+
+
+@pytest.fixture
+def requests_made(monkeypatch):
+    requests_made = []
+
+    def get(url, params):
+        requests_made.append(params)
+        responses = [
+            {
+                "current": {
+                    "temperature_2m": float(latitude),
+                    "weather_code": 0,
+                    "is_day": 1,
+                    "wind_direction_10m": 180,
+                },
+                "current_units": {"temperature_2m": "°C"},
+            }
+            for latitude in params["latitude"].split(",")
+        ]
+        return FakeResponse(responses if len(responses) > 1 else responses[0])
+
+    monkeypatch.setattr(open_meteo.http, "get", get)
+    monkeypatch.setattr(open_meteo, "current_cache", WeatherCache(0.05, 60, 10))
+    return requests_made
+
+
+def test_nearby_positions_share_a_cell():
+    cache = WeatherCache(0.05, 60, 10)
+    assert cache.cell([49.911, 9.210]) == cache.cell([49.902, 9.224]) == (49.9, 9.2)
+    assert cache.cell([49.911, 9.210]) != cache.cell([49.99, 9.210])
+
+
+def test_ttl_and_lru_eviction():
+    cache = WeatherCache(0.05, 60, 2)
+    cache.put((1, 1), {"a": 1})
+    cache.put((2, 2), {"b": 2})
+    assert cache.get((1, 1)) == {"a": 1}
+    cache.put((3, 3), {"c": 3})
+
+    assert cache.get((2, 2)) is None, "Least recently used entry should be evicted"
+    assert cache.get((1, 1)) == {"a": 1}
+    assert cache.stats() == {"size": 2, "hits": 2, "misses": 1}
+
+    expired = WeatherCache(0.05, -1, 2)
+    expired.put((1, 1), {"a": 1})
+    assert expired.get((1, 1)) is None
+
+
+def test_fetch_weather_uses_cache(requests_made):
+    first = open_meteo.fetch_weather([49.911, 9.210])
+    second = open_meteo.fetch_weather([49.903, 9.219])
+    open_meteo.fetch_weather([52.0, 5.0])
+
+    assert "49.9°C" in first
+    assert first == second
+    assert len(requests_made) == 2
+    assert (requests_made[0]["latitude"], requests_made[0]["longitude"]) == (
+        "49.9",
+        "9.2",
+    )
+    assert open_meteo.current_cache.stats()["hits"] == 1
+
+
+def test_concurrent_requests_are_coalesced(requests_made, monkeypatch):
+    release = threading.Event()
+    slow_get = open_meteo.http.get
+
+    def get(url, params):
+        release.wait()
+        return slow_get(url, params)
+
+    monkeypatch.setattr(open_meteo.http, "get", get)
+
+    results = []
+    threads = [
+        threading.Thread(
+            target=lambda i=i: results.append(
+                open_meteo.fetch_weather([49.9 + i / 1000, 9.2])
+            )
+        )
+        for i in range(10)
+    ]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.1)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(requests_made) == 1
+    assert len(results) == 10
+    assert all(result == results[0] and "49.9°C" in result for result in results)
+    assert open_meteo.in_flight == {}
+
+
+def test_batch_fetch(requests_made):
+    open_meteo.fetch_weather([52.0, 5.0])
+    positions = [[49.911, 9.210], [52.0, 5.0], [49.902, 9.224], [48.1, 11.6]]
+
+    reports = open_meteo.fetch_weather_batch(positions)
+
+    assert len(requests_made) == 2, "Uncached cells should be fetched in one go"
+    assert requests_made[1]["latitude"] == "49.9,48.1"
+    assert ["49.9°C" in reports[0], "52.0°C" in reports[1]] == [True, True]
+    assert reports[0] == reports[2]
+    assert "48.1°C" in reports[3]
+
+
+def test_prewarm_refreshes_entries_about_to_expire(requests_made, monkeypatch):
+    monkeypatch.setattr(open_meteo, "forecast_cache", WeatherCache(0.05, 60, 10))
+    monkeypatch.setattr(open_meteo, "_request_batch", _counting(requests_made))
+    positions = [[49.911, 9.210], [48.1, 11.6]]
+
+    open_meteo.prewarm(positions)
+    assert len(requests_made) == 2, "One batch for weather, one for forecasts"
+    open_meteo.prewarm(positions, refresh_within=30)
+    assert len(requests_made) == 2, "Nothing expires within 30 seconds"
+    open_meteo.prewarm(positions, refresh_within=120)
+    assert len(requests_made) == 4
+
+
+def test_prewarm_waits_for_requests_underway(requests_made, monkeypatch):
+    release = threading.Event()
+    slow_get = open_meteo.http.get
+
+    def get(url, params):
+        release.wait()
+        return slow_get(url, params)
+
+    monkeypatch.setattr(open_meteo.http, "get", get)
+    monkeypatch.setattr(open_meteo, "forecast_cache", WeatherCache(0.05, 60, 10))
+
+    user = threading.Thread(target=open_meteo.fetch_weather, args=([49.9, 9.2],))
+    user.start()
+    time.sleep(0.05)
+    prewarm = threading.Thread(
+        target=open_meteo.prewarm, args=([[49.9, 9.2], [48.1, 11.6]],)
+    )
+    prewarm.start()
+    time.sleep(0.05)
+    release.set()
+    user.join()
+    prewarm.join()
+
+    # The user's request for 49.9 and one batch for the weather at 48.1 only,
+    # and one for the forecasts
+    latitudes = sorted(request["latitude"] for request in requests_made)
+    assert latitudes == ["48.1", "49.9", "49.9,48.1"]
+    assert open_meteo.in_flight == {}
+
+
+def test_fetched_cells_are_not_counted_as_hits(requests_made, monkeypatch):
+    monkeypatch.setattr(open_meteo, "forecast_cache", WeatherCache(0.05, 60, 10))
+    open_meteo.prewarm([[49.9, 9.2]])
+    assert open_meteo.current_cache.stats()["hits"] == 0
+    assert open_meteo.current_cache.stats()["misses"] == 0
+
+    open_meteo.fetch_weather_batch([[49.9, 9.2], [48.1, 11.6]])
+    assert open_meteo.current_cache.stats() == {"size": 2, "hits": 1, "misses": 1}
+
+
+def test_prewarm_does_not_overfill_the_cache(requests_made, monkeypatch):
+    monkeypatch.setattr(open_meteo, "forecast_cache", WeatherCache(0.05, 60, 10))
+    monkeypatch.setattr(open_meteo, "_request_batch", _counting(requests_made))
+    positions = [[40 + i, 5.0] for i in range(15)]
+
+    open_meteo.prewarm(positions)
+
+    assert [len(cells) for cells in requests_made] == [10, 10]
+    assert all(
+        open_meteo.current_cache.get((40.0 + i, 5.0)) is not None for i in range(10)
+    )
+
+
+def _counting(requests_made):
+    def request_batch(params, cells):
+        requests_made.append(cells)
+        return [{} for _ in cells]
+
+    return request_batch
+
+
+def test_compact_forecast():
+    forecast = {
+        "daily": {
+            "time": ["2024-06-01", "2024-06-02"],
+            "weather_code": [0, 61],
+            "temperature_2m_max": [21.3, 18.0],
+            "temperature_2m_min": [12.1, 10.4],
+            "precipitation_sum": [0.0, 4.2],
+            "precipitation_probability_max": [5, 80],
+            "wind_speed_10m_max": [12.5, 20.1],
+            "wind_direction_10m_dominant": [180, 270],
+        },
+        "daily_units": {
+            "temperature_2m_max": "°C",
+            "precipitation_sum": "mm",
+            "precipitation_probability_max": "%",
+            "wind_speed_10m_max": "km/h",
+        },
+    }
+
+    compact = open_meteo._format_compact_forecast(forecast)
+
+    assert compact.count("\n") == 1
+    assert "21.3/12.1°C 0.0mm 5% 12.5km/h↑" in compact
+    assert len(compact.encode("utf-8")) < 120
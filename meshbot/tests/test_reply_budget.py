@@ -0,0 +1,87 @@
+from types import SimpleNamespace
+
+from meshtastic.protobuf import localonly_pb2
+
+from meshbot import reply_budget, radio_commands
+from meshbot.meshwrapper import Nodelist, Message
+from meshbot.meshwrapper.airtime import MODEM_PRESETS, airtime
+from meshbot.meshwrapper.node import MAX_SIZE
+from meshbot.tests.test_nodelist import fake_interface
+
+
+class FakeMessage(Message):
+    __slots__ = ("replies",)
+
+    def reply(self, text, **kwargs):
+        self.replies.append(text)
+
+
+def _interface(preset):
+    config = localonly_pb2.LocalConfig()
+    config.lora.use_preset = True
+    config.lora.modem_preset = preset
+    return SimpleNamespace(localNode=SimpleNamespace(localConfig=config))
+
+
+def test_airtime():
+    # Known values for a full packet
+    assert 2.0 < airtime(MAX_SIZE, MODEM_PRESETS["LONG_FAST"]) < 2.3
+    assert airtime(MAX_SIZE, MODEM_PRESETS["SHORT_FAST"]) < 0.25
+    assert airtime(10) < airtime(100) < airtime(200)
+
+
+def test_slower_presets_get_fewer_parts(monkeypatch):
+    monkeypatch.setattr(reply_budget, "MAX_AIRTIME", 10)
+    monkeypatch.setattr(reply_budget, "MAX_PARTS", 5)
+
+    assert reply_budget.max_parts(_interface(0)) == 4  # LONG_FAST
+    assert reply_budget.max_parts(_interface(1)) == 1  # LONG_SLOW
+    assert reply_budget.max_parts(_interface(6)) == 5  # SHORT_FAST
+    assert reply_budget.max_parts(None) == 4
+
+
+def test_pages_fit_the_budget():
+    lines = [f"Line number {i} with some text in it" for i in range(200)]
+
+    def render(lines, page, pages):
+        return f"Page {page}/{pages}\n" + "\n".join(lines)
+
+    pages = reply_budget.paginate(lines, render, 2)
+
+    assert len(pages) > 1
+    assert all(reply_budget.parts(page) <= 2 for page in pages)
+    assert pages[-1].startswith(f"Page {len(pages)}/{len(pages)}\n")
+    assert sum(page.count("Line number") for page in pages) == 200
+
+
+def _node_list(text, num_nodes):
+    message = FakeMessage()
+    message.replies = []
+    message.text = text
+    message.nodelist = Nodelist.from_interface(fake_interface(num_nodes)).view()
+    radio_commands.node_list(message)
+    return message.replies[0]
+
+
+def test_node_list_pages():
+    assert _node_list("/NODELIST", 3) == (
+        "🤖👀 I've seen these nodes:\n\n"
+        "[N1] Node 1 (!00000001)\n[N2] Node 2 (!00000002)\n[N3] Node 3 (!00000003)"
+    )
+
+    first = _node_list("/NODELIST", 200)
+    assert "send /NODELIST 2 for more" in first
+    assert reply_budget.parts(first) <= reply_budget.max_parts(None)
+    assert "[N1] Node 1 (!00000001)" not in _node_list("/NODELIST 2", 200)
+    assert _node_list("/NODELIST 99", 200).startswith("🤖🧨 There is no page 99")
+
+
+def test_compact_node_list_takes_fewer_pages():
+    full = _node_list("/NODELIST", 200)
+    compact = _node_list("/nodelist compact", 200)
+
+    assert "N1 !00000001" in compact
+    assert "send /NODELIST 2 COMPACT for more" in compact
+    assert int(compact.split(" of ")[1].split(",")[0]) < int(
+        full.split(" of ")[1].split(",")[0]
+    )
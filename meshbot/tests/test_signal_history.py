@@ -0,0 +1,51 @@
+import sys
+
+from meshbot.meshwrapper.signal_history import SignalHistory
+
+
+def test_keeps_the_most_recent_samples():
+    history = SignalHistory(size=4)
+    for i in range(6):
+        history.add(i, snr=i, rssi=-100 + i, hops=0)
+
+    assert len(history) == 4
+    assert history.values("snr") == [2, 3, 4, 5]
+    assert history.values("rssi", since=4) == [-96, -95]
+
+
+def test_stats_skip_missing_readings():
+    history = SignalHistory()
+    history.add(1, snr=-5.5, rssi=-110)
+    history.add(2, snr=None, rssi=-90)
+    history.add(3, snr=2.5)
+
+    assert history.stats("snr") == {
+        "count": 2,
+        "min": -5.5,
+        "avg": -1.5,
+        "max": 2.5,
+        "median": -5.5,
+    }
+    assert history.percentile("rssi", 90) == -90
+    assert history.stats("hops") is None
+    assert history.describe() == (
+        "Over the last 3 packets: SNR between -5.5 and 2.5 (average -1.5, median -5.5), "
+        "RSSI between -110 and -90 (average -100, median -110)."
+    )
+
+
+def _size(history):
+    return sys.getsizeof(history) + sum(
+        sys.getsizeof(getattr(history, name)) for name in SignalHistory.__slots__
+    )
+
+
+def test_memory_does_not_grow():
+    history = SignalHistory()
+    history.add(0, snr=1, rssi=-80, hops=1)
+    size = _size(history)
+    for i in range(10000):
+        history.add(i, snr=1, rssi=-80, hops=1)
+    assert _size(history) == size
+    assert not hasattr(history, "__dict__")
+    assert size < 1200
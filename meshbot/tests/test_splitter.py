@@ -0,0 +1,111 @@
+import random
+
+from meshbot.meshwrapper import splitter
+from meshbot.meshwrapper.splitter import split_message
+
+# Building blocks for random messages, including emoji sequences that must
+# never be split
+GRAPHEMES = [
+    "🤖",
+    "e\u0301",  # e with a combining accent
+    "👍🏽",
+    "👩‍👩‍👧‍👦",
+    "🇳🇱",
+    "🏳️‍🌈",
+    "1️⃣",
+]
+PIECES = [
+    "a",
+    "word",
+    "Meshtastic",
+    " ",
+    " ",
+    "\n",
+    "ß",
+    "日本語",
+    "x" * 300,
+] + GRAPHEMES
+
+
+def _random_message(rng):
+    return "".join(rng.choice(PIECES) for _ in range(rng.randint(1, 400)))
+
+
+def _content(parts):
+    # Strip the numbering and all whitespace, which the splitter may drop
+    if len(parts) > 1:
+        parts = [part.rsplit(" [", 1)[0] for part in parts]
+    return "".join("".join(parts).split())
+
+
+def test_parts_fit_and_keep_the_content():
+    rng = random.Random(1234)
+    for _ in range(300):
+        message = _random_message(rng)
+        size = rng.choice([40, 100, 234])
+        parts = split_message(message, size)
+
+        assert parts, "Every message has at least one part"
+        assert all(len(part.encode("utf-8")) <= size for part in parts)
+        assert _content(parts) == "".join(message.split())
+        if len(parts) > 1:
+            assert [part.rsplit(" ", 1)[1] for part in parts] == [
+                f"[{i}/{len(parts)}]" for i in range(1, len(parts) + 1)
+            ]
+
+
+def test_long_whitespace_still_makes_a_part():
+    assert split_message(" \n" * 200, 40) == [""]
+
+
+def test_emoji_sequences_are_never_split():
+    rng = random.Random(5678)
+    for _ in range(300):
+        message = "".join(rng.choice(GRAPHEMES) for _ in range(rng.randint(1, 200)))
+        parts = split_message(message, rng.choice([40, 100, 234]))
+        if len(parts) > 1:
+            parts = [part.rsplit(" [", 1)[0] for part in parts]
+
+        # Every part consists of whole graphemes only
+        for part in parts:
+            rest = part
+            while rest:
+                grapheme = next(g for g in GRAPHEMES if rest.startswith(g))
+                rest = rest[len(grapheme) :]
+
+
+def test_many_parts_are_numbered_correctly():
+    parts = split_message("word " * 1000, 60)
+
+    assert len(parts) > 99
+    assert parts[0].endswith(f" [1/{len(parts)}]")
+    assert parts[-1].endswith(f" [{len(parts)}/{len(parts)}]")
+    assert all(len(part.encode("utf-8")) <= 60 for part in parts)
+
+
+def test_prefers_to_split_at_the_end_of_a_line():
+    parts = split_message("first line\n" + "word " * 60, 234)
+
+    assert parts[0].startswith("first line\nword")
+    assert split_message("a" * 100 + "\n" + "b" * 200, 234)[0] == "a" * 100 + " [1/2]"
+
+
+def test_splitting_takes_linear_time(monkeypatch):
+    calls = []
+    for name in ("_codepoint_at", "_codepoint_start"):
+        function = getattr(splitter, name)
+        monkeypatch.setattr(
+            splitter,
+            name,
+            lambda *args, function=function: calls.append(1) or function(*args),
+        )
+
+    def cost(text):
+        calls.clear()
+        split_message(text, 234)
+        return len(calls)
+
+    # No spaces, so every cut has to look for the end of an emoji sequence
+    text = "🤖👍🏽🇳🇱👩‍👩‍👧‍👦" * 500
+    assert cost(text * 2) <= cost(text) * 2.1
+    assert cost(text) > 0
@@ -0,0 +1,304 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from meshbot.meshwrapper.transmitter import (
+    BROADCAST,
+    BULK,
+    RoundTripTime,
+    TokenBucket,
+    Transmitter,
+)
+
+
+class FakeInterface:
+    def __init__(self):
+        self.sent = []
+
+    def sendText(self, text, destinationId, wantAck, onResponse, **kwargs):
+        packet = SimpleNamespace(id=len(self.sent) + 1)
+        self.sent.append((packet.id, destinationId, text))
+        return packet
+
+
+def fake_node(id, interface, hopsAway=0):
+    return SimpleNamespace(id=id, interface=interface, hopsAway=hopsAway)
+
+
+def ack(transmitter, packet_id, error="NONE"):
+    transmitter.onAckNak(
+        {"decoded": {"requestId": packet_id, "routing": {"errorReason": error}}}
+    )
+
+
+def wait_for(condition, timeout=1):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "Timed out waiting for the transmitter"
+        time.sleep(0.001)
+
+
+def test_send_does_not_block_and_resolves_on_ack():
+    interface = FakeInterface()
+    transmitter = Transmitter(timeout=10)
+
+    delivery = transmitter.send(fake_node("!00000001", interface), ["one", "two"])
+    assert not delivery.done()
+
+    wait_for(lambda: len(interface.sent) == 1)
+    ack(transmitter, 1)
+    wait_for(lambda: len(interface.sent) == 2)
+    assert not delivery.done()
+    ack(transmitter, 2)
+
+    assert delivery.result(timeout=1) is True
+    assert [text for _, _, text in interface.sent] == ["one", "two"]
+
+
+def test_nothing_to_send():
+    interface = FakeInterface()
+    transmitter = Transmitter(timeout=10)
+
+    assert transmitter.send(fake_node("!00000001", interface), []).result() is True
+    assert transmitter.queued() == 0
+
+
+def test_worker_survives_a_broken_transmission():
+    interface = FakeInterface()
+    transmitter = Transmitter(timeout=10)
+    node = fake_node("!00000001", interface)
+
+    broken = transmitter.send(node, [None])
+    delivery = transmitter.send(node, ["one"])
+
+    assert broken.result(timeout=1) is False
+    wait_for(lambda: len(interface.sent) == 1)
+    ack(transmitter, 1)
+    assert delivery.result(timeout=1) is True
+
+
+def test_destinations_are_pipelined():
+    interface = FakeInterface()
+    transmitter = Transmitter(timeout=10)
+
+    first = transmitter.send(fake_node("!00000001", interface), ["a1", "a2"])
+    second = transmitter.send(fake_node("!00000002", interface), ["b1"])
+    third = transmitter.send(fake_node("!00000001", interface), ["a3"])
+
+    # Both destinations get their first packet out before any ACK arrives
+    wait_for(lambda: len(interface.sent) == 2)
+    assert {dest for _, dest, _ in interface.sent} == {"!00000001", "!00000002"}
+
+    ack(transmitter, next(id for id, _, text in interface.sent if text == "b1"))
+    assert second.result(timeout=1) is True
+
+    ack(transmitter, next(id for id, _, text in interface.sent if text == "a1"))
+    wait_for(lambda: len(interface.sent) == 3)
+    ack(transmitter, 3)
+    wait_for(lambda: len(interface.sent) == 4)
+    ack(transmitter, 4)
+
+    assert first.result(timeout=1) and third.result(timeout=1)
+    assert [text for _, dest, text in interface.sent if dest == "!00000001"] == [
+        "a1",
+        "a2",
+        "a3",
+    ]
+
+
+def test_nak_fails_message_and_skips_remaining_parts():
+    interface = FakeInterface()
+    transmitter = Transmitter(timeout=10)
+
+    failed = transmitter.send(fake_node("!00000001", interface), ["one", "two"])
+    next_message = transmitter.send(fake_node("!00000001", interface), ["three"])
+
+    wait_for(lambda: len(interface.sent) == 1)
+    ack(transmitter, 1, error="MAX_RETRANSMIT")
+    assert failed.result(timeout=1) is False
+
+    wait_for(lambda: len(interface.sent) == 2)
+    assert interface.sent[1][2] == "three"
+    ack(transmitter, 2)
+    assert next_message.result(timeout=1) is True
+
+
+def test_timeout():
+    interface = FakeInterface()
+    transmitter = Transmitter(timeout=0.05, retries=0)
+
+    delivery = transmitter.send(fake_node("!00000001", interface), ["one"])
+    assert delivery.result(timeout=1) is False
+
+    # A late ACK is ignored
+    ack(transmitter, 1)
+    assert transmitter.queued() == 0
+
+
+def test_interactive_replies_go_before_bulk():
+    interface = FakeInterface()
+    transmitter = Transmitter(timeout=10, duty_cycle=1, burst=1)
+    transmitter._airtime = lambda transmission: 0.1
+    transmitter._bucket.tokens = 0
+
+    bulk = transmitter.send(fake_node("!00000001", interface), ["bulk"], priority=BULK)
+    reply = transmitter.send(fake_node("!00000002", interface), ["reply"])
+
+    wait_for(lambda: len(interface.sent) == 1)
+    assert interface.sent[0][2] == "reply"
+    ack(transmitter, 1)
+    assert reply.result(timeout=1) is True
+
+    # Bulk traffic waits until there's air-time to spare for interactive replies
+    assert not bulk.done()
+    wait_for(lambda: len(interface.sent) == 2, timeout=2)
+    ack(transmitter, 2)
+    assert bulk.result(timeout=1) is True
+
+
+def test_duty_cycle_limits_transmissions():
+    interface = FakeInterface()
+    transmitter = Transmitter(timeout=10, duty_cycle=1, burst=0.25)
+    transmitter._airtime = lambda transmission: 0.1
+
+    start = time.monotonic()
+    delivery = transmitter.send(fake_node("!00000001", interface), ["a", "b", "c", "d"])
+    for packet_id in range(1, 5):
+        wait_for(lambda: len(interface.sent) == packet_id)
+        ack(transmitter, packet_id)
+    assert delivery.result(timeout=1) is True
+
+    # The burst covers two parts, the other two have to wait for air-time
+    assert time.monotonic() - start >= 0.14
+
+
+def test_channel_utilization_lowers_the_rate():
+    transmitter = Transmitter(duty_cycle=0.1)
+    transmitter.set_channel_utilization(50)
+    assert transmitter._bucket.rate == pytest.approx(0.05)
+
+    # Never stop transmitting altogether
+    transmitter.set_channel_utilization(100)
+    assert transmitter._bucket.rate == pytest.approx(0.01)
+
+
+def test_token_bucket():
+    bucket = TokenBucket(rate=2, capacity=1)
+    bucket.take(1.5)
+    assert 0.7 < bucket.time_until(1) <= 0.75
+    assert bucket.time_until(-0.5) == 0
+
+
+def test_unacknowledged_parts_are_sent_again_with_backoff():
+    interface = FakeInterface()
+    transmitter = Transmitter(timeout=0.05, retries=2)
+
+    start = time.monotonic()
+    delivery = transmitter.send(fake_node("!00000001", interface), ["one"])
+    wait_for(lambda: len(interface.sent) == 3)
+    # Waited 0.05 and then 0.1 seconds before trying again
+    assert time.monotonic() - start >= 0.15
+    ack(transmitter, 3)
+
+    assert delivery.result(timeout=1) is True
+    assert [text for _, _, text in interface.sent] == ["one", "one", "one"]
+
+
+def test_late_ack_for_an_earlier_copy_is_accepted():
+    interface = FakeInterface()
+    transmitter = Transmitter(timeout=0.1, retries=2)
+
+    delivery = transmitter.send(fake_node("!00000001", interface), ["one", "two"])
+    wait_for(lambda: len(interface.sent) == 2)
+    # The ACK for the first copy arrives after we sent it again
+    ack(transmitter, 1)
+    wait_for(lambda: len(interface.sent) == 3)
+    ack(transmitter, 2)
+    ack(transmitter, 3)
+
+    assert delivery.result(timeout=1) is True
+    time.sleep(0.2)
+    assert [text for _, _, text in interface.sent] == ["one", "one", "two"]
+
+
+def test_nak_for_an_earlier_copy_is_ignored():
+    interface = FakeInterface()
+    transmitter = Transmitter(timeout=0.1, retries=2)
+
+    delivery = transmitter.send(fake_node("!00000001", interface), ["one"])
+    wait_for(lambda: len(interface.sent) == 2)
+    ack(transmitter, 1, error="MAX_RETRANSMIT")
+    assert not delivery.done()
+    ack(transmitter, 2)
+
+    assert delivery.result(timeout=1) is True
+
+
+def test_broadcasts_are_not_sent_again():
+    interface = FakeInterface()
+    transmitter = Transmitter(timeout=0.05, retries=2)
+
+    delivery = transmitter.send(fake_node(BROADCAST, interface), ["one"])
+
+    assert delivery.result(timeout=1) is False
+    time.sleep(0.2)
+    assert len(interface.sent) == 1
+
+
+def test_timeout_depends_on_hops_and_round_trip_times():
+    interface = FakeInterface()
+    transmitter = Transmitter(timeout=5)
+
+    assert transmitter.timeout_for(fake_node("!00000001", interface)) == 5
+    assert transmitter.timeout_for(fake_node("!00000002", interface, 3)) == 20
+
+    node = fake_node("!00000001", interface)
+    transmitter.send(node, ["one"])
+    wait_for(lambda: len(interface.sent) == 1)
+    ack(transmitter, 1)
+
+    # The ACK came back right away, so we don't need to wait long anymore
+    assert transmitter.timeout_for(node) == 1
+
+
+def test_round_trip_time():
+    round_trip = RoundTripTime()
+    assert round_trip.timeout() is None
+
+    round_trip.sample(2)
+    assert round_trip.timeout() == 2 + 4 * 1
+
+    for _ in range(50):
+        round_trip.sample(2)
+    assert 2 < round_trip.timeout() < 2.1
+
+
+def test_interactive_replies_go_before_bulk_for_the_same_node():
+    interface = FakeInterface()
+    transmitter = Transmitter(timeout=10)
+    node = fake_node("!00000001", interface)
+
+    bulk = transmitter.send(node, ["bulk 1", "bulk 2"], priority=BULK)
+    queued = transmitter.send(node, ["queued"], priority=BULK)
+    wait_for(lambda: len(interface.sent) == 1)
+
+    # The part that is underway is finished first, then the reply goes ahead
+    # of the rest of the bulk messages
+    reply = transmitter.send(node, ["reply"])
+    ack(transmitter, 1)
+    wait_for(lambda: len(interface.sent) == 2)
+    ack(transmitter, 2)
+    assert reply.result(timeout=1) is True
+    assert not bulk.done()
+
+    for packet_id in (3, 4):
+        wait_for(lambda: len(interface.sent) == packet_id, timeout=2)
+        ack(transmitter, packet_id)
+    assert bulk.result(timeout=1) and queued.result(timeout=1)
+    assert [text for _, _, text in interface.sent] == [
+        "bulk 1",
+        "reply",
+        "bulk 2",
+        "queued",
+    ]
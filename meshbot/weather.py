@@ -1,6 +1,9 @@
-from .meshwrapper import Message
+import time
+
+from .meshwrapper import Message, Nodelist
 from .chatbot import Chatbot
-from .open_meteo import fetch_weather, fetch_forecast
+from . import reply_budget
+from .open_meteo import fetch_weather, fetch_forecast, prewarm
 
 
 def register(bot: Chatbot):
@@ -13,9 +16,9 @@ def register(bot: Chatbot):
             "function": get_weather,
         },
         {
-            "command": "/FORECAST",
+            "prefix": "/FORECAST",
             "module": "🌂 Weather requests",
-            "description": "Get a weather forecast",
+            "description": "/FORECAST [COMPACT]: Get a weather forecast",
             "channel": True,
             "function": get_forecast,
         },
@@ -55,8 +58,39 @@ def get_forecast(message: Message):
         )
         return
 
-    forecast = fetch_forecast(position)
+    compact = "COMPACT" in message.text.upper().split()[1:]
+    forecast = fetch_forecast(position, compact)
+    reply = f"🤖🌂 {location_text}\n\n{forecast}"
+
+    # Don't hog the channel with the full forecast if it takes too many packets
+    if (
+        forecast
+        and not compact
+        and not reply_budget.fits(reply, message.nodelist.interface)
+    ):
+        forecast = fetch_forecast(position, compact=True)
+        reply = f"🤖🌂 {location_text}\n\n{forecast}"
+
     if forecast:
-        message.reply(f"🤖🌂 {location_text}\n\n{forecast}")
+        message.reply(reply)
     else:
         message.reply(f"🤖🌂 I can't get a weather forecast at this time.")
+
+
+def prewarm_cache(nodelist: Nodelist, interval: float, active_within: float = 60 * 60):
+    """
+    Refresh the weather cache for all nodes with a known position that we have
+    heard from recently, so their `/WEATHER` and `/FORECAST` requests can be
+    answered from cache. Meant to be called every `interval` seconds.
+    """
+    recent = time.time() - active_within
+    nodes = [
+        node
+        for node in nodelist.nodes.values()
+        if node.position and (node.lastHeard or 0) >= recent
+    ]
+    # The cache may not fit them all, so the most recently heard go first
+    nodes.sort(key=lambda node: node.lastHeard, reverse=True)
+    positions = [node.position for node in nodes]
+    if positions:
+        prewarm(positions, refresh_within=interval)